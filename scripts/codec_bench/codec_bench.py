@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+CODEC_BENCH. Measures the stored size and encode/decode time of queue payload codecs.
+
+Payloads are read as one JSON document per line from the given files - for instance tweet blobs
+dumped with `tweet.AsJsonString()` - or, if no files are given, a synthetic tweet shaped payload
+is used.
+
+.. code-block:: console
+
+   $ ./dist/codec_bench.pex tweets.jsonl
+   $ ./dist/codec_bench.pex --compress-above 512 --compress-above 1024
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import sys
+import time
+
+from skrode.codec import Codec
+
+
+args = argparse.ArgumentParser()
+args.add_argument("--rounds",
+                  dest="rounds",
+                  default=1000,
+                  type=int,
+                  help="Number of times each payload is encoded and decoded")
+args.add_argument("--compress-above",
+                  dest="thresholds",
+                  action="append",
+                  type=int,
+                  help="Compression thresholds in bytes to compare, by default 512")
+args.add_argument("payloads",
+                  nargs="*",
+                  help="Files of JSON payloads, one per line")
+
+
+# Roughly the size and shape of an extended tweet from the REST API
+SAMPLE_TWEET = {
+  "created_at": "Sun Jul 30 00:00:00 +0000 2017",
+  "id": 891466283484573697,
+  "id_str": "891466283484573697",
+  "full_text": "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor "
+               "incididunt ut labore et dolore magna aliqua. https://t.co/abcdefghij",
+  "truncated": False,
+  "display_text_range": [0, 140],
+  "entities": {
+    "hashtags": [],
+    "symbols": [],
+    "user_mentions": [{"screen_name": "arrdem", "name": "Reid McKenzie",
+                       "id": 389468789, "id_str": "389468789", "indices": [0, 7]}],
+    "urls": [{"url": "https://t.co/abcdefghij", "expanded_url": "https://example.com/post",
+              "display_url": "example.com/post", "indices": [117, 140]}],
+  },
+  "source": "<a href=\"http://twitter.com\" rel=\"nofollow\">Twitter Web Client</a>",
+  "in_reply_to_status_id": None,
+  "in_reply_to_user_id": None,
+  "in_reply_to_screen_name": None,
+  "user": {
+    "id": 883521901670178818,
+    "id_str": "883521901670178818",
+    "name": "ArrdemSays",
+    "screen_name": "arrdemsays",
+    "location": "",
+    "description": "Lorem ipsum dolor sit amet",
+    "url": None,
+    "protected": False,
+    "followers_count": 12,
+    "friends_count": 34,
+    "listed_count": 0,
+    "created_at": "Sat Jul 08 04:00:00 +0000 2017",
+    "favourites_count": 56,
+    "verified": False,
+    "statuses_count": 789,
+    "lang": "en",
+    "profile_image_url_https": "https://pbs.twimg.com/profile_images/1/abc_normal.jpg",
+  },
+  "geo": None,
+  "coordinates": None,
+  "place": None,
+  "is_quote_status": False,
+  "retweet_count": 3,
+  "favorite_count": 14,
+  "favorited": False,
+  "retweeted": False,
+  "possibly_sensitive": False,
+  "lang": "en",
+}
+
+
+def load_payloads(files):
+  if not files:
+    return [SAMPLE_TWEET]
+
+  payloads = []
+  for path in files:
+    with open(path) as f:
+      payloads.extend(json.loads(line) for line in f if line.strip())
+  return payloads
+
+
+def run_codec(codec, payloads, rounds):
+  """Returns the mean stored bytes, encode and decode microseconds of a payload."""
+
+  encoded = [codec.encode(payload) for payload in payloads]
+  size = sum(len(data) for data in encoded) / len(encoded)
+
+  begin = time.perf_counter()
+  for _ in range(rounds):
+    for payload in payloads:
+      codec.encode(payload)
+  encode = (time.perf_counter() - begin) / (rounds * len(payloads))
+
+  begin = time.perf_counter()
+  for _ in range(rounds):
+    for data in encoded:
+      codec.decode(data)
+  decode = (time.perf_counter() - begin) / (rounds * len(payloads))
+
+  return size, encode * 1e6, decode * 1e6
+
+
+def main(opts):
+  payloads = load_payloads(opts.payloads)
+  configs = [("json", None), ("msgpack", None)]
+  for threshold in opts.thresholds or [512]:
+    configs.extend([("json", threshold), ("msgpack", threshold)])
+
+  print("%8s %14s %10s %10s %10s" % ("codec", "compress above", "bytes", "encode us", "decode us"))
+  for name, threshold in configs:
+    size, encode, decode = run_codec(Codec(name, compress_above=threshold), payloads, opts.rounds)
+    print("%8s %14s %10.1f %10.2f %10.2f" % (name, "-" if threshold is None else threshold,
+                                             size, encode, decode))
+
+
+if __name__ == "__main__":
+  main(args.parse_args(sys.argv[1:]))
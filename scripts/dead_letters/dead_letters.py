@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+DEAD_LETTERS. Inspects and requeues the dead letters of a configured work queue.
+
+The queue is named by its key in the config file, with dots separating nested keys. It must be a
+`!skrode/queue` with a `dead_letter` key.
+
+.. code-block:: console
+
+   $ ./dist/dead_letters.pex -c config.yml tweet_id_queue list --limit 20
+   $ ./dist/dead_letters.pex -c config.yml tweet_id_queue requeue
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import sys
+
+from skrode.config import Config
+
+
+args = argparse.ArgumentParser()
+args.add_argument("-c", "--config",
+                  dest="config",
+                  default="config.yml")
+args.add_argument("queue",
+                  help="The config key of the queue, eg. tweet_id_queue")
+
+commands = args.add_subparsers(dest="command")
+commands.required = True
+
+list_args = commands.add_parser("list")
+list_args.add_argument("-l", "--limit",
+                       dest="limit",
+                       default=100,
+                       type=int)
+
+requeue_args = commands.add_parser("requeue")
+requeue_args.add_argument("-n", "--count",
+                          dest="count",
+                          default=None,
+                          type=int,
+                          help="Number of dead letters to requeue, by default all of them")
+requeue_args.add_argument("-p", "--priority",
+                          dest="priority",
+                          default=0,
+                          type=int)
+
+
+def main(opts):
+  queue = Config(config=opts.config)
+  for key in opts.queue.split("."):
+    queue = queue.get(key)
+
+  if queue is None or not hasattr(queue, "dead_letters"):
+    print("%s is not a work queue with dead letters" % (opts.queue,), file=sys.stderr)
+    return 1
+
+  if opts.command == "list":
+    for idx, value, error in queue.dead_letters(limit=opts.limit):
+      print("%d\t%r\t%s" % (idx, value, error or ""))
+
+  else:
+    print("Requeued %d dead letters" % queue.requeue_dead_letters(n=opts.count,
+                                                                 priority=opts.priority))
+
+
+if __name__ == "__main__":
+  sys.exit(main(args.parse_args(sys.argv[1:])))
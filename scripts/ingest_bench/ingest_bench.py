@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+INGEST_BENCH. Measures how fast tweets are inserted into the configured SQL database.
+
+Inserts synthetic tweets, each by one of a pool of users, mentioning a few others and replying to
+an earlier tweet, with `insert_tweet`. The tweets are first inserted one commit per helper call as
+the helpers do on their own, and then within a unit of work of each of the given batch sizes. Each
+run reports tweets per second, and the commits and SQL statements made per tweet.
+
+Every run inserts new tweets, so the database grows with every run. Point this at a scratch
+database.
+
+.. code-block:: console
+
+   $ ./dist/ingest_bench.pex -c bench.yml --tweets 2000 10 100 1000
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import random
+import sys
+import time
+
+from skrode.config import Config
+from skrode.services.twitter import insert_tweet
+from skrode.unit_of_work import UnitOfWork
+
+from sqlalchemy import event
+from twitter.models import Status
+
+
+args = argparse.ArgumentParser()
+args.add_argument("-c", "--config",
+                  dest="config",
+                  default="config.yml")
+args.add_argument("--tweets",
+                  dest="tweets",
+                  default=1000,
+                  type=int,
+                  help="Number of tweets inserted by each run")
+args.add_argument("--users",
+                  dest="users",
+                  default=200,
+                  type=int,
+                  help="Number of distinct users posting and mentioned")
+args.add_argument("batch_sizes",
+                  nargs="*",
+                  default=[10, 100, 1000],
+                  type=int,
+                  help="Unit of work batch sizes to compare with committing every call")
+
+
+def _tweet(opts, tweet_id, first_id):
+  user_ids = random.sample(range(1, opts.users + 1), 4)
+  reply_to = random.randint(first_id, tweet_id - 1) if tweet_id > first_id else None
+  return Status.NewFromJsonDict({
+    "id": tweet_id,
+    "id_str": str(tweet_id),
+    "created_at": time.strftime("%a %b %d %H:%M:%S +0000 %Y", time.gmtime()),
+    "full_text": "Lorem ipsum dolor sit amet, consectetur adipiscing elit",
+    "user": {"id": user_ids[0], "screen_name": "user%d" % user_ids[0],
+             "name": "User %d" % user_ids[0]},
+    "entities": {"user_mentions": [{"id": user_id, "screen_name": "user%d" % user_id}
+                                   for user_id in user_ids[1:]]},
+    "in_reply_to_status_id": reply_to,
+  })
+
+
+def run(opts, session, first_id, batch_size=None):
+  """Insert a run of tweets, returning tweets per second and commits and statements per tweet."""
+
+  counts = {"commits": 0, "statements": 0}
+
+  def _commit(session):
+    counts["commits"] += 1
+
+  def _statement(*args):
+    counts["statements"] += 1
+
+  tweets = [_tweet(opts, tweet_id, first_id)
+            for tweet_id in range(first_id, first_id + opts.tweets)]
+
+  event.listen(session, "after_commit", _commit)
+  event.listen(session.bind, "before_cursor_execute", _statement)
+  try:
+    begin = time.time()
+    if batch_size is None:
+      for tweet in tweets:
+        insert_tweet(session, None, tweet)
+    else:
+      with UnitOfWork(session, size=batch_size, interval=60) as uow:
+        for tweet in tweets:
+          insert_tweet(session, None, tweet)
+          uow.done()
+    elapsed = time.time() - begin
+  finally:
+    event.remove(session, "after_commit", _commit)
+    event.remove(session.bind, "before_cursor_execute", _statement)
+
+  return (opts.tweets / elapsed,
+          counts["commits"] / float(opts.tweets),
+          counts["statements"] / float(opts.tweets))
+
+
+def main(opts):
+  session = Config(config=opts.config).get("sql")
+
+  # Tweet IDs from the clock, so that every run inserts new tweets
+  first_id = int(time.time() * 1000) << 20
+
+  print("%10s %12s %14s %16s" % ("batch", "tweets/sec", "commits/tweet", "statements/tweet"))
+  for batch_size in [None] + opts.batch_sizes:
+    rate, commits, statements = run(opts, session, first_id, batch_size)
+    print("%10s %12.1f %14.3f %16.2f" % (batch_size or "-", rate, commits, statements))
+    first_id += opts.tweets
+
+
+if __name__ == "__main__":
+  main(args.parse_args(sys.argv[1:]))
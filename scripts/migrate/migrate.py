@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+MIGRATE. Creates any missing tables and indices of the schema in the configured SQL database.
+
+Tables made by older versions also get the unique constraints which bulk upserts rely on. Any
+duplicate rows are deleted first, keeping one of each. If a constrained column holds NULLs this
+stops with an error naming the table, without changing it, as those rows must be fixed by hand.
+
+An older post table also gets its text search column and the trigger which maintains it, and the
+search vectors of its posts are filled in. Indices are added to existing tables too, after
+installing the `pg_trgm` extension which the name index needs. Workers only create missing tables
+when they start, or nothing if their `!skrode/sql` node sets `create_schema: false`, so this should
+be run after each upgrade.
+
+.. code-block:: console
+
+   $ ./dist/migrate.pex -c config.yml
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import sys
+
+from skrode.config import Config, disable_schema_checks
+from skrode.schema import Base
+from skrode.sql import migrate
+
+from sqlalchemy import inspect
+
+
+args = argparse.ArgumentParser()
+args.add_argument("-c", "--config",
+                  dest="config",
+                  default="config.yml")
+
+
+def main(opts):
+  # Otherwise loading the config would migrate the database, leaving nothing to report
+  disable_schema_checks()
+  engine = Config(config=opts.config).get("sql").bind
+
+  existing = set(inspect(engine).get_table_names())
+  changes = migrate(engine)
+  for table in sorted(set(Base.metadata.tables) - existing):
+    print("Created table", table)
+  for change in changes:
+    print(change)
+
+
+if __name__ == "__main__":
+  main(args.parse_args(sys.argv[1:]))
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+NAME_BENCH. Measures `whois` persona lookup latency over a large name table.
+
+Fills the configured SQL database with `--names` synthetic names, spread over accounts and
+personas of a benchmark service, then times `personas_by_name` for a sample of queries in each
+search mode. Each mode is timed with the trigram index of names, and again with the index dropped
+inside a transaction which is then rolled back, to show what the index buys.
+
+The names are left in place, so later runs with `--names 0` time lookups without refilling. Point
+this at a scratch database.
+
+.. code-block:: console
+
+   $ ./dist/name_bench.pex -c bench.yml --names 1000000
+   $ ./dist/name_bench.pex -c bench.yml --names 0 --queries 200 prefix similar
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import random
+import string
+import sys
+import time
+import uuid
+
+from skrode import schema
+from skrode.config import Config
+from skrode.personas import NAME_MODES, personas_by_name
+from skrode.services import mk_service
+
+
+args = argparse.ArgumentParser()
+args.add_argument("-c", "--config",
+                  dest="config",
+                  default="config.yml")
+args.add_argument("--names",
+                  dest="names",
+                  default=1000000,
+                  type=int,
+                  help="Number of names to add before timing lookups")
+args.add_argument("--queries",
+                  dest="queries",
+                  default=100,
+                  type=int,
+                  help="Number of lookups timed in each mode")
+args.add_argument("--chunk",
+                  dest="chunk",
+                  default=10000,
+                  type=int,
+                  help="Number of rows per INSERT while filling")
+args.add_argument("modes",
+                  nargs="*",
+                  default=NAME_MODES,
+                  choices=NAME_MODES)
+
+
+insert_bench_service = mk_service("namebench", [])
+
+_SYLLABLES = ["ar", "dem", "rei", "mck", "en", "zie", "ka", "to", "li", "sa", "mo", "ra", "vi",
+              "an", "el", "jo", "be", "th", "or", "us"]
+
+
+def _name(rand):
+  name = "".join(rand.choice(_SYLLABLES) for _ in range(rand.randint(2, 5)))
+  if rand.random() < 0.5:
+    name = "@" + name + "".join(rand.choice(string.digits) for _ in range(rand.randint(0, 4)))
+  else:
+    name = name.capitalize()
+  return name
+
+
+def fill(opts, session, rand):
+  """Add `opts.names` names, two per account and two accounts per persona."""
+
+  service_id = insert_bench_service(session).id
+  session.commit()
+
+  for start in range(0, opts.names, opts.chunk):
+    count = min(opts.chunk, opts.names - start)
+    personas = [{"id": uuid.uuid4()} for _ in range((count + 3) // 4)]
+    accounts = [{"id": uuid.uuid4(),
+                 "external_id": "namebench+user:%s" % (uuid.uuid4(),),
+                 "service_id": service_id,
+                 "persona_id": personas[i // 2]["id"]}
+                for i in range((count + 1) // 2)]
+    names = [{"id": uuid.uuid4(),
+              "name": _name(rand),
+              "account_id": accounts[i // 2]["id"]}
+             for i in range(count)]
+    for first, second in zip(names[::2], names[1::2]):
+      # An account's names must differ
+      if first["name"] == second["name"]:
+        second["name"] += "_"
+
+    session.execute(schema.Persona.__table__.insert().values(personas))
+    session.execute(schema.Account.__table__.insert().values(accounts))
+    session.execute(schema.Name.__table__.insert().values(names))
+    session.commit()
+    print("Filled %d names" % (start + count,), file=sys.stderr)
+
+  session.execute("ANALYZE name")
+  session.commit()
+
+
+def _percentile(latencies, p):
+  return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+def time_lookups(opts, session, mode, queries):
+  """Time `personas_by_name` for every query, returning the p50 and p99 latency in ms."""
+
+  latencies = []
+  for query in queries:
+    begin = time.time()
+    personas_by_name(session, query, mode=mode, limit=3)
+    latencies.append(time.time() - begin)
+
+  latencies.sort()
+  return _percentile(latencies, 0.50) * 1000, _percentile(latencies, 0.99) * 1000
+
+
+def main(opts):
+  session = Config(config=opts.config).get("sql")
+  rand = random.Random(0)
+
+  if opts.names:
+    fill(opts, session, rand)
+
+  total = session.query(schema.Name).count()
+  sample = [name for name, in session.query(schema.Name.name)
+                                     .order_by(schema.Name.id)
+                                     .limit(opts.queries)]
+  queries = {
+    "exact": sample,
+    "prefix": [name[:4] for name in sample],
+    "contains": [name[1:5] for name in sample],
+    # Misspelt, by dropping a character
+    "similar": [name[:3] + name[4:] for name in sample],
+  }
+
+  print("%d names" % (total,))
+  print("%10s %8s %10s %10s" % ("mode", "index", "p50 ms", "p99 ms"))
+  for mode in opts.modes:
+    p50, p99 = time_lookups(opts, session, mode, queries[mode])
+    print("%10s %8s %10.2f %10.2f" % (mode, "trgm", p50, p99))
+
+    # DDL is transactional in Postgres, so the index comes back on rollback
+    session.execute("DROP INDEX ix_name_name_trgm")
+    try:
+      p50, p99 = time_lookups(opts, session, mode, queries[mode])
+    finally:
+      session.rollback()
+    print("%10s %8s %10.2f %10.2f" % (mode, "none", p50, p99))
+
+
+if __name__ == "__main__":
+  main(args.parse_args(sys.argv[1:]))
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+QUEUE_BENCH. Measures work queue throughput and storage costs.
+
+The `throughput` benchmark forks each requested number of producer processes, which all push onto
+the same queue key at once, and reports the aggregate puts per second.
+
+The `memory` benchmark fills a queue with tweet ID sized values using both the flat one key per
+element layout and the segmented layout, and reports the Redis memory and key count of each.
+
+The `suite` benchmark runs every combination of producer count, consumer count and payload size
+against both the `Producer`/`Consumer` pair and `WorkQueue`, with a thread and connection per
+worker. It reports put and get operations per second and the p50 and p99 latency of each
+operation, and with `--json` writes its results as JSON lines so that runs on different commits
+can be compared. With `--fake`, it runs against an in-process fakeredis server instead of Redis.
+
+The `window` benchmark drains a queue through a `Consumer` with each requested claim window, and
+reports the Redis commands and round trips made per item processed. A window of 1 claims and
+acknowledges every item on its own; larger windows claim several items and acknowledge them
+together.
+
+The queues make every change with a single Lua script rather than retrying WATCH transactions, so
+there are no WatchError retries to count; contention shows up as latency instead.
+
+The target Redis database is flushed before every run, so point this at a scratch db.
+
+.. code-block:: console
+
+   $ ./dist/queue_bench.pex --db 15 throughput --ops 10000 1 4 16
+   $ ./dist/queue_bench.pex --db 15 memory --items 1000000
+   $ ./dist/queue_bench.pex --db 15 suite --json results.jsonl --label $(git rev-parse HEAD)
+   $ ./dist/queue_bench.pex --db 15 window --items 10000 1 10 100
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+from multiprocessing import Event, Process
+import sys
+from threading import Thread
+import time
+
+from skrode.redis.workqueue import Consumer, Producer, WorkQueue
+
+from redis import StrictRedis
+
+
+args = argparse.ArgumentParser()
+args.add_argument("--host",
+                  dest="host",
+                  default="localhost")
+args.add_argument("--port",
+                  dest="port",
+                  default=6379,
+                  type=int)
+args.add_argument("--db",
+                  dest="db",
+                  default=15,
+                  type=int)
+args.add_argument("--key",
+                  dest="key",
+                  default="/bench/queue")
+
+benchmarks = args.add_subparsers(dest="benchmark")
+benchmarks.required = True
+
+throughput_args = benchmarks.add_parser("throughput")
+throughput_args.add_argument("--ops",
+                             dest="ops",
+                             default=10000,
+                             type=int,
+                             help="Number of puts made by each producer")
+throughput_args.add_argument("producers",
+                             nargs="*",
+                             default=[1, 4, 16],
+                             type=int)
+
+memory_args = benchmarks.add_parser("memory")
+memory_args.add_argument("--items",
+                         dest="items",
+                         default=1000000,
+                         type=int)
+memory_args.add_argument("segment_sizes",
+                         nargs="*",
+                         default=[0, 128],
+                         type=int,
+                         help="Segment sizes to compare, where 0 is one key per element")
+
+suite_args = benchmarks.add_parser("suite")
+suite_args.add_argument("--ops",
+                        dest="ops",
+                        default=2000,
+                        type=int,
+                        help="Number of items put in each run")
+suite_args.add_argument("--producers",
+                        dest="producers",
+                        nargs="+",
+                        default=[1, 4],
+                        type=int)
+suite_args.add_argument("--consumers",
+                        dest="consumers",
+                        nargs="+",
+                        default=[1, 4],
+                        type=int)
+suite_args.add_argument("--payload-sizes",
+                        dest="payload_sizes",
+                        nargs="+",
+                        default=[16, 1024],
+                        type=int)
+suite_args.add_argument("--fake",
+                        dest="fake",
+                        action="store_true",
+                        help="Run against an in-process fakeredis server")
+suite_args.add_argument("--json",
+                        dest="json",
+                        help="A file to append results to as JSON lines, or - for stdout")
+suite_args.add_argument("--label",
+                        dest="label",
+                        help="A label recorded with every result, such as the commit benchmarked")
+
+window_args = benchmarks.add_parser("window")
+window_args.add_argument("--items",
+                         dest="items",
+                         default=10000,
+                         type=int)
+window_args.add_argument("--fake",
+                         dest="fake",
+                         action="store_true",
+                         help="Run against an in-process fakeredis server")
+window_args.add_argument("windows",
+                         nargs="*",
+                         default=[1, 10, 100],
+                         type=int)
+
+
+_FAKE_SERVER = None
+
+
+def _conn(opts):
+  if getattr(opts, "fake", False):
+    # Only needed for in-process runs, so imported here
+    import fakeredis
+
+    global _FAKE_SERVER
+    if _FAKE_SERVER is None:
+      _FAKE_SERVER = fakeredis.FakeServer()
+    return fakeredis.FakeStrictRedis(server=_FAKE_SERVER)
+
+  return StrictRedis(opts.host, port=opts.port, db=opts.db)
+
+
+def _counting(conn):
+  """Instrument a client to count the commands and round trips it makes, including pipelines."""
+
+  conn.commands = conn.round_trips = 0
+  execute_command, pipeline = conn.execute_command, conn.pipeline
+
+  def _execute_command(*args, **kwargs):
+    conn.commands += 1
+    conn.round_trips += 1
+    return execute_command(*args, **kwargs)
+
+  def _pipeline(*args, **kwargs):
+    p = pipeline(*args, **kwargs)
+    execute = p.execute
+
+    def _execute(*args, **kwargs):
+      if p.command_stack:
+        conn.commands += len(p.command_stack)
+        conn.round_trips += 1
+      return execute(*args, **kwargs)
+
+    p.execute = _execute
+    return p
+
+  conn.execute_command = _execute_command
+  conn.pipeline = _pipeline
+  return conn
+
+
+def _produce(opts, start):
+  producer = Producer(_conn(opts), opts.key)
+  start.wait()
+  for i in range(opts.ops):
+    producer.put(str(i))
+
+
+def run_throughput(opts, producers):
+  """Run one round with `producers` concurrent producers, returning the observed puts per second."""
+
+  conn = _conn(opts)
+  conn.flushdb()
+
+  start = Event()
+  children = [Process(target=_produce, args=(opts, start)) for _ in range(producers)]
+  for ps in children:
+    ps.start()
+
+  begin = time.time()
+  start.set()
+  for ps in children:
+    ps.join()
+  elapsed = time.time() - begin
+
+  total = producers * opts.ops
+  assert len(Producer(conn, opts.key)) == total
+  return total / elapsed
+
+
+def run_memory(opts, segment_size):
+  """Fill a queue with the given layout, returning the bytes of Redis memory and keys it used."""
+
+  conn = _conn(opts)
+  conn.flushdb()
+  before = conn.info("memory")["used_memory"]
+
+  producer = Producer(conn, opts.key, segment_size=segment_size)
+  # Roughly the size and shape of a tweet ID
+  first_id = 950000000000000000
+  for chunk in range(0, opts.items, 1000):
+    producer.put_many(str(first_id + i) for i in range(chunk, min(chunk + 1000, opts.items)))
+
+  return conn.info("memory")["used_memory"] - before, conn.dbsize()
+
+
+def _percentile(latencies, p):
+  return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+def _run_threads(workers, target):
+  """Run `target(i, latencies)` on `workers` threads at once, returning the elapsed time and the
+  sorted latencies they recorded."""
+
+  latencies = [[] for _ in range(workers)]
+  threads = [Thread(target=target, args=(i, latencies[i])) for i in range(workers)]
+  begin = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return time.time() - begin, sorted(sum(latencies, []))
+
+
+def _record(api, op, producers, consumers, payload, ops, elapsed, latencies):
+  return {
+    "api": api,
+    "op": op,
+    "producers": producers,
+    "consumers": consumers,
+    "payload": payload,
+    "ops": ops,
+    "ops_per_sec": ops / elapsed,
+    "p50_ms": _percentile(latencies, 0.50) * 1000,
+    "p99_ms": _percentile(latencies, 0.99) * 1000,
+  }
+
+
+def run_suite(opts, api, producers, consumers, payload):
+  """Fill and then drain a queue through the given API, returning a put and a get result."""
+
+  _conn(opts).flushdb()
+  if api == "workqueue":
+    make_writer = make_reader = lambda: WorkQueue(_conn(opts), opts.key)
+    put = lambda queue, value: queue.put(value)
+    get = lambda queue: queue.get()
+  else:
+    make_writer = lambda: Producer(_conn(opts), opts.key)
+    make_reader = lambda: Consumer(_conn(opts), opts.key, "bench_consumer")
+    put = lambda producer, value: producer.put(value)
+
+    def get(consumer):
+      try:
+        return consumer.next()
+      except StopIteration:
+        return None
+
+  value = "x" * payload
+  per_producer = opts.ops // producers
+
+  def _produce(i, latencies):
+    writer = make_writer()
+    for _ in range(per_producer):
+      begin = time.time()
+      put(writer, value)
+      latencies.append(time.time() - begin)
+
+  def _consume(i, latencies):
+    reader = make_reader()
+    while True:
+      begin = time.time()
+      item = get(reader)
+      if item is None:
+        return
+      item.complete()
+      latencies.append(time.time() - begin)
+
+  total = per_producer * producers
+  elapsed, latencies = _run_threads(producers, _produce)
+  puts = _record(api, "put", producers, consumers, payload, total, elapsed, latencies)
+
+  elapsed, latencies = _run_threads(consumers, _consume)
+  assert len(latencies) == total
+  gets = _record(api, "get", producers, consumers, payload, total, elapsed, latencies)
+  return [puts, gets]
+
+
+def run_window(opts, window):
+  """Drain a queue with a consumer claiming `window` items at a time, returning the commands and
+  round trips made per item."""
+
+  conn = _conn(opts)
+  conn.flushdb()
+  Producer(conn, opts.key).put_many(str(i) for i in range(opts.items))
+
+  conn = _counting(_conn(opts))
+  consumer = Consumer(conn, opts.key, "bench_consumer", window=window)
+  processed = 0
+  while True:
+    try:
+      consumer.next().complete()
+    except StopIteration:
+      break
+    processed += 1
+  consumer.flush()
+
+  assert processed == opts.items
+  return conn.commands / processed, conn.round_trips / processed
+
+
+def main(opts):
+  if opts.benchmark == "window":
+    print("%8s %14s %16s" % ("window", "commands/item", "round trips/item"))
+    for window in opts.windows:
+      commands, round_trips = run_window(opts, window)
+      print("%8d %14.3f %16.3f" % (window, commands, round_trips))
+
+  elif opts.benchmark == "suite":
+    out = None
+    if opts.json:
+      out = sys.stdout if opts.json == "-" else open(opts.json, "a")
+
+    print("%10s %4s %10s %10s %8s %12s %10s %10s" % ("api", "op", "producers", "consumers",
+                                                      "payload", "ops/sec", "p50 ms", "p99 ms"),
+          file=sys.stderr if out is sys.stdout else sys.stdout)
+    for api in ["consumer", "workqueue"]:
+      for payload in opts.payload_sizes:
+        for producers in opts.producers:
+          for consumers in opts.consumers:
+            for result in run_suite(opts, api, producers, consumers, payload):
+              print("%(api)10s %(op)4s %(producers)10d %(consumers)10d %(payload)8d "
+                    "%(ops_per_sec)12.1f %(p50_ms)10.3f %(p99_ms)10.3f" % result,
+                    file=sys.stderr if out is sys.stdout else sys.stdout)
+              if out is not None:
+                result["label"] = opts.label
+                out.write(json.dumps(result, sort_keys=True) + "\n")
+
+  elif opts.benchmark == "memory":
+    print("%12s %14s %12s %12s" % ("segment size", "used memory", "bytes/item", "keys"))
+    for segment_size in opts.segment_sizes:
+      used, keys = run_memory(opts, segment_size)
+      print("%12d %14d %12.1f %12d" % (segment_size, used, used / opts.items, keys))
+
+  else:
+    print("%10s %12s" % ("producers", "puts/sec"))
+    for producers in opts.producers:
+      print("%10d %12.1f" % (producers, run_throughput(opts, producers)))
+
+
+if __name__ == "__main__":
+  main(args.parse_args(sys.argv[1:]))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+QUEUE_OFFSETS. Reports and moves the consumer offsets of a configured work queue.
+
+The queue is named by its key in the config file, with dots separating nested keys, and must be a
+`!skrode/queue` using the default sequence backend. `show` lists the offset, lag and in-flight
+count of every consumer registered on each lane of the queue. `seek` moves the queue's own
+consumer to an offset, or to the first item put at or after a time. `remove` unregisters a
+consumer which is gone for good, so that trimming the queue no longer waits for it.
+
+.. code-block:: console
+
+   $ ./dist/queue_offsets.pex -c config.yml tweet_id_queue show
+   $ ./dist/queue_offsets.pex -c config.yml tweet_id_replay seek --offset 0
+   $ ./dist/queue_offsets.pex -c config.yml tweet_id_replay seek --time 2017-08-01T00:00:00
+   $ ./dist/queue_offsets.pex -c config.yml tweet_id_queue remove /queue/twitter/tweet_ids/ready/old
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import calendar
+from datetime import datetime
+import sys
+
+from skrode.config import Config
+
+
+def timestamp(text):
+  """Parse either a unix timestamp, or a UTC time as YYYY-MM-DDTHH:MM:SS."""
+
+  try:
+    return float(text)
+  except ValueError:
+    return calendar.timegm(datetime.strptime(text, "%Y-%m-%dT%H:%M:%S").utctimetuple())
+
+
+args = argparse.ArgumentParser()
+args.add_argument("-c", "--config",
+                  dest="config",
+                  default="config.yml")
+args.add_argument("queue",
+                  help="The config key of the queue, eg. tweet_id_queue")
+
+commands = args.add_subparsers(dest="command")
+commands.required = True
+
+commands.add_parser("show")
+
+seek_args = commands.add_parser("seek")
+seek_to = seek_args.add_mutually_exclusive_group(required=True)
+seek_to.add_argument("--offset",
+                     dest="offset",
+                     type=int)
+seek_to.add_argument("--time",
+                     dest="timestamp",
+                     type=timestamp,
+                     help="A unix timestamp, or a UTC time as YYYY-MM-DDTHH:MM:SS")
+
+remove_args = commands.add_parser("remove")
+remove_args.add_argument("consumer",
+                         help="The consumer to unregister, as listed by show")
+
+
+def main(opts):
+  queue = Config(config=opts.config)
+  for key in opts.queue.split("."):
+    queue = queue.get(key)
+
+  if queue is None or not hasattr(queue, "offsets"):
+    print("%s is not a work queue with offsets" % (opts.queue,), file=sys.stderr)
+    return 1
+
+  if opts.command == "show":
+    print("%6s %-60s %12s %12s %10s" % ("lane", "consumer", "offset", "lag", "inflight"))
+    for lane, consumers in enumerate(queue.offsets()):
+      for consumer, stats in sorted(consumers.items()):
+        print("%6d %-60s %12d %12d %10d" % (lane, consumer, stats["offset"], stats["lag"],
+                                            stats["inflight"]))
+
+  elif opts.command == "seek":
+    for lane, offset in enumerate(queue.seek(offset=opts.offset, timestamp=opts.timestamp)):
+      print("Lane %d now at offset %d" % (lane, offset))
+
+  else:
+    if not queue.unregister(opts.consumer):
+      print("%s is not a consumer of %s" % (opts.consumer, opts.queue), file=sys.stderr)
+      return 1
+    print("Removed %s" % (opts.consumer,))
+
+
+if __name__ == "__main__":
+  sys.exit(main(args.parse_args(sys.argv[1:])))
@@ -47,6 +47,9 @@ Example-ish configuration, note use of !skrode/* ctors, provided by skrode.confi
      conn: *redis
      key: /queue/twitter/user_names/ready
      inflight: /queue/twitter/user_names/inflight
+     # Items are stored 128 to a Redis hash. Items of queues written by older releases, one key
+     # each, are still read from their keys and go when trimmed, so no migration is needed
+     segment_size: 128
 
    twitter_user_id_queue:
      &twitter_user_id_queue
@@ -69,6 +72,13 @@ Example-ish configuration, note use of !skrode/* ctors, provided by skrode.confi
      conn: *redis
      key: /queue/twitter/tweet_ids/ready
      inflight: /queue/twitter/tweet_ids/inflight
+     # Drop re-enqueues of a tweet ID within 5m of its first enqueue
+     dedup: 300
+     # Tweets referenced by live tweets jump ahead of the backfill
+     lanes: 2
+     # Keep a day of processed IDs in Redis for replay, and archive the rest
+     retain_hours: 24
+     archive: /var/lib/skrode/archive/tweet_ids
 
    tweet_queue:
      &tweet_queue
@@ -76,6 +86,11 @@ Example-ish configuration, note use of !skrode/* ctors, provided by skrode.confi
      conn: *redis
      key: /queue/twitter/tweets/ready
      inflight: /queue/twitter/tweets/inflight
+     # Full tweet blobs are big, so store them compactly
+     codec: msgpack
+     compress_above: 512
+     # ..and stored aside from the queue itself if they are bigger than that
+     indirect: 4096
 
    # Worker queue topology
    ################################################################################
@@ -113,8 +128,17 @@ Example-ish configuration, note use of !skrode/* ctors, provided by skrode.confi
      session: *sql
      twitter_api: *twitter
      tweet_id_queue: *tweet_id_queue
+     # Commit once per 50 tweets, or every 5 seconds
+     commit_size: 50
+     commit_interval: 5
+
+   tweet_id_trim:
+     type: trim
+     source: *tweet_id_queue
+     interval: 60
 
    workers:
+     - tweet_id_trim
      - twitter_home_timeline
      - twitter_user_ids
      - twitter_empty_tweets
@@ -134,6 +158,8 @@ import threading
 import time
 
 from skrode.config import Config
+from skrode.redis.pool import pool_stats
+from skrode.unit_of_work import UnitOfWork
 
 import colorlog
 
@@ -164,23 +190,108 @@ def worker(name):
   return _inner
 
 
+def _flush(source):
+  """Send the acknowledgements a windowed queue has held back, so they aren't re-delivered."""
+
+  if hasattr(source, "flush"):
+    source.flush()
+
+
+def _process(uow, item, target, kwargs):
+  if uow is None:
+    with item as item_contents:
+      target(item_contents, **kwargs)
+
+  else:
+    # Only acknowledged once the unit of work commits what the target wrote. A failing item is
+    # rolled back to its SAVEPOINT and given back alone, and the rest of the batch carries on.
+    try:
+      with uow.event(on_commit=item.complete, on_rollback=item.abort):
+        target(item.value, **kwargs)
+    except Exception:
+      log.exception("Failed to process an item, giving it back")
+
+
+def _timeout(name, timeout, sleep):
+  """Take the deprecated `sleep` option, which `timeout` replaced, as the timeout."""
+
+  if sleep is not None:
+    log.warning("Worker option sleep is deprecated, set timeout: %s on %r instead", sleep, name)
+    return sleep
+  return timeout
+
+
+def _map(event, source, claim, target, kwargs, commit_size, commit_interval):
+  target = _import(target)
+
+  def _loop(uow=None):
+    while not event.is_set():
+      item = claim()
+      if item is not None:
+        _process(uow, item, target, kwargs)
+      elif uow is not None:
+        uow.poll()
+
+  try:
+    if commit_size:
+      with UnitOfWork(kwargs["session"], size=commit_size, interval=commit_interval) as uow:
+        _loop(uow)
+    else:
+      _loop()
+  finally:
+    _flush(source)
+
+
 @worker("map")
-def map_worker(event, target, source, type=None, sleep=1, **kwargs):
+def map_worker(event, target, source, type=None, timeout=5, commit_size=None, commit_interval=5,
+               sleep=None, **kwargs):
   """A worker which just maps over the items on a queue.
 
-  Tries to read an item from the work queue, processes it if there is one, otherwise waits 5s.
+  Blocks for up to `timeout` seconds waiting to read an item from the work queue, and processes it
+  if there is one. The timeout bounds how long a shutdown may take to be noticed.
+
+  Given a `commit_size`, the target's `session` is committed once per that many items, or at least
+  every `commit_interval` seconds, rather than by every insert, and items are acknowledged only
+  once they are committed. An item which fails is rolled back and given back on its own, without
+  losing the rest of the batch. See :py:class:`skrode.unit_of_work.UnitOfWork`.
+
+  `sleep` is a deprecated name for `timeout`.
   """
 
-  target = _import(target)
+  timeout = _timeout(target, timeout, sleep)
+  _map(event, source, lambda: source.get(timeout=timeout), target, kwargs,
+       commit_size, commit_interval)
+
+
+@worker("batch_map")
+def batch_map_worker(event, target, source, type=None, batch=100, timeout=5, commit_size=None,
+                     commit_interval=5, sleep=None, **kwargs):
+  """A worker which maps over batches of items on a queue.
+
+  Claims up to `batch` items at a time, and calls the target with the list of their values. The
+  whole batch is put back on the queue if the target fails. Commits may be batched as by the `map`
+  worker, with a `commit_size` counted in batches. `sleep` is a deprecated name for `timeout`.
+  """
+
+  timeout = _timeout(target, timeout, sleep)
+  _map(event, source, lambda: source.get_batch(batch, timeout=timeout), target, kwargs,
+       commit_size, commit_interval)
+
+
+@worker("trim")
+def trim_worker(event, source, type=None, interval=60, **kwargs):
+  """A worker which trims a queue every `interval` seconds.
+
+  Trimming drops, or archives, the items every consumer of the queue has processed and which its
+  retention policy doesn't keep, so that the queue's Redis memory stays flat. Local queues have no
+  retention, and can't be trimmed.
+  """
 
   while not event.is_set():
-    item = source.get()
-    if item is not None:
-      with item as item_contents:
-        target(item_contents, **kwargs)
-    else:
-      # FIXME: make this a configurable strategy
-      time.sleep(sleep)
+    trimmed = source.trim()
+    if trimmed:
+      log.info("Trimmed %d segments", trimmed)
+    event.wait(interval)
 
 
 @worker("custom")
@@ -223,7 +334,11 @@ def worker(opts, target_name):
   target = config.get(target_name).dict()
   log.info("Booting worker %r", target_name)
   # We're gonna load up a single worker, and start running it.
-  return WORKER_REGISTRY.get(target.get("type"))(event, **target)
+  try:
+    return WORKER_REGISTRY.get(target.get("type"))(event, **target)
+  finally:
+    for (host, port, db), stats in pool_stats().items():
+      log.info("Worker %r used redis %s:%d/%d: %r", target_name, host, port, db, stats)
 
 
 def main(opts):
@@ -245,6 +360,10 @@ def main(opts):
 
   # Populate the restart queue
   for worker_name in config.get("workers"):
+    target = config.get(worker_name)
+    # Refuse here, rather than in a worker which would be restarted forever
+    if target.get("type") == "trim" and not hasattr(target.get("source"), "trim"):
+      raise ValueError("Worker %r trims a queue which can't be trimmed" % (worker_name,))
     restarts.put(worker_name)
 
   def _chld(sig, frame):
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+SEARCH. Full text search over the posts in the configured database.
+
+Prints the best matching posts first, each with its rank, time and external ID. If there may be
+more results, the command to fetch the next page is printed to stderr.
+
+.. code-block:: console
+
+   $ ./dist/search.pex --service twitter --since 2017-01-01 clojure compiler
+   $ ./dist/search.pex --after 0.06079271:4b7c... clojure compiler
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import sys
+
+from skrode.config import Config
+from skrode.search import search_posts
+
+from arrow import get as aget
+
+
+args = argparse.ArgumentParser()
+args.add_argument("-c", "--config",
+                  dest="config",
+                  default="config.yml")
+args.add_argument("-s", "--service",
+                  dest="service",
+                  help="Only search posts on this service, such as twitter")
+args.add_argument("-p", "--persona",
+                  dest="persona",
+                  help="Only search posts by the accounts of this persona ID")
+args.add_argument("--since",
+                  dest="since",
+                  type=aget,
+                  help="Only search posts made at or after this ISO 8601 time")
+args.add_argument("--until",
+                  dest="until",
+                  type=aget,
+                  help="Only search posts made before this ISO 8601 time")
+args.add_argument("-l", "--limit",
+                  dest="limit",
+                  default=20,
+                  type=int)
+args.add_argument("--after",
+                  dest="after",
+                  help="The cursor of the previous page")
+args.add_argument("query",
+                  nargs="+")
+
+
+def main(opts):
+  session = Config(config=opts.config).get("sql")
+  text = " ".join(opts.query)
+
+  page = search_posts(session, text, service=opts.service, persona=opts.persona,
+                      since=opts.since, until=opts.until, limit=opts.limit, after=opts.after)
+  for post, rank in page.posts:
+    print("%s %s %s" % (rank, post.when, post.external_id))
+    print("  " + (post.text or "").replace("\n", "\n  "))
+
+  if page.next:
+    print("More results with --after %s" % (page.next,), file=sys.stderr)
+
+
+if __name__ == "__main__":
+  main(args.parse_args(sys.argv[1:]))
@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
 """
 WHOIS. A quick user lookup script.
+
+Personas are found by any of their names, ranked by trigram similarity. By default a persona
+matches if one of its names contains the given name; `--mode` selects exact, prefix or fuzzy
+matching instead, and `-i` ignores case.
+
+.. code-block:: console
+
+   $ ./dist/whois.pex arrdem
+   $ ./dist/whois.pex --mode similar "Reid McKenze"
 """
 
 from __future__ import absolute_import, print_function
@@ -9,7 +18,7 @@ import argparse
 import sys
 
 from skrode.config import Config
-from skrode.personas import personas_by_name
+from skrode.personas import NAME_MODES, personas_by_name
 
 import jinja2
 
@@ -57,13 +66,21 @@ args.add_argument("-l", "--limit",
                   dest="limit",
                   default=3,
                   type=int)
+args.add_argument("-m", "--mode",
+                  dest="mode",
+                  default="contains",
+                  choices=NAME_MODES)
+args.add_argument("-i", "--ignore-case",
+                  dest="ignore_case",
+                  action="store_true")
 args.add_argument("name")
 
 if __name__ == "__main__":
   opts = args.parse_args(sys.argv[1:])
   config = Config(config=opts.config)
 
-  for persona in personas_by_name(config.get("sql"), opts.name, limit=opts.limit):
+  for persona in personas_by_name(config.get("sql"), opts.name, limit=opts.limit, mode=opts.mode,
+                                  ignore_case=opts.ignore_case):
     if persona.owner:
       print(HUMAN_TEMPLATE.render(human=persona.owner))
     else:
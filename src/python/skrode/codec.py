@@ -0,0 +1,102 @@
+"""
+Payload codecs for work queues.
+
+Queues were originally written with bare JSON text, and every reader must still decode it. The
+other encodings are marked by a leading header byte which can never start a JSON document, so a
+queue may switch codecs while old entries are still waiting in it:
+
+=======  ========================================
+Header   Payload
+=======  ========================================
+(none)   JSON text
+``\\x01``  msgpack
+``\\x02``  zlib compressed msgpack
+``\\x03``  zlib compressed JSON text
+=======  ========================================
+
+Configured on a `!skrode/queue` or `!skrode/localqueue` node with the `codec` and
+`compress_above` keys:
+
+.. code-block:: yaml
+
+   tweet_queue:
+     &tweet_queue
+     !skrode/queue
+     conn: *redis
+     key: /queue/twitter/tweets/ready
+     codec: msgpack
+     # zlib any payload of more than 512 bytes
+     compress_above: 512
+"""
+
+from __future__ import absolute_import
+
+import json
+import zlib
+
+import msgpack
+
+
+_MSGPACK = b"\x01"
+_MSGPACK_ZLIB = b"\x02"
+_JSON_ZLIB = b"\x03"
+
+_HEADERS = {
+  "json": (None, _JSON_ZLIB),
+  "msgpack": (_MSGPACK, _MSGPACK_ZLIB),
+}
+
+
+def _load_json(data):
+  if isinstance(data, bytes):
+    data = data.decode("utf-8")
+  return json.loads(data)
+
+
+def _load_msgpack(data):
+  return msgpack.unpackb(data, raw=False)
+
+
+_LOADERS = {
+  _MSGPACK: _load_msgpack,
+  _MSGPACK_ZLIB: lambda data: _load_msgpack(zlib.decompress(data)),
+  _JSON_ZLIB: lambda data: _load_json(zlib.decompress(data)),
+}
+
+
+class Codec(object):
+  """Encodes values for a queue with the given `codec`, and decodes values in any codec.
+
+  If `compress_above` is given, encoded payloads of more than that many bytes are compressed with
+  zlib at the given compression `level`. The plain `json` codec writes the same bare JSON text as
+  ever, so that queues may keep being read by older workers.
+  """
+
+  def __init__(self, codec="json", compress_above=None, level=6):
+    if codec not in _HEADERS:
+      raise ValueError("Unknown codec %r, expected one of %s"
+                       % (codec, ", ".join(sorted(_HEADERS))))
+
+    self._header, self._compressed_header = _HEADERS[codec]
+    self._dump = json.dumps if codec == "json" else \
+      (lambda value: msgpack.packb(value, use_bin_type=True))
+    self._compress_above = compress_above
+    self._level = level
+
+  def encode(self, value):
+    data = self._dump(value)
+    if self._compress_above is not None and len(data) > self._compress_above:
+      if isinstance(data, str):
+        data = data.encode("utf-8")
+      return self._compressed_header + zlib.compress(data, self._level)
+
+    elif self._header is None:
+      return data
+
+    return self._header + data
+
+  def decode(self, data):
+    if isinstance(data, bytes) and data[:1] in _LOADERS:
+      return _LOADERS[data[:1]](data[1:])
+
+    return _load_json(data)
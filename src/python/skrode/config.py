@@ -4,46 +4,75 @@ The BBDB config
 
 from __future__ import absolute_import
 
-import json
+import inspect
 import types
 
-from skrode.redis.workqueue import WorkQueue
-from skrode.sql import make_engine_session_factory
+from skrode.codec import Codec
+from skrode.local import workqueue as localqueue
+from skrode.redis import partitioned, pool, streams, workqueue
+from skrode.sql import get_session as get_sql_session
 from skrode.sql import make_uri as make_sql_uri
 
-import redis
 from twitter import Api
 import yaml
 
 
 def make_proxy_ctor(ctor, **more):
   def _from_yaml(loader, node):
-    d = loader.construct_mapping(node)
+    # Deep, so that list values (such as the conns of a partitioned queue) are filled in already
+    d = loader.construct_mapping(node, deep=True)
     d.update(more)
     return ctor(**d)
 
   return _from_yaml
 
 
-def _make_sql_session(**kwargs):
-  engine, sessionmaker = make_engine_session_factory(uri=make_sql_uri(**kwargs))
-  return sessionmaker()
+def _make_sql_session(pool_size=5, max_overflow=10, pool_pre_ping=True, pool_recycle=3600,
+                      create_schema=True, **kwargs):
+  return get_sql_session(make_sql_uri(**kwargs), pool_size=pool_size, max_overflow=max_overflow,
+                         pool_pre_ping=pool_pre_ping, pool_recycle=pool_recycle,
+                         create_schema=create_schema)
 
 
-def _decode_and_load(text):
-  if isinstance(text, bytes):
-    text = text.decode("utf-8")
-  return json.loads(text)
+QUEUE_BACKENDS = {
+  "sequence": workqueue.WorkQueue,
+  "streams": streams.WorkQueue,
+  "partitioned": partitioned.PartitionedQueue,
+}
 
 
-yaml.SafeLoader.add_constructor('!skrode/redis', make_proxy_ctor(redis.StrictRedis))
-yaml.SafeLoader.add_constructor('!skrode/queue', make_proxy_ctor(WorkQueue,
-                                                                 encoder=json.dumps,
-                                                                 decoder=_decode_and_load))
+def _make_queue(backend="sequence", codec="json", compress_above=None, **kwargs):
+  # Backends only share some options, so name the ones a backend lacks rather than a TypeError
+  cls = QUEUE_BACKENDS[backend]
+  unsupported = set(kwargs) - set(inspect.signature(cls).parameters)
+  if unsupported:
+    raise ValueError("The %s queue backend doesn't support %s"
+                     % (backend, ", ".join(sorted(unsupported))))
+
+  codec = Codec(codec, compress_above=compress_above)
+  return cls(encoder=codec.encode, decoder=codec.decode, **kwargs)
+
+
+def _make_localqueue(codec="json", compress_above=None, **kwargs):
+  codec = Codec(codec, compress_above=compress_above)
+  return localqueue.WorkQueue(encoder=codec.encode, decoder=codec.decode, **kwargs)
+
+
+yaml.SafeLoader.add_constructor('!skrode/redis', make_proxy_ctor(pool.get_redis))
+yaml.SafeLoader.add_constructor('!skrode/queue', make_proxy_ctor(_make_queue))
+yaml.SafeLoader.add_constructor('!skrode/localqueue', make_proxy_ctor(_make_localqueue))
 yaml.SafeLoader.add_constructor('!skrode/twitter', make_proxy_ctor(Api))
 yaml.SafeLoader.add_constructor('!skrode/sql', make_proxy_ctor(_make_sql_session))
 
 
+def disable_schema_checks():
+  """Make `!skrode/sql` nodes loaded from now on skip checking the schema, as if they all set
+  `create_schema: false`. For tools which manage the schema themselves."""
+
+  yaml.SafeLoader.add_constructor('!skrode/sql',
+                                  make_proxy_ctor(_make_sql_session, create_schema=False))
+
+
 class Config(object):
   """An object structure which proxies pretty thinly over a loaded dictionary of data, and a
   dictionary of either default values or default-calculating functions.
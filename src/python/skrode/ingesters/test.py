@@ -15,8 +15,7 @@ def random(event, queue, rate):
   Puts random numbers on a queue, until the event becomes set.
   """
   while not event.is_set():
-    for i in range(100):
-      queue.put(randint(1, 10000))
+    queue.put_many(randint(1, 10000) for i in range(100))
     log.info("Wrote, napping")
     sleep(rate)
 
@@ -11,10 +11,12 @@ import time
 
 from skrode.schema import Account, Post, PostDistribution, PostRelationship
 from skrode.services import twitter as bt
+from skrode.unit_of_work import commit, UnitOfWork
 
 from arrow import utcnow
 from requests import Session
 from sqlalchemy import or_, and_
+from sqlalchemy.exc import SQLAlchemyError
 from twitter.error import TwitterError
 from twitter.models import Status, User
 
@@ -57,8 +59,12 @@ def have_tweet(session, id):
                 .first()
 
 
-def ingest_tweet(tweet, session, twitter_api, tweet_id_queue):
-  """Actually ingest a single tweet, dealing with the required enqueuing."""
+def ingest_tweet(tweet, session, twitter_api, tweet_id_queue, priority=0):
+  """Actually ingest a single tweet, dealing with the required enqueuing.
+
+  Referenced tweets are enqueued with the given `priority`, so that the context of live tweets can
+  be fetched ahead of backfill.
+  """
 
   if not isinstance(tweet, Status):
     tweet = Status.NewFromJsonDict(tweet)
@@ -66,7 +72,7 @@ def ingest_tweet(tweet, session, twitter_api, tweet_id_queue):
   if tweet.retweeted_status:
     # We don't actually care about retweets, they aren't original content.
     # Just insert the original.
-    ingest_tweet(tweet.retweeted_status, session, twitter_api, tweet_id_queue)
+    ingest_tweet(tweet.retweeted_status, session, twitter_api, tweet_id_queue, priority)
 
     ingest_user_object(tweet.user, session)
 
@@ -83,18 +89,18 @@ def ingest_tweet(tweet, session, twitter_api, tweet_id_queue):
       # inserting its parent post(s) (recursively!)
       thread_id = str(tweet.in_reply_to_status_id)
       if not have_tweet(session, thread_id):
-        tweet_id_queue.put(thread_id)
+        tweet_id_queue.put(thread_id, priority=priority)
         pass
 
     if tweet.quoted_status:
       # This is a quote tweet (possibly subtweet or snarky reply, quote tweets have different
       # broadcast mechanics).
-      ingest_tweet(tweet.quoted_status, session, twitter_api, tweet_id_queue)
+      ingest_tweet(tweet.quoted_status, session, twitter_api, tweet_id_queue, priority)
 
     for url in tweet.urls or []:
       tweet_id = bt.tweet_id_from_url(url.expanded_url)
       if tweet_id and not have_tweet(session, tweet_id):
-        tweet_id_queue.put(tweet_id)
+        tweet_id_queue.put(tweet_id, priority=priority)
         pass
 
     for user in tweet.user_mentions or []:
@@ -161,7 +167,7 @@ def _ingest_event(stream_event, session, twitter_api, tweet_id_queue, user_queue
     entity = bt._tweet_or_dummy(session, event_id)
     entity.tombstone = True
     session.add(entity)
-    session.commit()
+    commit(session)
 
   elif stream_event and "id" in stream_event and "user" in stream_event:
     if "extended_tweet" in stream_event:
@@ -171,11 +177,11 @@ def _ingest_event(stream_event, session, twitter_api, tweet_id_queue, user_queue
       # And by munge I just mean copy, because the twitter-python driver drops this on the floor
       stream_event["text"] = stream_event["extended_tweet"]["full_text"]
 
-    ingest_tweet(stream_event, session, twitter_api, tweet_id_queue)
+    # Live tweets from the stream, whose context should jump the backfill
+    ingest_tweet(stream_event, session, twitter_api, tweet_id_queue, priority=1)
 
   elif "friends" in stream_event:
-    for friend in stream_event.get("friends"):
-      user_queue.put(str(friend))
+    user_queue.put_many(str(friend) for friend in stream_event.get("friends"))
 
   else:
     blob = json.dumps(stream_event)
@@ -188,11 +194,21 @@ class TimeoutException(Exception):
   """Dummy used for timeouts."""
 
 
-def user_stream(event, session, twitter_api, tweet_id_queue, user_queue, **stream_kwargs):
+def user_stream(event, session, twitter_api, tweet_id_queue, user_queue, commit_size=100,
+                commit_interval=5, **stream_kwargs):
   """
   Ingest a Twitter stream, enqueuing tweets and users for eventual processing.
+
+  Events are committed in batches of up to `commit_size`, at least every `commit_interval` seconds.
+  Stream events can't be replayed, so a batch which fails is logged and dropped.
   """
 
+  with UnitOfWork(session, size=commit_size, interval=commit_interval) as uow:
+    _user_stream(event, session, twitter_api, tweet_id_queue, user_queue, uow, **stream_kwargs)
+
+
+def _user_stream(event, session, twitter_api, tweet_id_queue, user_queue, uow, **stream_kwargs):
+
   def _timeout_handler(sig, stack):
     raise TimeoutException()
 
@@ -215,8 +231,10 @@ def user_stream(event, session, twitter_api, tweet_id_queue, user_queue, **strea
         for stream_event in stream:
           if stream_event:
             _ingest_event(stream_event, session, twitter_api, tweet_id_queue, user_queue)
+            uow.done()
           else:
             log.debug("keepalive....")
+            uow.poll()
 
           # Update the alarm we're using for the keepalive signal...
           signal.alarm(35)
@@ -230,6 +248,12 @@ def user_stream(event, session, twitter_api, tweet_id_queue, user_queue, **strea
             log.info("Resetting Twitter stream connection...")
             break
 
+      except SQLAlchemyError as e:
+        # The session can't be committed after a failed statement, so the batch is lost
+        log.error(e)
+        uow.rollback(error="%s: %s" % (e.__class__.__name__, e))
+        continue
+
       except Exception as e:
         log.error(e)
         continue
@@ -243,14 +267,17 @@ def user_stream(event, session, twitter_api, tweet_id_queue, user_queue, **strea
 
 def collect_empty_tweets(event, session, tweet_id_queue):
   while not event.is_set():
-    for post_id, in session.query(Post.external_id)\
-                           .filter(Post.poster == None,
-                                   Post.service == bt.insert_twitter(session),
-                                   Post.tombstone == False)\
-                           .all():
-      tweet_id_queue.put(post_id.split(":")[1])
+    empty_posts = session.query(Post.external_id)\
+                         .filter(Post.poster == None,
+                                 Post.service == bt.insert_twitter(session),
+                                 Post.tombstone == False)\
+                         .all()
+    # Chunked, so that no one append holds up Redis for long and shutdown is still noticed
+    for start in range(0, len(empty_posts), 1000):
       if event.is_set():
         break
+      tweet_id_queue.put_many(post_id.split(":")[1]
+                              for post_id, in empty_posts[start:start + 1000])
 
     time.sleep(5)
 
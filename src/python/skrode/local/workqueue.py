@@ -0,0 +1,517 @@
+"""
+A durable queue backed by files on the local disk.
+
+An alternative to :py:mod:`skrode.redis.workqueue` for topologies which run on a single host,
+providing the same `Producer`, `Consumer`, `WorkItem`, `WorkBatch` and `WorkQueue` interfaces
+without any external service.
+
+A queue is a directory holding an append-only `data` file of concatenated values, an `index` file
+of the end offset of each value as a little-endian 64 bit integer, and a `consumers` directory of
+per-consumer state files. Writers and consumers serialize on `flock` locks, which makes the queue
+safe to share between the forked worker processes of `run_topology`. Values are read back through
+a read-only memory map of the data file.
+
+Every claim, and every acknowledgement, give back and renewal, rewrites the consumer's state file
+under its lock. The file lists every lease the consumer holds, so each of these costs time in the
+number of items in flight. A consumer `window` claims that many items at once and holds its
+acknowledgements back to be written with the next claim, so that the file is rewritten about once
+per window rather than once per item.
+
+These queues have no retention. Consumers address items by their index in the files, so items are
+never dropped and the files grow with every put. They can't be trimmed, and `run_topology` refuses
+`trim` workers over them.
+"""
+
+import fcntl
+import json
+import mmap
+import os
+import struct
+import time
+from urllib.parse import quote
+
+
+_OFFSET = struct.Struct("<Q")
+
+
+class _Locked(object):
+  """Helper class. Holds an exclusive `flock` on a file for the duration of a `with` block."""
+
+  def __init__(self, fd):
+    self._fd = fd
+
+  def __enter__(self):
+    fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+  def __exit__(self, type, value, traceback):
+    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class _Files(object):
+  """Helper class.
+
+  Lazily opens files, re-opening them after a fork. `flock` locks belong to an open file, so a
+  file opened before a fork would let the parent and child hold the same lock at once.
+  """
+
+  def __init__(self):
+    self._pid = None
+    self._fds = {}
+
+  def __call__(self, path):
+    if self._pid != os.getpid():
+      self._pid = os.getpid()
+      self._fds = {}
+
+    if path not in self._fds:
+      self._fds[path] = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    return self._fds[path]
+
+
+class _Log(object):
+  """Helper class.
+
+  An append-only sequence of values stored in a directory, with constant time access to indexed
+  elements.
+
+  Values are written to the data file at the end offset of the last indexed value, and only then
+  indexed, so a writer which dies part way through an append leaves nothing visible and its
+  partial data is overwritten by the next append.
+  """
+
+  def __init__(self, path, fsync=False):
+    self._path = path
+    self._fsync = fsync
+    self._files = _Files()
+    self._map = None
+    self._map_pid = None
+
+    os.makedirs(os.path.join(path, "consumers"), exist_ok=True)
+
+  def _data(self):
+    return self._files(os.path.join(self._path, "data"))
+
+  def _index(self):
+    return self._files(os.path.join(self._path, "index"))
+
+  def _end(self, idx):
+    """The end offset of the value at `idx` in the data file."""
+
+    if idx < 0:
+      return 0
+
+    return _OFFSET.unpack(os.pread(self._index(), _OFFSET.size, idx * _OFFSET.size))[0]
+
+  def __len__(self):
+    return os.fstat(self._index()).st_size // _OFFSET.size
+
+  def __getitem__(self, idx):
+    assert isinstance(idx, int)
+
+    if not 0 <= idx < len(self):
+      raise IndexError()
+
+    start, end = self._end(idx - 1), self._end(idx)
+    if start == end:
+      return b""
+
+    if self._map is None or len(self._map) < end or self._map_pid != os.getpid():
+      self._map = mmap.mmap(self._data(), os.fstat(self._data()).st_size, access=mmap.ACCESS_READ)
+      self._map_pid = os.getpid()
+
+    return self._map[start:end]
+
+  def push(self, val):
+    """
+    Atomically pushes the given value to the end of the list.
+    """
+
+    return self.extend([val])[0]
+
+  def extend(self, vals):
+    """
+    Atomically pushes all the given values to the end of the list, returning the range of indices
+    they were assigned.
+    """
+
+    vals = [val.encode("utf-8") if isinstance(val, str) else val for val in vals]
+    if not vals:
+      return range(0)
+
+    with _Locked(self._index()):
+      first = len(self)
+      end = self._end(first - 1)
+      ends = []
+      for val in vals:
+        end += len(val)
+        ends.append(end)
+
+      os.pwrite(self._data(), b"".join(vals), self._end(first - 1))
+      if self._fsync:
+        os.fsync(self._data())
+
+      os.pwrite(self._index(), b"".join(_OFFSET.pack(end) for end in ends), first * _OFFSET.size)
+      if self._fsync:
+        os.fsync(self._index())
+
+    return range(first, first + len(vals))
+
+
+class _ConsumerState(object):
+  """Helper class.
+
+  The durable cursor and in-flight leases of one consumer, stored as a small JSON file which is
+  replaced atomically on every update. A lease which passes its deadline without being
+  acknowledged is re-delivered by the next claim.
+
+  Acknowledgements may be batched, by holding them until `ack_window` are pending or
+  `ack_interval` seconds have passed, or until the next claim writes them. See
+  :py:class:`skrode.redis.workqueue._Inflight`.
+  """
+
+  def __init__(self, log, consumer_id, lease=300, ack_window=1, ack_interval=None):
+    self._log = log
+    self._path = os.path.join(log._path, "consumers", quote(consumer_id, safe=""))
+    self._lease = lease
+    self._ack_window = ack_window
+    self._ack_interval = ack_interval
+    self._pending = []
+    self._flush_at = time.time() + (ack_interval or 0)
+
+  def _lock(self):
+    return _Locked(self._log._files(self._path + ".lock"))
+
+  def _read(self):
+    try:
+      with open(self._path) as f:
+        state = json.load(f)
+    except FileNotFoundError:
+      state = {"cursor": 0, "inflight": {}}
+
+    return state["cursor"], {int(idx): deadline for idx, deadline in state["inflight"].items()}
+
+  def _write(self, cursor, inflight):
+    with open(self._path + ".tmp", "w") as f:
+      json.dump({"cursor": cursor, "inflight": inflight}, f)
+      if self._log._fsync:
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(self._path + ".tmp", self._path)
+
+  def __len__(self):
+    cursor, _ = self._read()
+    return len(self._log) - cursor
+
+  def claim(self, n=1):
+    """Claim up to `n` elements, returning a list of pairs of index and value. Any held back
+    acknowledgements are written along with the claim."""
+
+    now = time.time()
+    acks, self._pending = self._pending, []
+    self._flush_at = now + (self._ack_interval or 0)
+    with self._lock():
+      cursor, inflight = self._read()
+      for idx in acks:
+        inflight.pop(idx, None)
+
+      idxs = sorted(idx for idx, deadline in inflight.items() if deadline <= now)[:n]
+      fresh = min(n - len(idxs), len(self._log) - cursor)
+      if fresh > 0:
+        idxs.extend(range(cursor, cursor + fresh))
+        cursor += fresh
+
+      if idxs or acks:
+        inflight.update((idx, now + self._lease) for idx in idxs)
+        self._write(cursor, inflight)
+
+    return [(idx, self._log[idx]) for idx in idxs]
+
+  def _update(self, idxs, deadline):
+    with self._lock():
+      cursor, inflight = self._read()
+      changed = False
+      for idx in idxs:
+        if idx in inflight:
+          changed = True
+          if deadline is None:
+            del inflight[idx]
+          else:
+            inflight[idx] = deadline
+
+      if changed:
+        self._write(cursor, inflight)
+
+  def ack(self, *idxs):
+    """Drop the leases on the given indices, marking them as processed.
+
+    The acknowledgement may be held back to be written with others.
+    """
+
+    self._pending.extend(idxs)
+    if len(self._pending) >= self._ack_window or \
+       (self._ack_interval is not None and time.time() >= self._flush_at):
+      self.flush()
+
+  def flush(self):
+    """Write any held back acknowledgements."""
+
+    idxs, self._pending = self._pending, []
+    self._flush_at = time.time() + (self._ack_interval or 0)
+    if idxs:
+      self._update(idxs, None)
+
+  def nack(self, *idxs):
+    """Expire the leases on the given indices, so that they are re-delivered immediately."""
+
+    if idxs:
+      self._update(idxs, 0)
+
+  def renew(self, *idxs, lease=None):
+    """Push back the deadline of the leases on the given indices, by `lease` seconds if given."""
+
+    if idxs:
+      self._update(idxs, time.time() + (self._lease if lease is None else lease))
+
+
+class WorkItem(object):
+  """
+  Helper class to WorkQueue.
+
+  Represents a single claimed value. See :py:class:`skrode.redis.workqueue.WorkItem`.
+  """
+
+  def __init__(self, state, idx, value, decoder=None):
+    self._state = state
+    self._idx = idx
+    self._value = value
+    self._decoder = decoder or (lambda x: x)
+
+  @property
+  def value(self):
+    return self._decoder(self._value)
+
+  def complete(self):
+    """Acknowledge this work item as processed."""
+
+    self._state.ack(self._idx)
+
+  def abort(self, error=None):
+    """Admit a failure to process this work item and put it back on the queue.
+
+    Items of this queue aren't dead lettered, so `error` is ignored.
+    """
+
+    self._state.nack(self._idx)
+
+  def renew(self, lease=None):
+    """Extend the lease on this work item, for items which take a long time to process."""
+
+    self._state.renew(self._idx, lease=lease)
+
+  def __enter__(self):
+    return self.value
+
+  def __exit__(self, type, value, traceback):
+    if type is None and value is None and traceback is None:
+      self.complete()
+    else:
+      self.abort()
+
+
+class WorkBatch(object):
+  """
+  Helper class to WorkQueue.
+
+  Represents a group of values claimed at once. See :py:class:`skrode.redis.workqueue.WorkBatch`.
+  """
+
+  def __init__(self, state, idxs, values, decoder=None):
+    self._state = state
+    self._idxs = idxs
+    self._values = values
+    self._decoder = decoder or (lambda x: x)
+
+  def __len__(self):
+    return len(self._idxs)
+
+  @property
+  def value(self):
+    return [self._decoder(value) for value in self._values]
+
+  def complete(self):
+    """Acknowledge every item in this batch as processed."""
+
+    self._state.ack(*self._idxs)
+
+  def abort(self, error=None):
+    """Admit a failure to process this batch and put all of it back on the queue.
+
+    Items of this queue aren't dead lettered, so `error` is ignored.
+    """
+
+    self._state.nack(*self._idxs)
+
+  def renew(self, lease=None):
+    """Extend the lease on every item in this batch."""
+
+    self._state.renew(*self._idxs, lease=lease)
+
+  def __enter__(self):
+    return self.value
+
+  def __exit__(self, type, value, traceback):
+    if type is None and value is None and traceback is None:
+      self.complete()
+    else:
+      self.abort()
+
+
+class Producer(object):
+  """A helper type which represents a writer to a durable FIFO queue on disk.
+
+  If `fsync` is set, every write is synced to disk before it returns.
+  """
+
+  def __init__(self, path, encoder=None, fsync=False):
+    self._log = _Log(path, fsync=fsync)
+    self._encoder = encoder or (lambda x: x)
+
+  def __len__(self):
+    return len(self._log)
+
+  def put(self, value):
+    return self._log.push(self._encoder(value))
+
+  def put_many(self, values):
+    """Enqueue every value from an iterable, returning the range of indices they were assigned."""
+
+    return self._log.extend(self._encoder(value) for value in values)
+
+
+class Consumer(object):
+  """A helper type which represents a consumer over a durable FIFO queue on disk.
+
+  Consumers sharing a `consumer_id` compete for items. Given a `window` of more than one, `next`
+  claims that many items at once and hands them out one at a time, and acknowledgements are held
+  back and written with the following claim, or once `ack_interval` seconds have passed. `flush`
+  writes any held back acknowledgements, and should be called before a consumer is discarded. See
+  :py:class:`skrode.redis.workqueue.Consumer`.
+  """
+
+  def __init__(self, path, consumer_id, decoder=None, lease=300, fsync=False, poll=0.01,
+               window=1, ack_interval=None):
+    self._log = _Log(path, fsync=fsync)
+    self._state = _ConsumerState(self._log, consumer_id, lease=lease, ack_window=window,
+                                 ack_interval=ack_interval)
+    self._decoder = decoder
+    self._poll = poll
+    self._window = window
+    self._buffer = []
+
+  def __iter__(self):
+    return self
+
+  def __len__(self):
+    """Returns the number of items this consumer has yet to claim."""
+
+    return len(self._state)
+
+  def _claim(self, n, timeout):
+    deadline = time.time() + (timeout or 0)
+    while True:
+      claimed = self._state.claim(n)
+      if claimed or time.time() >= deadline:
+        return claimed
+
+      # Waiting on the index file to grow is a stat() per poll, not a network round trip
+      length = len(self._log)
+      while len(self._log) == length and time.time() < deadline:
+        time.sleep(self._poll)
+
+  def next(self, timeout=None):
+    """Claim the next item as a :py:class:`WorkItem`.
+
+    If `timeout` is given and the queue is empty, blocks for up to `timeout` seconds waiting for
+    an item to be added.
+    """
+
+    if not self._buffer:
+      self._buffer = self._claim(self._window, timeout)
+      self._buffer.reverse()
+    if not self._buffer:
+      raise StopIteration
+
+    idx, val = self._buffer.pop()
+    return WorkItem(self._state, idx, val, decoder=self._decoder)
+
+  def next_batch(self, n, timeout=None):
+    """Claim up to `n` items at once, returning them as a single :py:class:`WorkBatch`. Items left
+    over from a window claimed by `next` are handed out first."""
+
+    if self._buffer:
+      claimed, self._buffer = self._buffer[:-n - 1:-1], self._buffer[:-n]
+    else:
+      claimed = self._claim(n, timeout)
+    if not claimed:
+      raise StopIteration
+
+    idxs, vals = zip(*claimed)
+    return WorkBatch(self._state, idxs, vals, decoder=self._decoder)
+
+  def flush(self):
+    """Write any acknowledgements held back by the window."""
+
+    self._state.flush()
+
+
+class WorkQueue(object):
+  """Provides `.put` and `.get` over a queue directory, using an implicit single shared consumer.
+
+  Configured in YAML with the `!skrode/localqueue` constructor:
+
+  .. code-block:: yaml
+
+     tweet_id_queue:
+       &tweet_id_queue
+       !skrode/localqueue
+       path: /var/lib/skrode/queues/tweet_ids
+
+  A `window` claims that many items at once, and writes acknowledgements once per window or
+  `ack_interval` seconds rather than once per item. See :py:class:`Consumer`.
+  """
+
+  def __init__(self, path, decoder=None, encoder=None, lease=300, fsync=False, window=1,
+               ack_interval=None):
+    self._producer = Producer(path, encoder=encoder, fsync=fsync)
+    self._consumer = Consumer(path, "implicit_consumer", decoder=decoder, lease=lease, fsync=fsync,
+                              window=window, ack_interval=ack_interval)
+
+  def __len__(self):
+    return len(self._consumer)
+
+  def put(self, val, priority=0):
+    """Enqueue a value. This queue has a single lane, so `priority` is ignored."""
+
+    return self._producer.put(val)
+
+  def put_many(self, vals, priority=0):
+    return self._producer.put_many(vals)
+
+  def flush(self):
+    """Write any acknowledgements held back by the window."""
+
+    self._consumer.flush()
+
+  def get(self, timeout=None):
+    try:
+      return self._consumer.next(timeout=timeout)
+    except StopIteration:
+      return None
+
+  def get_batch(self, n, timeout=None):
+    try:
+      return self._consumer.next_batch(n, timeout=timeout)
+    except StopIteration:
+      return None
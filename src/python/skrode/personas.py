@@ -5,6 +5,7 @@ Helpers for working with (merging/splitting) personas.
 from skrode import schema
 from skrode.schema import get_or_create
 from skrode.services import mk_insert_user, mk_service
+from skrode.unit_of_work import commit
 
 from sqlalchemy import asc, func, inspect, join
 
@@ -32,34 +33,92 @@ def insert_name(session, persona, name):
                              external_id=_nullsvc_fk(persona.id),
                              persona=persona)
     session.add(nullact)
-    session.commit()
+    commit(session)
 
   return get_or_create(session, schema.Name,
                        name=name,
                        account=nullact)
 
 
-def personas_by_name(session, name, one=False, exact=False, limit=None):
+NAME_MODES = ["exact", "prefix", "contains", "similar"]
+
+
+def _escape_like(name):
+  return name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _name_filter(name, mode, ignore_case):
+  column = schema.Name.name
+  if mode == "exact":
+    return func.lower(column) == name.lower() if ignore_case else column == name
+
+  elif mode == "similar":
+    # The pg_trgm similarity operator, which is always case insensitive. SQLAlchemy doesn't escape
+    # custom operators for psycopg2's format parameters, so it is written escaped.
+    return column.op("%%")(name)
+
+  elif mode in ("prefix", "contains"):
+    pattern = _escape_like(name) + "%"
+    if mode == "contains":
+      pattern = "%" + pattern
+    return column.ilike(pattern) if ignore_case else column.like(pattern)
+
+  raise ValueError("Unknown name search mode %r, expected one of %s"
+                   % (mode, ", ".join(NAME_MODES)))
+
+
+def search_names(session, name, mode="contains", ignore_case=False, limit=None):
+  """Returns the Names which match a name, best first, as pairs of Name and similarity score.
+
+  `mode` is one of
+
+  - `exact`, names equal to `name`
+  - `prefix`, names starting with `name`
+  - `contains`, names containing `name`
+  - `similar`, names with trigram similarity to `name` over `pg_trgm.similarity_threshold`
+
+  and is case insensitive if `ignore_case`. Matches are ranked by trigram similarity, which for
+  every mode is served by the trigram index of names, although the index can't narrow down
+  prefixes or substrings of less than three characters.
+  """
+
+  score = func.similarity(schema.Name.name, name)
+  q = session.query(schema.Name, score)\
+             .filter(_name_filter(name, mode, ignore_case))\
+             .order_by(score.desc(), schema.Name.name)
+
+  if limit:
+    q = q.limit(limit)
+
+  return q.all()
+
+
+def personas_by_name(session, name, one=False, exact=False, limit=None, mode="contains",
+                     ignore_case=False):
   """Given a name, return personas such that any account matches the name query.
 
   If `one` is True, return only one result.
 
   If `limit` is not None, return only `limit` results.
 
-  If `exact` is True, return only personas which exactly match the given name string.
+  If `exact` is True, return only personas which exactly match the given name string. Otherwise
+  names are matched by `mode`, and personas are ranked by their best matching name. See
+  :py:func:`search_names`.
   """
 
-  _filter = lambda: schema.Name.name.contains(name) if not exact else schema.Name.name == name
-  _score = lambda: func.abs(func.length(schema.Name.name) - len(name))
+  if exact:
+    mode = "exact"
+
+  score = func.max(func.similarity(schema.Name.name, name)).label("score")
+  ranked = session.query(schema.Account.persona_id.label("persona_id"), score)\
+                  .join(schema.Name, schema.Name.account_id == schema.Account.id)\
+                  .filter(_name_filter(name, mode, ignore_case))\
+                  .group_by(schema.Account.persona_id)\
+                  .subquery()
 
   p = session.query(schema.Persona)\
-             .join(schema.Account)\
-             .filter(schema.Persona.id == schema.Account.persona_id)\
-             .join(schema.Name)\
-             .filter(schema.Name.account_id == schema.Account.id)\
-             .filter(_filter())\
-             .order_by(_score())\
-             .distinct()
+             .join(ranked, ranked.c.persona_id == schema.Persona.id)\
+             .order_by(ranked.c.score.desc(), schema.Persona.id)
 
   if limit:
     p = p.limit(limit)
@@ -84,18 +143,18 @@ def merge_left(session, l, r):
       account.persona_id = l.id
       session.add(account)
 
-  session.commit()
+  commit(session)
 
   for name in r.linked_names:
     if not inspect(name).deleted:
       name.persona_id = l.id
       session.add(name)
-  session.commit()
+  commit(session)
 
   # This is now safe, and if it isn't because there are orphans then it'll explode
   session.delete(r)
 
-  session.commit()
+  commit(session)
 
 
 def link_personas_by_owner(session, *ps):
@@ -116,4 +175,4 @@ def link_personas_by_owner(session, *ps):
     p.owner = person
     session.add(p)
 
-  session.commit()
+  commit(session)
@@ -0,0 +1,408 @@
+"""
+An asyncio interface to the durable queue of :py:mod:`skrode.redis.workqueue`.
+
+Provides `Producer`, `Consumer`, `WorkItem`, `WorkBatch` and `WorkQueue` counterparts whose
+operations are coroutines, over a `redis.asyncio` client (redis-py 4.2 or later). They run the same
+Lua scripts over the same keys as the synchronous classes, so the two may be mixed freely - a
+synchronous ingester may feed a queue which an event loop worker drains, or the other way around.
+
+.. code-block:: python
+
+   conn = redis.asyncio.StrictRedis("localhost")
+   queue = WorkQueue(conn, "/queue/twitter/tweet_ids/ready")
+
+   async def worker():
+     while True:
+       item = await queue.get(timeout=5)
+       if item is not None:
+         async with item as tweet_id:
+           # ... await the Twitter API
+"""
+
+import time
+
+from skrode.redis import workqueue
+
+
+class _AppendSeq(workqueue._AppendSeq):
+  """Helper class. The coroutine counterparts of the :py:class:`workqueue._AppendSeq` operations.
+
+  Trimming and archives are only supported by the synchronous sequence.
+  """
+
+  def __init__(self, conn, key, suffix="/", segment_size=128):
+    super(_AppendSeq, self).__init__(conn, key, suffix=suffix, segment_size=segment_size)
+
+  async def length(self):
+    return int(await self._conn.get(self._key) or "0")
+
+  async def get(self, idx):
+    result = await self.__run__(self._get, args=[idx])
+    if result is None:
+      raise IndexError()
+
+    return result[0]
+
+  async def extend(self, vals, dedup=0, indirect=None, ttl=0):
+    vals = list(vals)
+    if not vals:
+      return range(0)
+
+    first, n = await self.__run__(self._push, args=[int(dedup), int(time.time()),
+                                                    -1 if indirect is None else int(indirect),
+                                                    int(ttl)] + vals)
+    return range(first, first + n)
+
+  async def resolve(self, vals):
+    refs = [i for i, val in enumerate(vals) if val is not None and val[:len(workqueue._REF)] ==
+            workqueue._REF]
+    vals = list(vals)
+    if refs:
+      keys = [vals[i][len(workqueue._REF):] for i in refs]
+      for i, key, payload in zip(refs, keys, await self._conn.mget(keys)):
+        if payload is None:
+          raise KeyError("Payload %s has expired" % (key.decode("utf-8"),))
+        vals[i] = payload
+
+    return vals
+
+  async def claim(self, cursor_key, inflight, n=1):
+    now = time.time()
+    result = await self.__run__(self._claim,
+                                keys=[cursor_key, inflight._key, inflight._attempts,
+                                      inflight._errors, inflight._dead_letter],
+                                args=[n, now, now + inflight._lease, inflight._max_attempts])
+    return [(int(idx), val) for idx, val in zip(result[::2], result[1::2])]
+
+  async def register(self, cursor_key, inflight):
+    await self._conn.hset(self._consumers, cursor_key, inflight._key)
+
+
+class _Inflight(workqueue._Inflight):
+  """Helper class. The coroutine counterparts of the :py:class:`workqueue._Inflight` operations."""
+
+  async def length(self):
+    return await self._conn.zcard(self._key)
+
+  async def ack(self, *idxs):
+    if idxs:
+      async with self._conn.pipeline(transaction=False) as p:
+        p.zrem(self._key, *idxs)
+        if self._attempts:
+          p.hdel(self._attempts, *idxs)
+        if self._errors:
+          p.hdel(self._errors, *idxs)
+        await p.execute()
+
+  async def nack(self, *idxs, error=None):
+    if idxs:
+      await self._list.__run__(self._nack,
+                               keys=[self._key, self._attempts, self._errors, self._dead_letter],
+                               args=[time.time(), self._backoff, self._max_backoff,
+                                     self._max_attempts, error or ""] + list(idxs))
+
+  async def renew(self, *idxs, lease=None):
+    if idxs:
+      lease = self._lease if lease is None else lease
+      await self._release(keys=[self._key], args=[time.time() + lease] + list(idxs))
+
+
+class _Signal(object):
+  """Helper class. A lazily made subscription to the channels on which producers announce appends.
+  See :py:class:`workqueue._Signal`."""
+
+  def __init__(self, conn, channels):
+    self._conn = conn
+    self._channels = channels
+    self._pubsub = None
+
+  async def wait(self, timeout):
+    if self._pubsub is None:
+      self._pubsub = self._conn.pubsub(ignore_subscribe_messages=True)
+      await self._pubsub.subscribe(*self._channels)
+
+    deadline = time.time() + timeout
+    while True:
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        return False
+
+      if await self._pubsub.get_message(timeout=remaining) is not None:
+        while await self._pubsub.get_message() is not None:
+          pass
+        return True
+
+
+class WorkItem(object):
+  """
+  Helper class to WorkQueue.
+
+  Represents a unit of work, as :py:class:`workqueue.WorkItem` does. Used as an `async with`
+  context manager, the item is completed if the block succeeds and aborted if it raises.
+  """
+
+  def __init__(self, inflight, list, idx, decoder=None, value=None):
+    self._inflight = inflight
+    self._list = list
+    self._idx = idx
+    self._decoder = decoder or (lambda x: x)
+    self._value = value
+
+  async def value(self):
+    if self._value is None or self._value[:len(workqueue._REF)] == workqueue._REF:
+      value = await self._list.get(self._idx) if self._value is None else self._value
+      self._value = (await self._list.resolve([value]))[0]
+    return self._decoder(self._value)
+
+  async def complete(self):
+    """Acknowledge this work item as processed, releasing its lease."""
+
+    await self._inflight.ack(self._idx)
+
+  async def abort(self, error=None):
+    """Admit a failure to process this work item and put it back on the queue."""
+
+    await self._inflight.nack(self._idx, error=error)
+
+  async def renew(self, lease=None):
+    """Extend the lease on this work item, for items which take a long time to process."""
+
+    await self._inflight.renew(self._idx, lease=lease)
+
+  async def __aenter__(self):
+    return await self.value()
+
+  async def __aexit__(self, type, value, traceback):
+    if type is None and value is None and traceback is None:
+      await self.complete()
+    else:
+      await self.abort(error="%s: %s" % (type.__name__, value))
+
+
+class WorkBatch(object):
+  """
+  Helper class to WorkQueue.
+
+  Represents a group of work items claimed at once, as :py:class:`workqueue.WorkBatch` does.
+  """
+
+  def __init__(self, inflight, idxs, values, decoder=None):
+    self._inflight = inflight
+    self._idxs = idxs
+    self._values = values
+    self._decoder = decoder or (lambda x: x)
+
+  def __len__(self):
+    return len(self._idxs)
+
+  async def value(self):
+    # Values the claim found missing are fetched again, which raises IndexError if they're trimmed
+    seq = self._inflight._list
+    self._values = await seq.resolve([await seq.get(idx) if value is None else value
+                                      for idx, value in zip(self._idxs, self._values)])
+    return [self._decoder(value) for value in self._values]
+
+  async def complete(self):
+    """Acknowledge every item in this batch as processed."""
+
+    await self._inflight.ack(*self._idxs)
+
+  async def abort(self, error=None):
+    """Admit a failure to process this batch and put all of it back on the queue."""
+
+    await self._inflight.nack(*self._idxs, error=error)
+
+  async def renew(self, lease=None):
+    """Extend the lease on every item in this batch."""
+
+    await self._inflight.renew(*self._idxs, lease=lease)
+
+  async def __aenter__(self):
+    return await self.value()
+
+  async def __aexit__(self, type, value, traceback):
+    if type is None and value is None and traceback is None:
+      await self.complete()
+    else:
+      await self.abort(error="%s: %s" % (type.__name__, value))
+
+
+class Producer(object):
+  """A writer to a durable FIFO queue. See :py:class:`workqueue.Producer`."""
+
+  def __init__(self, conn, key, encoder=None, segment_size=128, dedup=0, indirect=False,
+               payload_ttl=7 * 24 * 60 * 60):
+    self._conn = conn
+    self._list = _AppendSeq(conn, key, segment_size=segment_size)
+    self._encoder = encoder or (lambda x: x)
+    self._dedup = dedup
+    if indirect is True:
+      indirect = 0
+    elif indirect is False:
+      indirect = None
+    self._indirect = indirect
+    self._payload_ttl = payload_ttl
+
+  async def length(self):
+    return await self._list.length()
+
+  async def put(self, value):
+    """Enqueue a value, returning its index, or None if it was suppressed as a duplicate."""
+
+    idxs = await self.put_many([value])
+    if idxs:
+      return idxs[0]
+
+  async def put_many(self, values):
+    """Enqueue every value from an iterable in one round trip, returning the range of indices
+    they were assigned."""
+
+    return await self._list.extend((self._encoder(value) for value in values), dedup=self._dedup,
+                                   indirect=self._indirect, ttl=self._payload_ttl)
+
+
+class Consumer(object):
+  """A consumer over a durable FIFO queue. See :py:class:`workqueue.Consumer`.
+
+  A consumer must be registered with the queue before `Producer.trim` will retain the items it has
+  yet to acknowledge. Registration is a round trip, so it is made by the first claim rather than
+  by the constructor.
+  """
+
+  def __init__(self, conn, key, consumer_id, decoder=None, inflight=None, lease=300,
+               segment_size=128, max_attempts=0, backoff=0, max_backoff=3600, dead_letter=None):
+    self._conn = conn
+    self._list = _AppendSeq(conn, key, segment_size=segment_size)
+    self._key = consumer_id
+    self._inflight = _Inflight(self._list, inflight or "%s/inflight" % (consumer_id,),
+                               lease=lease, max_attempts=max_attempts, backoff=backoff,
+                               max_backoff=max_backoff, dead_letter=dead_letter)
+    self._decoder = decoder
+    self._signal = _Signal(conn, [self._list._channel])
+    self._registered = False
+
+  async def length(self):
+    """Returns the number of items this consumer has yet to claim."""
+
+    max_idx, cur_idx = await self._conn.mget(self._list._key, self._key)
+    return int(max_idx or "0") - int(cur_idx or "0")
+
+  async def wait(self, timeout):
+    """Wait until a producer signals that items were added, or `timeout` seconds pass."""
+
+    return await self._signal.wait(timeout)
+
+  async def _claim(self, n, timeout):
+    if not self._registered:
+      await self._list.register(self._key, self._inflight)
+      self._registered = True
+
+    if timeout:
+      deadline = time.time() + timeout
+      await self.wait(0)
+
+    while True:
+      claimed = await self._list.claim(self._key, self._inflight, n)
+      if claimed or not timeout or not await self.wait(deadline - time.time()):
+        return claimed
+
+  async def next(self, timeout=None):
+    """Claim the next item as a :py:class:`WorkItem`, or None if the queue is empty.
+
+    If `timeout` is given and the queue is empty, waits for up to `timeout` seconds for an item to
+    be added.
+    """
+
+    claimed = await self._claim(1, timeout)
+    if claimed:
+      [(idx, val)] = claimed
+      return WorkItem(self._inflight, self._list, idx, decoder=self._decoder, value=val)
+
+  async def next_batch(self, n, timeout=None):
+    """Claim up to `n` items at once as a single :py:class:`WorkBatch`, or None."""
+
+    claimed = await self._claim(n, timeout)
+    if claimed:
+      idxs, vals = zip(*claimed)
+      return WorkBatch(self._inflight, idxs, vals, decoder=self._decoder)
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self):
+    item = await self.next()
+    if item is None:
+      raise StopAsyncIteration
+    return item
+
+
+class WorkQueue(object):
+  """Provides `put` and `get` coroutines over a queue, using the same implicit shared consumer and
+  priority lanes as :py:class:`workqueue.WorkQueue`."""
+
+  def __init__(self, conn, key, inflight=None, indirect=False, decoder=None, encoder=None,
+               lease=300, segment_size=128, dedup=0, lanes=1, starvation_ratio=8,
+               max_attempts=0, backoff=0, max_backoff=3600, dead_letter=None,
+               consumer="implicit_consumer", payload_ttl=7 * 24 * 60 * 60):
+    self._conn = conn
+    self._producers = []
+    self._consumers = []
+    for lane in range(lanes):
+      lane_key = "%s/lane/%d" % (key, lane) if lane else key
+      lane_inflight = "%s/lane/%d" % (inflight, lane) if lane and inflight else inflight
+      self._producers.append(Producer(conn, lane_key, encoder=encoder,
+                                      segment_size=segment_size, dedup=dedup, indirect=indirect,
+                                      payload_ttl=payload_ttl))
+      self._consumers.append(Consumer(conn, lane_key, "%s/%s" % (lane_key, consumer),
+                                      decoder=decoder, inflight=lane_inflight, lease=lease,
+                                      segment_size=segment_size, max_attempts=max_attempts,
+                                      backoff=backoff, max_backoff=max_backoff,
+                                      dead_letter=dead_letter))
+
+    self._starvation_ratio = starvation_ratio
+    self._served = 0
+    self._signal = _Signal(conn, [consumer._list._channel for consumer in self._consumers])
+
+  async def length(self):
+    keys = []
+    for consumer in self._consumers:
+      keys.extend([consumer._list._key, consumer._key])
+    counts = [int(count or "0") for count in await self._conn.mget(keys)]
+    return sum(counts[::2]) - sum(counts[1::2])
+
+  def _lane(self, priority):
+    return self._producers[max(0, min(priority, len(self._producers) - 1))]
+
+  async def put(self, val, priority=0):
+    return await self._lane(priority).put(val)
+
+  async def put_many(self, vals, priority=0):
+    return await self._lane(priority).put_many(vals)
+
+  async def _claim(self, claim, timeout):
+    if timeout:
+      deadline = time.time() + timeout
+      await self._signal.wait(0)
+
+    while True:
+      if self._served % (self._starvation_ratio + 1) == self._starvation_ratio:
+        lanes = self._consumers
+      else:
+        lanes = reversed(self._consumers)
+
+      for consumer in lanes:
+        item = await claim(consumer)
+        if item is not None:
+          self._served += 1
+          return item
+
+      if not timeout or not await self._signal.wait(deadline - time.time()):
+        return None
+
+  async def get(self, timeout=None):
+    return await self._claim(lambda consumer: consumer.next(), timeout)
+
+  async def get_batch(self, n, timeout=None):
+    """Claim up to `n` items from a single lane."""
+
+    return await self._claim(lambda consumer: consumer.next_batch(n), timeout)
@@ -0,0 +1,81 @@
+"""
+Compressed on-disk archives of trimmed sequence segments.
+
+When a sequence with an archive is trimmed, each segment it drops from Redis is first written to
+its own gzip file in the archive directory, named by the segment number. Reads of indices which
+have been trimmed fall back to the archive, so consumers may still seek back and replay them.
+
+A segment file is the concatenation of the segment's values in index order, each prefixed with its
+length as a little-endian 64 bit integer.
+"""
+
+import gzip
+import os
+import struct
+
+
+_LENGTH = struct.Struct("<Q")
+
+# The length recorded for an index which had no value.
+_MISSING = 2 ** 64 - 1
+
+
+class SegmentArchive(object):
+  """A directory of archived segments.
+
+  The most recently read segment is kept in memory, so that replaying a run of archived indices
+  decompresses each segment once.
+  """
+
+  def __init__(self, path):
+    self._path = path
+    self._cached = (None, None)
+    os.makedirs(path, exist_ok=True)
+
+  def _file(self, seg):
+    return os.path.join(self._path, "%012x.seg.gz" % (seg,))
+
+  def segments(self):
+    """Returns the sorted list of archived segment numbers."""
+
+    return sorted(int(name.split(".")[0], 16) for name in os.listdir(self._path)
+                  if name.endswith(".seg.gz"))
+
+  def write(self, seg, values):
+    """Archive the list of values of a segment, replacing any previous archive of it."""
+
+    tmp = self._file(seg) + ".tmp"
+    with gzip.open(tmp, "wb") as f:
+      for value in values:
+        if value is None:
+          f.write(_LENGTH.pack(_MISSING))
+        else:
+          f.write(_LENGTH.pack(len(value)))
+          f.write(value)
+
+    os.replace(tmp, self._file(seg))
+
+  def read(self, seg):
+    """Returns the list of values of an archived segment, or None if it was never archived."""
+
+    if self._cached[0] == seg:
+      return self._cached[1]
+
+    try:
+      with gzip.open(self._file(seg), "rb") as f:
+        data = f.read()
+    except FileNotFoundError:
+      return None
+
+    values, offset = [], 0
+    while offset < len(data):
+      length, = _LENGTH.unpack_from(data, offset)
+      offset += _LENGTH.size
+      if length == _MISSING:
+        values.append(None)
+      else:
+        values.append(data[offset:offset + length])
+        offset += length
+
+    self._cached = (seg, values)
+    return values
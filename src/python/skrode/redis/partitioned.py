@@ -0,0 +1,227 @@
+"""
+A work queue spread over several sequences.
+
+Every producer and consumer of a :py:class:`skrode.redis.workqueue.WorkQueue` contends on the same
+length and cursor keys. A :py:class:`PartitionedQueue` instead spreads one logical queue over
+`partitions` sequences, optionally on several Redis instances, and routes each value to a
+partition by a stable hash of its routing key. Values with the same routing key always land in
+the same partition, and so are consumed in the order they were put.
+
+Consumers join the queue's membership set when they first claim, and each takes an even share of
+the partitions. Members renew their membership every `heartbeat / 3` seconds, and every renewal
+rebalances the partitions over the members which are still alive, so partitions move as workers
+join or leave. Each partition has a single shared cursor and in-flight set, so a partition which
+is briefly claimed by two members during a rebalance is safely shared, and the leases of a member
+which died are re-delivered to the partition's next owner when they expire.
+
+Retries, dead letters and windowed claims are configured as for a `WorkQueue`, and apply to each
+partition alike. The dead letters of a partition are buried on the partition's own Redis.
+"""
+
+import os
+import socket
+import time
+import zlib
+
+from skrode.redis.workqueue import _Signal, Consumer, Producer
+
+
+class PartitionedQueue(object):
+  """Provides `.put` and `.get` over a partitioned queue.
+
+  `conn` is either one Redis connection or a list of them, in which case partition `p` is stored
+  on `conn[p % len(conn)]`. Membership is tracked on the first connection. Partitions are stored
+  at `<key>/partition/<p>`, so the partition count of a queue may not be changed once it has items.
+
+  By default the routing key of a value is its encoded form; `route` may be given a function from
+  a value to its routing key instead, or `put` may be given a routing key directly. In YAML:
+
+  .. code-block:: yaml
+
+     tweet_id_queue:
+       &tweet_id_queue
+       !skrode/queue
+       backend: partitioned
+       conn: [*redis_a, *redis_b]
+       key: /queue/twitter/tweet_ids/ready
+       partitions: 16
+  """
+
+  def __init__(self, conn, key, inflight=None, indirect=False, decoder=None, encoder=None,
+               lease=300, segment_size=128, dedup=0, partitions=8, route=None, heartbeat=30,
+               member_id=None, payload_ttl=7 * 24 * 60 * 60, retain_items=None, retain_hours=None,
+               archive=None, max_attempts=0, backoff=0, max_backoff=3600, dead_letter=None,
+               window=1, ack_interval=None):
+    conns = conn if isinstance(conn, (list, tuple)) else [conn]
+    self._conn = conns[0]
+    self._encoder = encoder or (lambda x: x)
+    self._route = route
+    self._members = "%s/members" % (key,)
+    self._member_id = member_id or "%s:%d" % (socket.gethostname(), os.getpid())
+    self._heartbeat = heartbeat
+    self._rebalance_at = 0
+    self._assigned = []
+    self._signals = []
+    self._served = 0
+
+    self._producers = []
+    self._consumers = []
+    for partition in range(partitions):
+      partition_conn = conns[partition % len(conns)]
+      partition_key = "%s/partition/%d" % (key, partition)
+      partition_inflight = "%s/partition/%d" % (inflight, partition) if inflight else None
+      partition_archive = os.path.join(archive, "partition", str(partition)) if archive else None
+      # Values are encoded once when routed, so the partition producers pass them through
+      self._producers.append(Producer(partition_conn, partition_key, segment_size=segment_size,
+                                      dedup=dedup, indirect=indirect, payload_ttl=payload_ttl,
+                                      retain_items=retain_items, retain_hours=retain_hours,
+                                      archive=partition_archive))
+      self._consumers.append(Consumer(partition_conn, partition_key,
+                                      "%s/implicit_consumer" % (partition_key,),
+                                      decoder=decoder, inflight=partition_inflight, lease=lease,
+                                      segment_size=segment_size, max_attempts=max_attempts,
+                                      backoff=backoff, max_backoff=max_backoff,
+                                      dead_letter=dead_letter, archive=partition_archive,
+                                      window=window, ack_interval=ack_interval))
+
+  def __len__(self):
+    return sum(len(consumer) for consumer in self._consumers)
+
+  def _partition(self, routing_key):
+    if isinstance(routing_key, str):
+      routing_key = routing_key.encode("utf-8")
+    elif not isinstance(routing_key, bytes):
+      routing_key = str(routing_key).encode("utf-8")
+
+    # crc32 rather than hash(), which is salted per process
+    return zlib.crc32(routing_key) % len(self._producers)
+
+  def _routing_key(self, val, encoded):
+    return self._route(val) if self._route else encoded
+
+  def put(self, val, key=None, priority=0):
+    """Enqueue a value on the partition of `key`, or of its routing key. `priority` is ignored."""
+
+    encoded = self._encoder(val)
+    partition = self._partition(self._routing_key(val, encoded) if key is None else key)
+    return self._producers[partition].put(encoded)
+
+  def put_many(self, vals, priority=0):
+    """Enqueue every value from an iterable, with one round trip per partition written to.
+
+    Returns a dict of each partition written to, to the range of indices its values were assigned
+    as `Producer.put_many` returns. `priority` is ignored.
+    """
+
+    routed = {}
+    for val in vals:
+      encoded = self._encoder(val)
+      routed.setdefault(self._partition(self._routing_key(val, encoded)), []).append(encoded)
+
+    return {partition: self._producers[partition].put_many(encoded)
+            for partition, encoded in routed.items()}
+
+  def trim(self):
+    return sum(producer.trim() for producer in self._producers)
+
+  def flush(self):
+    """Send any acknowledgements held back by the window."""
+
+    for consumer in self._consumers:
+      consumer.flush()
+
+  def assigned(self):
+    """Returns the partitions this member currently consumes, rebalancing if it is due."""
+
+    now = time.time()
+    if now < self._rebalance_at:
+      return self._assigned
+
+    with self._conn.pipeline(transaction=False) as p:
+      p.execute_command("ZADD", self._members, now + self._heartbeat, self._member_id)
+      p.zremrangebyscore(self._members, "-inf", now)
+      p.zrange(self._members, 0, -1)
+      # Sorted by name rather than by deadline, so that renewals don't reorder the members
+      members = sorted(member.decode("utf-8") for member in p.execute()[-1])
+
+    me, count = members.index(self._member_id), len(members)
+    assigned = [partition for partition in range(len(self._consumers))
+                if partition % count == me]
+    if assigned != self._assigned:
+      self._assigned = assigned
+      self._signals = self._make_signals(assigned)
+
+    self._rebalance_at = now + self._heartbeat / 3.0
+    return self._assigned
+
+  def _make_signals(self, partitions):
+    """Make one append signal for the assigned partitions on each distinct connection."""
+
+    channels = {}
+    for partition in partitions:
+      consumer = self._consumers[partition]
+      conn, chans = channels.setdefault(id(consumer._conn), (consumer._conn, []))
+      chans.append(consumer._list._channel)
+
+    return [_Signal(conn, chans) for conn, chans in channels.values()]
+
+  def leave(self):
+    """Drop out of the queue's membership, so that the other members take over its partitions."""
+
+    self._conn.zrem(self._members, self._member_id)
+    self._rebalance_at = 0
+    self._assigned = []
+    self._signals = []
+
+  def _wait(self, timeout):
+    if not self._signals:
+      # There are more members than partitions, and this one has nothing to do
+      time.sleep(timeout)
+      return False
+
+    elif len(self._signals) == 1:
+      return self._signals[0].wait(timeout)
+
+    # Subscriptions on different servers can't be waited on together, so take turns
+    deadline = time.time() + timeout
+    while True:
+      for signal in self._signals:
+        if signal.wait(min(0.1, max(0, deadline - time.time()))):
+          return True
+
+      if time.time() >= deadline:
+        return False
+
+  def _claim(self, claim, timeout):
+    if timeout:
+      deadline = time.time() + timeout
+      # Subscribe before the first claim, so an item added between the two isn't missed
+      self.assigned()
+      self._wait(0)
+
+    while True:
+      assigned = self.assigned()
+      # Start from a different partition each time, so that none is starved
+      for i in range(len(assigned)):
+        partition = assigned[(self._served + i) % len(assigned)]
+        try:
+          item = claim(self._consumers[partition])
+          self._served += 1
+          return item
+        except StopIteration:
+          continue
+
+      remaining = deadline - time.time() if timeout else 0
+      if remaining <= 0:
+        return None
+
+      # Wake for the next rebalance, even if nothing is put on the assigned partitions
+      self._wait(min(remaining, self._heartbeat / 3.0))
+
+  def get(self, timeout=None):
+    return self._claim(lambda consumer: consumer.next(), timeout)
+
+  def get_batch(self, n, timeout=None):
+    """Claim up to `n` items from a single partition."""
+
+    return self._claim(lambda consumer: consumer.next_batch(n), timeout)
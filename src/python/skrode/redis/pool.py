@@ -0,0 +1,74 @@
+"""
+A process-wide registry of Redis connection pools.
+
+Every `!skrode/redis` node used to build its own client with its own connection pool, so a worker
+whose config named several queues on the same Redis held a socket per node. Clients made with
+:py:func:`get_redis` share one bounded pool per host, port and db instead. When the pool is
+exhausted, callers block for up to `timeout` seconds for a connection to be released rather than
+opening another socket.
+
+Pools are per process. A pool inherited across a fork drops the parent's connections and starts
+counting afresh on its first use in the child, which redis-py detects by pid.
+"""
+
+import redis
+
+
+_POOLS = {}
+
+
+class _Pool(redis.BlockingConnectionPool):
+  """Helper class. A blocking connection pool which counts connections made and checked out."""
+
+  def reset(self):
+    super(_Pool, self).reset()
+    self.created = 0
+    self.checkouts = 0
+
+  def make_connection(self):
+    self.created += 1
+    return super(_Pool, self).make_connection()
+
+  def get_connection(self, *args, **kwargs):
+    self.checkouts += 1
+    return super(_Pool, self).get_connection(*args, **kwargs)
+
+  def stats(self):
+    return {
+      "max_connections": self.max_connections,
+      "created": self.created,
+      "checkouts": self.checkouts,
+      "reused": self.checkouts - self.created,
+    }
+
+
+def connection_pool(host="localhost", port=6379, db=0, max_connections=50, timeout=20, **kwargs):
+  """Return the shared connection pool for a Redis database, making it if need be.
+
+  The first call for a database determines the options of its pool; later calls for the same
+  host, port and db get the same pool regardless of the options they give.
+  """
+
+  key = (host, int(port), int(db))
+  if key not in _POOLS:
+    _POOLS[key] = _Pool(host=host, port=int(port), db=int(db), max_connections=max_connections,
+                        timeout=timeout, **kwargs)
+
+  return _POOLS[key]
+
+
+def get_redis(host="localhost", port=6379, db=0, max_connections=50, timeout=20, **kwargs):
+  """Return a client over the shared connection pool for a Redis database.
+
+  Takes the same options as :py:func:`connection_pool`.
+  """
+
+  return redis.StrictRedis(connection_pool=connection_pool(host=host, port=port, db=db,
+                                                           max_connections=max_connections,
+                                                           timeout=timeout, **kwargs))
+
+
+def pool_stats():
+  """Returns a dict of the connection reuse statistics of every pool, by host, port and db."""
+
+  return {key: pool.stats() for key, pool in _POOLS.items()}
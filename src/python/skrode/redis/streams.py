@@ -0,0 +1,397 @@
+"""
+A durable queue backed by Redis Streams.
+
+An alternative to :py:mod:`skrode.redis.workqueue` providing the same `Producer`, `Consumer`,
+`WorkItem`, `WorkBatch` and `WorkQueue` interfaces. Each named consumer is a stream consumer group,
+so any number of processes may compete for the items of a consumer without sharing a cursor key;
+Redis tracks which entries each process has been delivered in the group's pending entries list.
+
+Requires Redis 6.2 or later (for XAUTOCLAIM). The stream commands are issued with
+`execute_command`, as older Redis clients don't wrap them. Newer clients parse some stream replies
+into dicts, so the replies are decoded to tolerate both shapes.
+"""
+
+import os
+import socket
+
+from redis import ResponseError
+
+
+# The field under which each stream entry stores its value.
+_FIELD = b"v"
+
+# Sets the idle time of pending entries, which is how long their lease has been held.
+#
+# Issued as a script so that clients which parse XCLAIM replies don't have to be told JUSTID.
+#
+# KEYS[1] - the stream key
+# ARGV[1] - the consumer group
+# ARGV[2] - the consumer name
+# ARGV[3] - the idle time to set, in milliseconds
+# ARGV[4...] - the pending entry IDs
+_IDLE_SCRIPT = """
+return #redis.call('XCLAIM', KEYS[1], ARGV[1], ARGV[2], 0, unpack(ARGV, 4, #ARGV),
+                   'IDLE', ARGV[3], 'JUSTID')
+"""
+
+# Counts the entries of a stream after an entry ID, a page at a time. Redis 7.0 reports this as the
+# `lag` of a consumer group, but older servers don't.
+#
+# KEYS[1] - the stream key
+# ARGV[1] - the entry ID to count after
+_BACKLOG_SCRIPT = """
+local count, start = 0, '(' .. ARGV[1]
+while true do
+  local entries = redis.call('XRANGE', KEYS[1], start, '+', 'COUNT', 1000)
+  count = count + #entries
+  if #entries < 1000 then
+    return count
+  end
+  start = '(' .. entries[#entries][1]
+end
+"""
+
+
+def _info(reply):
+  """Decode a flat field, value list reply into a dict with string keys."""
+
+  if not isinstance(reply, dict):
+    reply = dict(zip(reply[::2], reply[1::2]))
+
+  return {(k.decode("utf-8") if isinstance(k, bytes) else k): v
+          for k, v in reply.items()}
+
+
+def _entries(entries):
+  """Decode a list of stream entries into pairs of entry ID and value.
+
+  Entries which have been trimmed out from under the pending entries list have no fields, and are
+  dropped.
+  """
+
+  return [(id, _info(fields)[_FIELD.decode("utf-8")])
+          for id, fields in entries
+          if fields]
+
+
+class _Group(object):
+  """Helper class.
+
+  A stream consumer group, which plays the role of both the cursor and the in-flight set of a
+  sequence consumer. Entries are leased to a named consumer process within the group when they
+  are read, and stay in the group's pending entries list until they are acknowledged. Pending
+  entries which have been idle for longer than the lease are re-delivered by the next claim.
+  """
+
+  def __init__(self, conn, key, group, lease=300):
+    self._conn = conn
+    self._key = key
+    self._group = group
+    self._lease = lease
+    self._name = "%s:%d" % (socket.gethostname(), os.getpid())
+    # Where the scan of the pending entries list for expired leases is to resume
+    self._cursor = "0-0"
+    self._idle = conn.register_script(_IDLE_SCRIPT)
+    self._backlog = conn.register_script(_BACKLOG_SCRIPT)
+
+    try:
+      self._conn.execute_command("XGROUP", "CREATE", key, group, "0", "MKSTREAM")
+    except ResponseError as e:
+      if "BUSYGROUP" not in str(e):
+        raise
+
+  def claim(self, n=1, timeout=None):
+    """Claim up to `n` entries, returning a list of pairs of entry ID and value.
+
+    Expired leases are re-delivered first, scanning the pending entries list on from where the last
+    claim left off. If there are none and no new entries and `timeout` is given, blocks for up to
+    `timeout` seconds for new entries to be added.
+    """
+
+    self._cursor, entries = self._conn.execute_command("XAUTOCLAIM", self._key, self._group,
+                                                       self._name, int(self._lease * 1000),
+                                                       self._cursor, "COUNT", n)[:2]
+    claimed = _entries(entries)
+
+    if len(claimed) < n:
+      block = ["BLOCK", int(timeout * 1000)] if timeout and not claimed else []
+      reply = self._conn.execute_command("XREADGROUP", "GROUP", self._group, self._name,
+                                         "COUNT", n - len(claimed), *block,
+                                         "STREAMS", self._key, ">")
+      for _, entries in reply or []:
+        claimed.extend(_entries(entries))
+
+    return claimed
+
+  def ack(self, *ids):
+    """Acknowledge the given entries, removing them from the pending entries list."""
+
+    if ids:
+      self._conn.execute_command("XACK", self._key, self._group, *ids)
+
+  def nack(self, *ids):
+    """Expire the leases on the given entries, so that they are re-delivered immediately."""
+
+    if ids:
+      self._idle(keys=[self._key],
+                 args=[self._group, self._name, int(self._lease * 1000)] + list(ids))
+
+  def renew(self, *ids, lease=None):
+    """Reset the lease on the given entries, or leave `lease` seconds of it if given.
+
+    A lease is how long an entry may stay idle before it is re-delivered, so a `lease` longer than
+    the group's is cut to the group's.
+    """
+
+    if ids:
+      idle = 0 if lease is None else max(0, int((self._lease - lease) * 1000))
+      self._idle(keys=[self._key], args=[self._group, self._name, idle] + list(ids))
+
+  def lag(self):
+    """The number of entries in the stream which have yet to be delivered to this group."""
+
+    for group in self._conn.execute_command("XINFO", "GROUPS", self._key):
+      group = _info(group)
+      if group["name"] in (self._group, self._group.encode("utf-8")):
+        # Redis 7.0 reports the lag when it can, which is unless entries have been deleted
+        if group.get("lag") is not None:
+          return group["lag"]
+        return self._backlog(keys=[self._key], args=[group["last-delivered-id"]])
+
+    return 0
+
+
+class WorkItem(object):
+  """
+  Helper class to WorkQueue.
+
+  Represents a single stream entry claimed by a consumer. See
+  :py:class:`skrode.redis.workqueue.WorkItem`.
+  """
+
+  def __init__(self, group, id, value, decoder=None):
+    self._group = group
+    self._id = id
+    self._value = value
+    self._decoder = decoder or (lambda x: x)
+
+  @property
+  def value(self):
+    return self._decoder(self._value)
+
+  def complete(self):
+    """Acknowledge this work item as processed."""
+
+    self._group.ack(self._id)
+
+  def abort(self, error=None):
+    """Admit a failure to process this work item and put it back on the queue.
+
+    Items of this queue aren't dead lettered, so `error` is ignored.
+    """
+
+    self._group.nack(self._id)
+
+  def renew(self, lease=None):
+    """Extend the lease on this work item, for items which take a long time to process."""
+
+    self._group.renew(self._id, lease=lease)
+
+  def __enter__(self):
+    return self.value
+
+  def __exit__(self, type, value, traceback):
+    if type is None and value is None and traceback is None:
+      self.complete()
+    else:
+      self.abort()
+
+
+class WorkBatch(object):
+  """
+  Helper class to WorkQueue.
+
+  Represents a group of stream entries claimed at once. See
+  :py:class:`skrode.redis.workqueue.WorkBatch`.
+  """
+
+  def __init__(self, group, ids, values, decoder=None):
+    self._group = group
+    self._ids = ids
+    self._values = values
+    self._decoder = decoder or (lambda x: x)
+
+  def __len__(self):
+    return len(self._ids)
+
+  @property
+  def value(self):
+    return [self._decoder(value) for value in self._values]
+
+  def complete(self):
+    """Acknowledge every item in this batch as processed."""
+
+    self._group.ack(*self._ids)
+
+  def abort(self, error=None):
+    """Admit a failure to process this batch and put all of it back on the queue.
+
+    Items of this queue aren't dead lettered, so `error` is ignored.
+    """
+
+    self._group.nack(*self._ids)
+
+  def renew(self, lease=None):
+    """Extend the lease on every item in this batch."""
+
+    self._group.renew(*self._ids, lease=lease)
+
+  def __enter__(self):
+    return self.value
+
+  def __exit__(self, type, value, traceback):
+    if type is None and value is None and traceback is None:
+      self.complete()
+    else:
+      self.abort()
+
+
+class Producer(object):
+  """A helper type which represents a writer to a stream.
+
+  If `maxlen` is given, the stream is approximately capped to that many entries as it is written,
+  regardless of whether they have been consumed.
+  """
+
+  def __init__(self, conn, key, encoder=None, maxlen=None):
+    self._conn = conn
+    self._key = key
+    self._encoder = encoder or (lambda x: x)
+    self._cap = ["MAXLEN", "~", maxlen] if maxlen else []
+
+  def __len__(self):
+    return self._conn.execute_command("XLEN", self._key)
+
+  def put(self, value):
+    """Enqueue a value, returning its entry ID."""
+
+    return self._conn.execute_command("XADD", self._key, *self._cap + ["*", _FIELD,
+                                                                       self._encoder(value)])
+
+  def put_many(self, values):
+    """Enqueue every value from an iterable in one round trip, returning their entry IDs."""
+
+    with self._conn.pipeline(transaction=False) as p:
+      for value in values:
+        p.execute_command("XADD", self._key, *self._cap + ["*", _FIELD, self._encoder(value)])
+      return p.execute()
+
+  def trim(self):
+    """Drop every entry which all consumer groups have been delivered and acknowledged."""
+
+    low = None
+    for group in self._conn.execute_command("XINFO", "GROUPS", self._key):
+      group = _info(group)
+      pending = self._conn.execute_command("XPENDING", self._key, group["name"])
+      if isinstance(pending, dict):
+        pending = [pending["pending"], pending["min"]]
+
+      # The group's oldest pending entry, or the entry after the last one it was delivered
+      if pending[0]:
+        mark = pending[1]
+      else:
+        ms, seq = group["last-delivered-id"].split(b"-")
+        mark = b"%s-%d" % (ms, int(seq) + 1)
+
+      if low is None or tuple(map(int, mark.split(b"-"))) < tuple(map(int, low.split(b"-"))):
+        low = mark
+
+    if low is not None:
+      return self._conn.execute_command("XTRIM", self._key, "MINID", low)
+
+    return 0
+
+
+class Consumer(object):
+  """A helper type which represents a consumer group over a stream.
+
+  Every process constructing a Consumer with the same `consumer_id` joins the same group, and
+  competes for its entries. See :py:class:`skrode.redis.workqueue.Consumer`.
+  """
+
+  def __init__(self, conn, key, consumer_id, decoder=None, lease=300):
+    self._conn = conn
+    self._group = _Group(conn, key, consumer_id, lease=lease)
+    self._decoder = decoder
+
+  def __iter__(self):
+    return self
+
+  def __len__(self):
+    """Returns the number of items this consumer has yet to claim."""
+
+    return self._group.lag()
+
+  def next(self, timeout=None):
+    """Claim the next item as a :py:class:`WorkItem`.
+
+    If `timeout` is given and the stream is empty, blocks for up to `timeout` seconds waiting for
+    an item to be added.
+    """
+
+    claimed = self._group.claim(1, timeout)
+    if not claimed:
+      raise StopIteration
+
+    [(id, val)] = claimed
+    return WorkItem(self._group, id, val, decoder=self._decoder)
+
+  def next_batch(self, n, timeout=None):
+    """Claim up to `n` items at once, returning them as a single :py:class:`WorkBatch`."""
+
+    claimed = self._group.claim(n, timeout)
+    if not claimed:
+      raise StopIteration
+
+    ids, vals = zip(*claimed)
+    return WorkBatch(self._group, ids, vals, decoder=self._decoder)
+
+
+class WorkQueue(object):
+  """Provides `.put` and `.get` over a stream, using a single implicit consumer group.
+
+  Accepts (and ignores) the `inflight` key of the sequence backed queue, so that a queue's YAML
+  configuration may switch backends by adding `backend: streams`.
+  """
+
+  def __init__(self, conn, key, inflight=None, indirect=False, decoder=None, encoder=None,
+               lease=300, maxlen=None):
+    self._conn = conn
+    self._producer = Producer(conn, key, encoder=encoder, maxlen=maxlen)
+    self._consumer = Consumer(conn, key, "implicit_consumer", decoder=decoder, lease=lease)
+
+  def __len__(self):
+    return len(self._consumer)
+
+  def put(self, val, priority=0):
+    """Enqueue a value. This queue has a single lane, so `priority` is ignored."""
+
+    return self._producer.put(val)
+
+  def put_many(self, vals, priority=0):
+    return self._producer.put_many(vals)
+
+  def trim(self):
+    return self._producer.trim()
+
+  def get(self, timeout=None):
+    try:
+      return self._consumer.next(timeout=timeout)
+    except StopIteration:
+      return None
+
+  def get_batch(self, n, timeout=None):
+    try:
+      return self._consumer.next_batch(n, timeout=timeout)
+    except StopIteration:
+      return None
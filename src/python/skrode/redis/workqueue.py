@@ -1,8 +1,377 @@
 """
 A simple durable queue backed by Redis.
+
+All of the mutating operations on the queue are implemented as server-side Lua scripts, so that
+each push or claim is a single atomic round trip rather than a WATCH/MULTI transaction which has to
+be retried whenever another client touches the same keys.
+"""
+
+import os
+import time
+
+from skrode.redis.archive import SegmentArchive
+
+
+# The marker starting a claim check element, followed by the key of its payload.
+_REF = b"\0skrode-ref:"
+
+# The marker starting a dead letter buried after its element was archived, followed by the index
+# and key of the sequence it was buried from.
+_ARCHIVED = b"\0skrode-archived:"
+
+# Shared helpers, prepended to every script which touches sequence elements.
+#
+# Every such script takes the element key suffix as ARGV[1] and the segment size as ARGV[2], and
+# the sequence length key as KEYS[1]. A segment size of 0 selects the flat layout of one key per
+# element, otherwise elements are stored as fields of one hash per segment. Elements missing from
+# their segment are read from their flat key, so that a sequence written before it was segmented
+# stays readable. The helpers take the length key of the sequence to operate on, so that a script
+# may also write to a second sequence with the same layout.
+#
+# Elements which are claim checks (see `_AppendSeq`) hold a reference to the key of their payload,
+# and each payload counts the elements referring to it in its `refs` key.
+_PRELUDE = """
+local base, suffix, segsize = KEYS[1], ARGV[1], tonumber(ARGV[2])
+
+local function segment_key(seq, seg)
+  return seq .. suffix .. 'segment' .. suffix .. string.format('%012x', seg)
+end
+
+-- The key of an element stored in the flat layout, which segmented sequences still read elements
+-- appended before they were segmented from.
+local function flat_key(seq, idx)
+  return seq .. suffix .. string.format('%016x', idx)
+end
+
+local function put(seq, idx, val)
+  if segsize > 0 then
+    local seg, field = math.floor(idx / segsize), string.format('%x', idx % segsize)
+    redis.call('HSET', segment_key(seq, seg), field, val)
+  else
+    redis.call('SET', flat_key(seq, idx), val)
+  end
+end
+
+local function notify(seq, idx)
+  redis.call('PUBLISH', seq .. suffix .. 'notify', idx)
+end
+
+local function fetch(seq, idx)
+  if segsize > 0 then
+    local seg, field = math.floor(idx / segsize), string.format('%x', idx % segsize)
+    local val = redis.call('HGET', segment_key(seq, seg), field)
+    if val then
+      return val
+    end
+  end
+  return redis.call('GET', flat_key(seq, idx))
+end
+
+local REF = '\\0skrode-ref:'
+local ARCHIVED = '\\0skrode-archived:'
+
+local function payload_key(val)
+  if val and string.sub(val, 1, #REF) == REF then
+    return string.sub(val, #REF + 1)
+  end
+end
+
+-- Counts a new element referring to a payload, if the value is a claim check.
+local function retain(val)
+  local payload = payload_key(val)
+  if payload then
+    redis.call('INCR', payload .. suffix .. 'refs')
+  end
+end
+
+-- Counts an element referring to a payload being dropped, dropping the payload with the last.
+local function release(val)
+  local payload = payload_key(val)
+  if payload and redis.call('DECR', payload .. suffix .. 'refs') <= 0 then
+    redis.call('DEL', payload, payload .. suffix .. 'refs')
+  end
+end
+
+-- Moves a leased index of the sequence to the end of a dead letter sequence, along with the last
+-- error recorded against it, dropping its lease.
+--
+-- An element which has been trimmed into the archive, which only clients may read, is buried as
+-- a reference to its index instead.
+local function bury(inflight, attempts, errors, dead_letter, idx)
+  local buried = redis.call('INCR', dead_letter) - 1
+  local val = fetch(base, tonumber(idx)) or ARCHIVED .. idx .. ':' .. base
+  retain(val)
+  put(dead_letter, buried, val)
+  notify(dead_letter, buried)
+
+  local err = errors ~= '' and redis.call('HGET', errors, idx)
+  if err then
+    redis.call('HSET', dead_letter .. suffix .. 'errors', buried, err)
+    redis.call('HDEL', errors, idx)
+  end
+  if attempts ~= '' then
+    redis.call('HDEL', attempts, idx)
+  end
+  redis.call('ZREM', inflight, idx)
+end
+"""
+
+# Appends values to the sequence as a single contiguous range, notifying any blocked consumers.
+#
+# If ARGV[3] is positive, each value is first recorded in a marker key which expires after that
+# many seconds, and values which already have a marker are counted as suppressed duplicates rather
+# than being appended.
+#
+# The first index appended in each second is recorded in the `times` sorted set, scored by the
+# time, so that consumers may seek by time.
+#
+# If ARGV[5] is not negative, values longer than that many bytes are stored once in a payload key
+# named by their hash, which expires after ARGV[6] seconds if that is positive, and a claim check
+# referring to the payload is appended in their place.
+#
+# ARGV[3] - the deduplication window in seconds, or 0 to append every value
+# ARGV[4] - the current time in whole seconds
+# ARGV[5] - the size above which values are stored as payloads, or -1
+# ARGV[6] - the expiry of payloads in seconds, or 0
+# ARGV[7...] - the values to append
+#
+# Returns a pair of the index of the first appended value and the number of values appended.
+_PUSH_SCRIPT = _PRELUDE + """
+local window, now = tonumber(ARGV[3]), tonumber(ARGV[4])
+local threshold, ttl = tonumber(ARGV[5]), tonumber(ARGV[6])
+local vals = {}
+for i = 7, #ARGV do
+  local val = ARGV[i]
+  if window <= 0 or
+     redis.call('SET', base .. suffix .. 'dedup' .. suffix .. redis.sha1hex(val), 1,
+                'NX', 'EX', window) then
+    if threshold >= 0 and #val > threshold and not payload_key(val) then
+      local payload = base .. suffix .. 'payload' .. suffix .. redis.sha1hex(val)
+      redis.call('SET', payload, val)
+      val = REF .. payload
+    end
+
+    local payload = payload_key(val)
+    if payload then
+      retain(val)
+      if ttl > 0 then
+        redis.call('EXPIRE', payload, ttl)
+        redis.call('EXPIRE', payload .. suffix .. 'refs', ttl)
+      end
+    end
+    table.insert(vals, val)
+  end
+end
+
+local suppressed = #ARGV - 6 - #vals
+if suppressed > 0 then
+  redis.call('INCRBY', base .. suffix .. 'suppressed', suppressed)
+end
+
+if #vals == 0 then
+  return {tonumber(redis.call('GET', base) or '0'), 0}
+end
+
+local first = redis.call('INCRBY', base, #vals) - #vals
+for i, val in ipairs(vals) do
+  put(base, first + i - 1, val)
+end
+
+local times = base .. suffix .. 'times'
+local latest = redis.call('ZREVRANGE', times, 0, 0, 'WITHSCORES')
+if #latest == 0 or tonumber(latest[2]) < now then
+  redis.call('ZADD', times, now, first)
+end
+
+notify(base, first)
+return {first, #vals}
+"""
+
+# Fetches a single element of the sequence, if it exists.
+#
+# ARGV[3] - the index to fetch
+#
+# Returns a singleton list of the value, or nil if the index is out of bounds.
+_GET_SCRIPT = _PRELUDE + """
+local max_idx = tonumber(redis.call('GET', base) or '0')
+local idx = tonumber(ARGV[3])
+local val = idx < max_idx and fetch(base, idx)
+if not val then
+  return false
+end
+return {val}
 """
 
-from redis import WatchError
+# Claims up to ARGV[3] elements of the sequence for a consumer, leasing each until ARGV[5].
+#
+# Claimed indices whose lease expired before ARGV[4] are re-delivered first, and the remainder of
+# the claim is made by advancing the consumer's cursor. If attempts are being counted, every claim
+# of an index counts as an attempt, and an expired index which has already used its ARGV[6]
+# attempts is moved to the dead letter sequence instead of being re-delivered.
+#
+# KEYS[2] - the consumer's cursor key
+# KEYS[3] - the consumer's in-flight sorted set of index to lease deadline
+# KEYS[4] - the hash of index to attempts, or '' to not count attempts
+# KEYS[5] - the hash of index to last error, or ''
+# KEYS[6] - the dead letter sequence length key, or '' to retry forever
+# ARGV[3] - the maximum number of elements to claim
+# ARGV[4] - the current time
+# ARGV[5] - the deadline of the new leases
+# ARGV[6] - the number of attempts after which an index is dead lettered
+#
+# Returns a flat list of claimed index, value pairs.
+_CLAIM_SCRIPT = _PRELUDE + """
+local n, max_attempts = tonumber(ARGV[3]), tonumber(ARGV[6])
+local idxs = {}
+for _, idx in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[4], 'LIMIT', 0, n)) do
+  if KEYS[4] ~= '' and KEYS[6] ~= '' and
+     tonumber(redis.call('HGET', KEYS[4], idx) or '0') >= max_attempts then
+    bury(KEYS[3], KEYS[4], KEYS[5], KEYS[6], idx)
+  else
+    table.insert(idxs, tonumber(idx))
+  end
+end
+
+local max_idx = tonumber(redis.call('GET', base) or '0')
+local cur_idx = tonumber(redis.call('GET', KEYS[2]) or '0')
+local fresh = math.min(n - #idxs, max_idx - cur_idx)
+if fresh > 0 then
+  redis.call('INCRBY', KEYS[2], fresh)
+  for i = 0, fresh - 1 do
+    table.insert(idxs, cur_idx + i)
+  end
+end
+
+local result = {}
+for _, idx in ipairs(idxs) do
+  local member = string.format('%d', idx)
+  redis.call('ZADD', KEYS[3], ARGV[5], member)
+  if KEYS[4] ~= '' then
+    redis.call('HINCRBY', KEYS[4], member, 1)
+  end
+  table.insert(result, idx)
+  table.insert(result, fetch(base, idx))
+end
+return result
+"""
+
+# Gives back leased indices after a failure to process them.
+#
+# Each index is made available for re-delivery after an exponential backoff in the number of
+# attempts made on it, unless it has used all of its attempts in which case it is moved to the
+# dead letter sequence.
+#
+# KEYS[2] - the in-flight sorted set of index to lease deadline
+# KEYS[3] - the hash of index to attempts, or ''
+# KEYS[4] - the hash of index to last error, or ''
+# KEYS[5] - the dead letter sequence length key, or ''
+# ARGV[3] - the current time
+# ARGV[4] - the backoff after the first attempt, in seconds
+# ARGV[5] - the maximum backoff, in seconds
+# ARGV[6] - the number of attempts after which an index is dead lettered
+# ARGV[7] - a description of the error, or ''
+# ARGV[8...] - the leased indices
+_NACK_SCRIPT = _PRELUDE + """
+local now, backoff, max_backoff = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local max_attempts = tonumber(ARGV[6])
+for i = 8, #ARGV do
+  local idx = ARGV[i]
+  if redis.call('ZSCORE', KEYS[2], idx) then
+    local attempts = tonumber(KEYS[3] ~= '' and redis.call('HGET', KEYS[3], idx) or '1')
+    if KEYS[4] ~= '' and ARGV[7] ~= '' then
+      redis.call('HSET', KEYS[4], idx, ARGV[7])
+    end
+
+    if KEYS[5] ~= '' and attempts >= max_attempts then
+      bury(KEYS[2], KEYS[3], KEYS[4], KEYS[5], idx)
+    else
+      redis.call('ZADD', KEYS[2], now + math.min(backoff * 2 ^ (attempts - 1), max_backoff), idx)
+    end
+  end
+end
+"""
+
+# Drops every whole segment below the lowest index any registered consumer may still claim, and
+# below the retention limit, along with their entries in the `times` index.
+#
+# KEYS[2] - the hash of registered consumer cursor keys to their in-flight keys
+# KEYS[3] - the key recording the first segment which has not been trimmed
+# ARGV[3] - the index below which elements may be dropped, or -1 for no limit
+# ARGV[4] - 1 to only plan the trim
+#
+# Returns the number of segments dropped, or when planning the pair of the first segment and the
+# segment after the last which would be dropped.
+_TRIM_SCRIPT = _PRELUDE + """
+local low = tonumber(redis.call('GET', base) or '0')
+local consumers = redis.call('HGETALL', KEYS[2])
+for i = 1, #consumers, 2 do
+  low = math.min(low, tonumber(redis.call('GET', consumers[i]) or '0'))
+  for _, idx in ipairs(redis.call('ZRANGE', consumers[i + 1], 0, -1)) do
+    low = math.min(low, tonumber(idx))
+  end
+end
+if tonumber(ARGV[3]) >= 0 then
+  low = math.min(low, tonumber(ARGV[3]))
+end
+
+local first = tonumber(redis.call('GET', KEYS[3]) or '0')
+local last = math.floor(low / segsize)
+if ARGV[4] == '1' then
+  return {first, math.max(first, last)}
+end
+
+for seg = first, last - 1 do
+  local key = segment_key(base, seg)
+  for _, val in ipairs(redis.call('HVALS', key)) do
+    release(val)
+  end
+  redis.call('DEL', key)
+
+  -- Elements appended before the queue was segmented are in the flat layout, and may share their
+  -- segment with later ones. Fetched in chunks, as unpack is bounded by the Lua stack.
+  for start = seg * segsize, (seg + 1) * segsize - 1, 1000 do
+    local keys = {}
+    for idx = start, math.min(start + 999, (seg + 1) * segsize - 1) do
+      keys[#keys + 1] = flat_key(base, idx)
+    end
+    local present = {}
+    for i, val in ipairs(redis.call('MGET', unpack(keys))) do
+      if val then
+        release(val)
+        present[#present + 1] = keys[i]
+      end
+    end
+    if #present > 0 then
+      redis.call('DEL', unpack(present))
+    end
+  end
+end
+if last > first then
+  local times = base .. suffix .. 'times'
+  while true do
+    local oldest = redis.call('ZRANGE', times, 0, 0)
+    if #oldest == 0 or tonumber(oldest[1]) >= last * segsize then
+      break
+    end
+    redis.call('ZREM', times, oldest[1])
+  end
+
+  redis.call('SET', KEYS[3], last)
+  return last - first
+end
+return 0
+"""
+
+# Moves the deadline of existing leases.
+#
+# KEYS[1] - the in-flight sorted set of index to lease deadline
+# ARGV[1] - the new deadline
+# ARGV[2...] - the leased indices
+_RELEASE_SCRIPT = """
+for i = 2, #ARGV do
+  redis.call('ZADD', KEYS[1], 'XX', ARGV[1], ARGV[i])
+end
+"""
 
 
 class _AppendSeq(object):
@@ -14,19 +383,57 @@ class _AppendSeq(object):
 
   Skrode needs atomic append, and constant time access to indexed sequence elements.
 
-  This is implemented by using a single key to track the length of the list, and storing each
-  element of the list in its own key.
+  This is implemented by using a single key to track the length of the list, and storing the
+  elements in fixed size segments of `segment_size` indices, each of which is a single hash keyed
+  by offset into the segment. Appends allocate their index with an INCR of the length key inside a
+  Lua script, so concurrent producers never conflict.
 
-  Deletion of elements from the list is not supported.
+  Redis only uses its compact hash encoding for hashes with at most `hash-max-ziplist-entries`
+  fields (128 by default) of at most `hash-max-ziplist-value` bytes, so the default segment size is
+  chosen to fit. Queues of larger values gain less from segmenting.
+
+  A `segment_size` of 0 selects the original layout of storing each element in its own key. Queues
+  written in that layout need no migration to be segmented: elements missing from their segment
+  are read from their own key, and are dropped along with the segment they would belong to when
+  it is trimmed.
+
+  Elements are not deleted individually, but segments which every registered consumer has moved
+  past may be dropped with `trim`.
+
+  Every append publishes the index it was assigned on the `<key>/notify` channel, which blocked
+  consumers subscribe to rather than polling.
+
+  If an `archive` directory is given, segments are written to it as they are trimmed, and reads
+  of trimmed elements fall back to it. See :py:mod:`skrode.redis.archive`.
+
+  Appends may store large values as claim checks. The value is stored once, in a payload key named
+  `<key>/payload/<sha1>` by the hash of its content, and the element holds only a short reference
+  to it, so that claims and scans of the sequence don't transfer large values. Each payload counts
+  the elements which refer to it, and is dropped when the last of them is trimmed or when it
+  expires. `resolve` fetches the payloads of claim checks.
+
+  The first index appended in each second is recorded in the `<key>/times` sorted set, so that
+  consumers may seek to a time with a resolution of one second. Elements appended before this
+  index existed are treated as older than any time.
   """
 
-  def __init__(self, conn, key, suffix="/"):
+  def __init__(self, conn, key, suffix="/", segment_size=128, archive=None):
     self._conn = conn
+    self._archive = SegmentArchive(archive) if archive else None
     self._key = key
     self._suffix = suffix
-
-  def __idx_key__(self, idx):
-    return "%s%s%016x" % (self._key, self._suffix, idx)
+    self._segment_size = segment_size
+    self._consumers = "%s%sconsumers" % (key, suffix)
+    self._trimmed = "%s%strimmed" % (key, suffix)
+    self._channel = "%s%snotify" % (key, suffix)
+    self._times = "%s%stimes" % (key, suffix)
+    self._push = conn.register_script(_PUSH_SCRIPT)
+    self._get = conn.register_script(_GET_SCRIPT)
+    self._claim = conn.register_script(_CLAIM_SCRIPT)
+    self._trim = conn.register_script(_TRIM_SCRIPT)
+
+  def __run__(self, script, keys=[], args=[]):
+    return script(keys=[self._key] + keys, args=[self._suffix, self._segment_size] + args)
 
   def __len__(self):
     """Returns the length of the list.
@@ -38,53 +445,297 @@ class _AppendSeq(object):
   def __getitem__(self, idx):
     assert isinstance(idx, int)
 
-    with self._conn.pipeline() as tx:
-      while True:
-        try:
-          tx.watch(self._key)
-          tx.watch(self.__idx_key__(idx))
+    result = self.__run__(self._get, args=[idx])
+    if result is None and self._archive is not None and self._segment_size:
+      values = self._archive.read(idx // self._segment_size)
+      if values is not None and values[idx % self._segment_size] is not None:
+        return values[idx % self._segment_size]
 
-          max_idx = int(tx.get(self._key) or "0")
+    if result is None:
+      raise IndexError()
 
-          tx.multi()
+    return result[0]
 
-          if max_idx > idx:
-            tx.get(self.__idx_key__(idx))
-            return tx.execute()[0]
+  def push(self, val, dedup=0, indirect=None, ttl=0):
+    """
+    Atomically pushes the given value to the end of the list, returning its index.
 
-          break
+    If `dedup` is positive and the same value was pushed within the last `dedup` seconds, the
+    value is not pushed and None is returned.
+    """
 
-        except WatchError:
-          continue
+    idxs = self.extend([val], dedup=dedup, indirect=indirect, ttl=ttl)
+    if idxs:
+      return idxs[0]
 
-        finally:
-          tx.reset()
+  def extend(self, vals, dedup=0, indirect=None, ttl=0):
+    """
+    Atomically pushes all the given values to the end of the list, returning the range of indices
+    they were assigned.
 
-    raise IndexError()
+    If `dedup` is positive, values pushed within the last `dedup` seconds are skipped, and the
+    returned range covers only the values which were pushed.
 
-  def push(self, val):
+    If `indirect` is not None, values of more than `indirect` bytes are pushed as claim checks,
+    and their payloads expire after `ttl` seconds if it is positive.
     """
-    Atomically pushes the given value to the end of the list.
+
+    vals = list(vals)
+    if not vals:
+      return range(0)
+
+    first, n = self.__run__(self._push, args=[int(dedup), int(time.time()),
+                                              -1 if indirect is None else int(indirect),
+                                              int(ttl)] + vals)
+    return range(first, first + n)
+
+  def resolve(self, vals, strict=True):
     """
+    Returns the given element values with the payloads of any claim checks fetched in their place.
 
-    with self._conn.pipeline() as tx:
-      while True:
-        try:
-          tx.watch(self._key)
-          next_idx = int(self._conn.get(self._key) or "0")
-          tx.multi()
-          self._conn.set(self.__idx_key__(next_idx), val)
-          # FIXME (arrdem 2018-01-03):
-          #   Could this be incr?
-          self._conn.set(self._key, next_idx + 1)
-          tx.execute()
-          return next_idx
-
-        except WatchError:
-          continue
+    Raises KeyError if a payload has expired, unless `strict` is False in which case the value is
+    replaced with None.
+    """
+
+    refs = [i for i, val in enumerate(vals) if val is not None and val[:len(_REF)] == _REF]
+    if not refs:
+      return list(vals)
+
+    vals = list(vals)
+    keys = [vals[i][len(_REF):] for i in refs]
+    for i, key, payload in zip(refs, keys, self._conn.mget(keys)):
+      if payload is None and strict:
+        raise KeyError("Payload %s has expired" % (key.decode("utf-8"),))
+      vals[i] = payload
+
+    return vals
+
+  def suppressed(self):
+    """Returns the number of pushes which have been skipped as duplicates."""
+
+    return int(self._conn.get("%s%ssuppressed" % (self._key, self._suffix)) or "0")
+
+  def claim(self, cursor_key, inflight, n=1):
+    """
+    Atomically claims up to `n` elements for the consumer whose cursor is stored at `cursor_key`,
+    leasing them in the :py:class:`_Inflight` set `inflight`. Returns a list of pairs of claimed
+    index and value, which is empty if the consumer is caught up and has no expired leases.
+    """
 
-        finally:
-          tx.reset()
+    now = time.time()
+    result = self.__run__(self._claim,
+                          keys=[cursor_key, inflight._key, inflight._attempts, inflight._errors,
+                                inflight._dead_letter],
+                          args=[n, now, now + inflight._lease, inflight._max_attempts])
+    return [(int(idx), val) for idx, val in zip(result[::2], result[1::2])]
+
+  def first(self):
+    """Returns the first index which has not been trimmed."""
+
+    return int(self._conn.get(self._trimmed) or "0") * self._segment_size
+
+  def earliest(self):
+    """Returns the first index which may still be read, from Redis or from the archive."""
+
+    segments = self._archive.segments() if self._archive is not None else []
+    return min([self.first()] + [seg * self._segment_size for seg in segments[:1]])
+
+  def index_at(self, timestamp):
+    """Returns the first index appended at or after the unix `timestamp`, to the second."""
+
+    found = self._conn.zrangebyscore(self._times, int(timestamp), "+inf", start=0, num=1)
+    return int(found[0]) if found else len(self)
+
+  def consumers(self):
+    """Returns a dict of every registered consumer's cursor key to its offset and lag, and the
+    number of items it has in flight."""
+
+    consumers = self._conn.hgetall(self._consumers)
+    with self._conn.pipeline(transaction=False) as p:
+      p.get(self._key)
+      for cursor_key, inflight_key in consumers.items():
+        p.get(cursor_key)
+        p.zcard(inflight_key)
+      replies = p.execute()
+
+    max_idx = int(replies[0] or "0")
+    result = {}
+    for cursor_key, cur_idx, inflight in zip(consumers, replies[1::2], replies[2::2]):
+      cur_idx = int(cur_idx or "0")
+      result[cursor_key.decode("utf-8")] = {"offset": cur_idx,
+                                            "lag": max_idx - cur_idx,
+                                            "inflight": inflight}
+    return result
+
+  def register(self, cursor_key, inflight):
+    """Record a consumer, so that `trim` will not drop elements it has yet to process."""
+
+    self._conn.hset(self._consumers, cursor_key, inflight._key)
+
+  def unregister(self, cursor_key):
+    """Forget a consumer, allowing `trim` to drop elements it has yet to process. Returns whether it
+    was registered."""
+
+    return bool(self._conn.hdel(self._consumers, cursor_key))
+
+  def trim(self, limit=None):
+    """
+    Drops every segment which all registered consumers have claimed and acknowledged, and which
+    lies wholly below the index `limit` if it is given, returning the number of segments dropped.
+
+    If the sequence has an archive, the segments are archived before they are dropped.
+    """
+
+    if not self._segment_size:
+      raise ValueError("Cannot trim a sequence stored without segments")
+
+    limit = -1 if limit is None else max(0, limit)
+    if self._archive is not None:
+      first, last = self.__run__(self._trim, keys=[self._consumers, self._trimmed],
+                                 args=[limit, 1])
+      segments = range(first, last)
+      with self._conn.pipeline(transaction=False) as p:
+        for seg in segments:
+          p.hgetall("%s%ssegment%s%012x" % (self._key, self._suffix, self._suffix, seg))
+          # Elements appended before the queue was segmented are stored in the flat layout
+          start = seg * self._segment_size
+          p.mget(["%s%s%016x" % (self._key, self._suffix, idx)
+                  for idx in range(start, start + self._segment_size)])
+        contents = p.execute()
+
+      for seg, fields, flat in zip(segments, contents[::2], contents[1::2]):
+        values = [fields.get(b"%x" % offset, flat[offset]) for offset in range(self._segment_size)]
+        self._archive.write(seg, self.resolve(values, strict=False))
+
+      # Only drop what was archived, even if consumers have moved on since
+      limit = last * self._segment_size if limit < 0 else min(limit, last * self._segment_size)
+
+    return self.__run__(self._trim, keys=[self._consumers, self._trimmed], args=[limit, 0])
+
+
+class _Inflight(object):
+  """Helper class.
+
+  Tracks the leases a consumer holds on claimed indices of an :py:class:`_AppendSeq`, as a sorted
+  set of index to lease deadline.
+
+  An index is leased when it is claimed, and stays in the set until it is acknowledged. A lease
+  which passes its deadline without being acknowledged - either because the consumer gave the item
+  back or because the consumer died - is re-delivered by the next claim against the set.
+
+  If `max_attempts` or `backoff` is set, the number of times each index has been claimed is
+  counted in the `<key>/attempts` hash. An index which is given back is re-delivered only after
+  `backoff * 2 ** (attempts - 1)` seconds, capped at `max_backoff`. If `dead_letter` is also set,
+  an index which has been claimed `max_attempts` times and still isn't acknowledged is moved onto
+  the end of the `dead_letter` sequence, and the last error it was given back with is recorded in
+  the `<dead_letter>/errors` hash under its new index.
+
+  Acknowledgements may be batched, by holding them until `ack_window` are pending or
+  `ack_interval` seconds have passed since the last were sent. An acknowledgement which is lost
+  before it is sent leaves its lease to expire, and the item to be re-delivered.
+  """
+
+  def __init__(self, list, key, lease=300, max_attempts=0, backoff=0, max_backoff=3600,
+               dead_letter=None, ack_window=1, ack_interval=None):
+    self._conn = list._conn
+    self._list = list
+    self._key = key
+    self._lease = lease
+    self._max_attempts = max_attempts
+    self._backoff = backoff
+    self._max_backoff = max_backoff
+    counted = max_attempts or backoff
+    self._attempts = "%s/attempts" % (key,) if counted else ""
+    self._dead_letter = dead_letter if dead_letter and max_attempts else ""
+    self._errors = "%s/errors" % (key,) if self._dead_letter else ""
+    self._ack_window = ack_window
+    self._ack_interval = ack_interval
+    self._pending = []
+    self._flush_at = time.time() + (ack_interval or 0)
+    self._nack = self._conn.register_script(_NACK_SCRIPT)
+    self._release = self._conn.register_script(_RELEASE_SCRIPT)
+
+  def __len__(self):
+    return self._conn.zcard(self._key)
+
+  def ack(self, *idxs):
+    """Drop the leases on the given indices, marking them as processed.
+
+    The acknowledgement may be held back to be sent with others.
+    """
+
+    self._pending.extend(idxs)
+    if len(self._pending) >= self._ack_window or \
+       (self._ack_interval is not None and time.time() >= self._flush_at):
+      self.flush()
+
+  def flush(self):
+    """Send any held back acknowledgements."""
+
+    idxs, self._pending = self._pending, []
+    self._flush_at = time.time() + (self._ack_interval or 0)
+    if idxs:
+      with self._conn.pipeline(transaction=False) as p:
+        p.zrem(self._key, *idxs)
+        if self._attempts:
+          p.hdel(self._attempts, *idxs)
+        if self._errors:
+          p.hdel(self._errors, *idxs)
+        p.execute()
+
+  def nack(self, *idxs, error=None):
+    """Give back the leases on the given indices, so that they are re-delivered after any backoff.
+
+    Indices which have used all their attempts are dead lettered, along with `error`.
+    """
+
+    if idxs:
+      self._list.__run__(self._nack,
+                         keys=[self._key, self._attempts, self._errors, self._dead_letter],
+                         args=[time.time(), self._backoff, self._max_backoff, self._max_attempts,
+                               error or ""] + list(idxs))
+
+  def renew(self, *idxs, lease=None):
+    """Push back the deadline of the leases on the given indices."""
+
+    if idxs:
+      lease = self._lease if lease is None else lease
+      self._release(keys=[self._key], args=[time.time() + lease] + list(idxs))
+
+
+class _Signal(object):
+  """Helper class.
+
+  A lazily made subscription to the channels on which producers announce appends, which lets
+  consumers block until there may be something to claim rather than polling.
+  """
+
+  def __init__(self, conn, channels):
+    self._conn = conn
+    self._channels = channels
+    self._pubsub = None
+
+  def wait(self, timeout):
+    """Block until a producer signals that items were added, or `timeout` seconds pass.
+
+    Returns True if signaled. While blocked, no commands are issued to Redis.
+    """
+
+    if self._pubsub is None:
+      self._pubsub = self._conn.pubsub(ignore_subscribe_messages=True)
+      self._pubsub.subscribe(*self._channels)
+
+    deadline = time.time() + timeout
+    while True:
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        return False
+
+      if self._pubsub.get_message(timeout=remaining) is not None:
+        # Drain any other pending signals, one claim will see all of their items
+        while self._pubsub.get_message() is not None:
+          pass
+        return True
 
 
 class WorkItem(object):
@@ -109,25 +760,37 @@ class WorkItem(object):
          sleep(5)
   """
 
-  def __init__(self, conn, key, list, idx, decoder=None):
-    self._conn = conn
-    self._key = key
+  def __init__(self, inflight, list, idx, decoder=None, value=None):
+    self._inflight = inflight
     self._list = list
     self._idx = idx
     self._decoder = decoder or (lambda x: x)
+    self._value = value
 
   @property
   def value(self):
-    return self._decoder(self._list[self._idx])
+    if self._value is None or self._value[:len(_REF)] == _REF:
+      self._value = self._list.resolve([self._list[self._idx]
+                                        if self._value is None else self._value])[0]
+    return self._decoder(self._value)
 
   def complete(self):
-    """FIXME: this is a no-op for now."""
-    pass
+    """Acknowledge this work item as processed, releasing its lease."""
 
-  def abort(self):
-    """Admit a failure to process this work item and put it back on the queue."""
+    self._inflight.ack(self._idx)
 
-    self._conn.set(self._key, self._idx)
+  def abort(self, error=None):
+    """Admit a failure to process this work item and put it back on the queue.
+
+    `error` describes the failure, and is kept if the item is dead lettered.
+    """
+
+    self._inflight.nack(self._idx, error=error)
+
+  def renew(self, lease=None):
+    """Extend the lease on this work item, for items which take a long time to process."""
+
+    self._inflight.renew(self._idx, lease=lease)
 
   def __enter__(self):
     return self.value
@@ -137,7 +800,66 @@ class WorkItem(object):
       # We processed the work item successfully as far as we can tell
       self.complete()
     else:
-      self.abort()
+      self.abort(error="%s: %s" % (type.__name__, value))
+
+
+class WorkBatch(object):
+  """
+  Helper class to WorkQueue.
+
+  Represents a group of work items claimed at once, as returned by `Consumer.next_batch`. Used as a
+  context manager, the `as` value is the list of decoded values and the whole batch is completed or
+  aborted together.
+
+  .. code-block:: python
+
+     batch = work_queue.get_batch(100)
+     if batch is not None:
+       with batch as jobs:
+         for job in jobs:
+           # ... process the item
+  """
+
+  def __init__(self, inflight, idxs, values, decoder=None):
+    self._inflight = inflight
+    self._idxs = idxs
+    self._values = values
+    self._decoder = decoder or (lambda x: x)
+
+  def __len__(self):
+    return len(self._idxs)
+
+  @property
+  def value(self):
+    # Values claimed after a seek back into an archive are read from the archive
+    seq = self._inflight._list
+    self._values = seq.resolve([seq[idx] if value is None else value
+                                for idx, value in zip(self._idxs, self._values)])
+    return [self._decoder(value) for value in self._values]
+
+  def complete(self):
+    """Acknowledge every item in this batch as processed."""
+
+    self._inflight.ack(*self._idxs)
+
+  def abort(self, error=None):
+    """Admit a failure to process this batch and put all of it back on the queue."""
+
+    self._inflight.nack(*self._idxs, error=error)
+
+  def renew(self, lease=None):
+    """Extend the lease on every item in this batch."""
+
+    self._inflight.renew(*self._idxs, lease=lease)
+
+  def __enter__(self):
+    return self.value
+
+  def __exit__(self, type, value, traceback):
+    if type is None and value is None and traceback is None:
+      self.complete()
+    else:
+      self.abort(error="%s: %s" % (type.__name__, value))
 
 
 class Producer(object):
@@ -145,91 +867,234 @@ class Producer(object):
 
   Users may enqueue blobs.
 
+  If `dedup` is a positive number of seconds, a blob which is enqueued again within that window of
+  its first enqueue - as judged by its encoded value - is silently dropped rather than queued
+  twice. This makes re-enqueuing an ID which is already pending a cheap no-op.
+
+  If `indirect` is True, or a number of bytes which encoded blobs are larger than, blobs are
+  enqueued as claim checks, with the blob itself stored once aside from the queue for
+  `payload_ttl` seconds (forever if 0). Consumers fetch the blobs of claim checks transparently.
+
+  By default `trim` drops every item which all consumers have processed. A retention policy keeps
+  some of those items for replay: `retain_items` keeps that many of the most recent items, and
+  `retain_hours` keeps the items put within that many hours, whichever keeps more. If an `archive`
+  directory is given, trimmed items are moved to compressed files there rather than dropped, and
+  consumers given the same archive may still seek back to them.
+
   A `WorkQueueConsumer` may be used to separately recover :py:class:`WorkItem` instances which wrap
   blobs.
 
   The queue is backed by a `BigList`
   """
 
-  def __init__(self, conn, key, encoder=None):
+  def __init__(self, conn, key, encoder=None, segment_size=128, dedup=0, indirect=False,
+               payload_ttl=7 * 24 * 60 * 60, retain_items=None, retain_hours=None, archive=None):
     self._conn = conn
-    self._list = _AppendSeq(conn, key)
+    self._list = _AppendSeq(conn, key, segment_size=segment_size, archive=archive)
     self._encoder = encoder or (lambda x: x)
+    self._dedup = dedup
+    # The sequence takes a size threshold, or None to store every blob in place
+    if indirect is True:
+      indirect = 0
+    elif indirect is False:
+      indirect = None
+    self._indirect = indirect
+    self._payload_ttl = payload_ttl
+    self._retain_items = retain_items
+    self._retain_hours = retain_hours
 
   def __len__(self):
     return len(self._list)
 
   def put(self, value):
+    """Enqueue a value, returning its index, or None if it was suppressed as a duplicate."""
+
     value = self._encoder(value)
-    return self._list.push(value)
+    return self._list.push(value, dedup=self._dedup, indirect=self._indirect,
+                           ttl=self._payload_ttl)
+
+  def put_many(self, values):
+    """Enqueue every value from an iterable in one round trip.
+
+    The values are assigned a contiguous range of indices, which is returned. Values suppressed as
+    duplicates are not assigned indices.
+    """
+
+    return self._list.extend((self._encoder(value) for value in values), dedup=self._dedup,
+                             indirect=self._indirect, ttl=self._payload_ttl)
+
+  def suppressed(self):
+    """Returns the number of values which have been suppressed as duplicates."""
+
+    return self._list.suppressed()
+
+  def trim(self):
+    """Drop the stored segments of the queue which every registered consumer has processed, and
+    which the retention policy doesn't keep."""
+
+    limits = []
+    if self._retain_items is not None:
+      limits.append(len(self._list) - self._retain_items)
+    if self._retain_hours is not None:
+      limits.append(self._list.index_at(time.time() - self._retain_hours * 60 * 60))
+
+    return self._list.trim(limit=min(limits) if limits else None)
 
 
 class Consumer(object):
   """A helper type which represents a consumer over a durable FIFO queue.
 
-  Iterates over enqueued blobs as WorkItems, maintaining a durable index of the last WorkItem which
-  was acknowledged as completed. Maintains a persistent cursor in the backing Redis store tracking
-  the index of the last successfully consumed work item. If a work item fails to process, the cursor
-  is RESET to the index of the failed item. This leads to at least once processing of all records,
-  unless sufficient error handling is provided on the client side.
-
+  Iterates over enqueued blobs as WorkItems, maintaining a persistent cursor in the backing Redis
+  store tracking the index of the next unclaimed work item.
+
+  Every claimed work item is leased for `lease` seconds in an in-flight set (by default keyed
+  `<consumer_id>/inflight`) until it is acknowledged as completed. If a work item fails to process,
+  or is not acknowledged before its lease runs out, that one item is re-delivered by a later claim.
+  This leads to at least once processing of all records, unless sufficient error handling is
+  provided on the client side.
+
+  Consumers sharing a `consumer_id` compete for items, and should share the in-flight key too.
+
+  A consumer's first claim or seek registers it with the queue, so that `Producer.trim` will retain
+  every item it has yet to acknowledge until it is unregistered with `unregister`. A consumer with
+  a new `consumer_id` starts at offset 0, and so is delivered every item which has not been
+  trimmed. `seek` moves a consumer's cursor to replay or skip items.
+
+  Items which fail are retried with exponential `backoff`, and after `max_attempts` claims may be
+  moved to a `dead_letter` queue rather than retried forever. See :py:class:`_Inflight`.
+
+  By default every `next` is a claim, advancing the cursor, and every acknowledgement is sent as it
+  is made. Given a `window` of more than one, `next` claims that many items at once and hands them
+  out one at a time, and acknowledgements are held back and sent with the following claim, or once
+  `ack_interval` seconds have passed. Items are still leased from when they are claimed, so the
+  `lease` must allow for processing a whole window. If the consumer dies, its unsent
+  acknowledgements and the unprocessed remainder of its window are re-delivered when their leases
+  expire, as for any other unacknowledged item. `flush` sends any held back acknowledgements, and
+  should be called before a consumer is discarded.
   """
 
-  def __init__(self, conn, key, consumer_id, decoder=None):
+  def __init__(self, conn, key, consumer_id, decoder=None, inflight=None, lease=300,
+               segment_size=128, max_attempts=0, backoff=0, max_backoff=3600, dead_letter=None,
+               archive=None, window=1, ack_interval=None):
     self._conn = conn
-    self._list = _AppendSeq(conn, key)
+    self._list = _AppendSeq(conn, key, segment_size=segment_size, archive=archive)
     self._key = consumer_id
+    self._inflight = _Inflight(self._list, inflight or "%s/inflight" % (consumer_id,),
+                               lease=lease, max_attempts=max_attempts, backoff=backoff,
+                               max_backoff=max_backoff, dead_letter=dead_letter,
+                               ack_window=window, ack_interval=ack_interval)
     self._decoder = decoder
+    self._window = window
+    self._buffer = []
+    self._signal = _Signal(conn, [self._list._channel])
+    self._registered = False
 
   def __iter__(self):
     return self
 
   def __len__(self):
-    with self._conn.pipeline() as tx:
-      while True:
-        try:
-          tx.watch(self._key)
-          tx.watch(self._list._key)
+    """Returns the number of items this consumer has yet to claim."""
 
-          max_idx = int(tx.get(self._list._key) or "0")
-          cur_idx = int(tx.get(self._key) or "0")
+    max_idx, cur_idx = self._conn.mget(self._list._key, self._key)
+    return int(max_idx or "0") - int(cur_idx or "0")
 
-          return cur_idx - max_idx
+  def offset(self):
+    """Returns the index of the next item this consumer will claim, barring re-deliveries."""
 
-        except WatchError:
-          continue
+    return int(self._conn.get(self._key) or "0")
 
-        finally:
-          tx.reset()
+  def seek(self, offset=None, timestamp=None):
+    """Move this consumer's cursor to `offset`, or to the first item put at or after the unix
+    `timestamp`, returning the new offset.
 
-  def next(self):
-    # FIXME (arrdem 2018-01-02):
-    #   when to throw StopIterationException?
+    Seeking backwards replays every item from the new offset, and seeking forwards skips items.
+    Leases already held are unaffected. Raises IndexError if the offset has been trimmed and not
+    archived, or is past the end of the queue.
+    """
 
-    with self._conn.pipeline() as tx:
-      while True:
-        try:
-          tx.watch(self._list._key)
-          tx.watch(self._key)
+    if timestamp is not None:
+      offset = self._list.index_at(timestamp)
 
-          max_idx = int(tx.get(self._list._key) or "0")
-          cur_idx = int(tx.get(self._key) or "0")
+    if not self._list.earliest() <= offset <= len(self._list):
+      raise IndexError("Offset %d is not in the queue" % (offset,))
 
-          if max_idx == cur_idx:
-            raise StopIteration
+    self._register()
+    self._conn.set(self._key, offset)
+    return offset
 
-          else:
-            tx.multi()
-            tx.incr(self._key)
-            tx.execute()
-            return WorkItem(self._conn, self._key, self._list, cur_idx,
-                            decoder=self._decoder)
+  def wait(self, timeout):
+    """Block until a producer signals that items were added, or `timeout` seconds pass.
 
-        except WatchError:
-          continue
+    Returns True if signaled. While blocked, the consumer issues no commands to Redis.
+    """
+
+    return self._signal.wait(timeout)
+
+  def unregister(self):
+    """Stop the queue retaining the items this consumer has yet to process, until its next claim or
+    seek. Returns whether it was registered."""
 
-        finally:
-          tx.reset()
+    self._registered = False
+    return self._list.unregister(self._key)
+
+  def _register(self):
+    if not self._registered:
+      self._list.register(self._key, self._inflight)
+      self._registered = True
+
+  def _claim(self, n, timeout):
+    self._register()
+    if timeout:
+      deadline = time.time() + timeout
+      # Subscribe before the first claim, so an item added between the two isn't missed
+      self.wait(0)
+
+    # Acknowledgements held back by the window go out with the claim, rather than one by one
+    self._inflight.flush()
+    while True:
+      claimed = self._list.claim(self._key, self._inflight, n)
+      if claimed or not timeout or not self.wait(deadline - time.time()):
+        return claimed
+
+  def flush(self):
+    """Send any acknowledgements held back by the window."""
+
+    self._inflight.flush()
+
+  def next(self, timeout=None):
+    """Claim the next item as a :py:class:`WorkItem`.
+
+    If `timeout` is given and the queue is empty, blocks for up to `timeout` seconds waiting for
+    an item to be added.
+    """
+
+    if not self._buffer:
+      self._buffer = self._claim(self._window, timeout)
+      self._buffer.reverse()
+    if not self._buffer:
+      raise StopIteration
+
+    idx, val = self._buffer.pop()
+    return WorkItem(self._inflight, self._list, idx,
+                    decoder=self._decoder, value=val)
+
+  def next_batch(self, n, timeout=None):
+    """Claim up to `n` items at once, returning them as a single :py:class:`WorkBatch`.
+
+    Blocks as `next` does if `timeout` is given. Items left over from a window claimed by `next`
+    are handed out first.
+    """
+
+    if self._buffer:
+      claimed, self._buffer = self._buffer[:-n - 1:-1], self._buffer[:-n]
+    else:
+      claimed = self._claim(n, timeout)
+    if not claimed:
+      raise StopIteration
+
+    idxs, vals = zip(*claimed)
+    return WorkBatch(self._inflight, idxs, vals,
+                     decoder=self._decoder)
 
 
 class WorkQueue(object):
@@ -237,21 +1102,244 @@ class WorkQueue(object):
 
   Provides `.put` and `.get`, using an implicit single shared consumer ID across all connected
   clients.
+
+  A queue may be split into several priority `lanes`, each of which is its own sequence. Lane 0,
+  the lowest priority, is stored at `key` and the others at `<key>/lane/<n>`. Values are put on a
+  lane by `priority`, and `get` claims from the highest priority lane which has work - except that
+  after every `starvation_ratio` items it tries the lanes lowest first, so that a busy high
+  priority lane can't starve the others entirely. In YAML:
+
+  .. code-block:: yaml
+
+     tweet_id_queue:
+       &tweet_id_queue
+       !skrode/queue
+       conn: *redis
+       key: /queue/twitter/tweet_ids/ready
+       inflight: /queue/twitter/tweet_ids/inflight
+       lanes: 2
+       starvation_ratio: 8
+
+  Items which keep failing may be moved to a `dead_letter` queue after `max_attempts` claims, with
+  an exponential `backoff` between attempts. Dead letters from every lane share the one queue, and
+  may be listed with `dead_letters` and put back with `requeue_dead_letters`:
+
+  .. code-block:: yaml
+
+     tweet_id_queue:
+       &tweet_id_queue
+       !skrode/queue
+       conn: *redis
+       key: /queue/twitter/tweet_ids/ready
+       dead_letter: /queue/twitter/tweet_ids/dead
+       max_attempts: 5
+       backoff: 10
+
+  Consumed items may be kept for replay with `retain_items` or `retain_hours`, and trimmed items
+  moved to compressed files in an `archive` directory. See :py:class:`Producer`.
+
+  Large values such as whole tweets may be enqueued as claim checks by setting `indirect` to a
+  size in bytes, or to true for every value. See :py:class:`Producer`.
+
+  Giving a `consumer` name other than the default reads the same queue with a separate cursor,
+  which starts at the beginning of the queue. This allows items to be replayed through a second
+  worker, for instance after fixing a bug in an ingester. Such a queue should not share the
+  `inflight` key of the original:
+
+  .. code-block:: yaml
+
+     tweet_id_replay:
+       &tweet_id_replay
+       !skrode/queue
+       conn: *redis
+       key: /queue/twitter/tweet_ids/ready
+       consumer: replay
+
+  A `window` claims that many items from a lane at once, and sends acknowledgements once per
+  window or `ack_interval` seconds rather than once per item. See :py:class:`Consumer`. Workers
+  should `flush` such a queue when they stop.
   """
 
-  def __init__(self, conn, key, inflight=None, indirect=False, decoder=None, encoder=None):
+  def __init__(self, conn, key, inflight=None, indirect=False, decoder=None, encoder=None,
+               lease=300, segment_size=128, dedup=0, lanes=1, starvation_ratio=8,
+               max_attempts=0, backoff=0, max_backoff=3600, dead_letter=None,
+               consumer="implicit_consumer", payload_ttl=7 * 24 * 60 * 60, retain_items=None,
+               retain_hours=None, archive=None, window=1, ack_interval=None):
     self._conn = conn
-    self._producer = Producer(conn, key, encoder=encoder)
-    self._consumer = Consumer(conn, key, "%s/implicit_consumer" % (key,), decoder=decoder)
+    self._decoder = decoder or (lambda x: x)
+    self._producers = []
+    self._consumers = []
+    for lane in range(lanes):
+      lane_key = "%s/lane/%d" % (key, lane) if lane else key
+      lane_inflight = "%s/lane/%d" % (inflight, lane) if lane and inflight else inflight
+      lane_archive = os.path.join(archive, "lane", str(lane)) if lane and archive else archive
+      self._producers.append(Producer(conn, lane_key, encoder=encoder,
+                                      segment_size=segment_size, dedup=dedup, indirect=indirect,
+                                      payload_ttl=payload_ttl, retain_items=retain_items,
+                                      retain_hours=retain_hours, archive=lane_archive))
+      self._consumers.append(Consumer(conn, lane_key, "%s/%s" % (lane_key, consumer),
+                                      decoder=decoder, inflight=lane_inflight, lease=lease,
+                                      segment_size=segment_size, max_attempts=max_attempts,
+                                      backoff=backoff, max_backoff=max_backoff,
+                                      dead_letter=dead_letter, archive=lane_archive,
+                                      window=window, ack_interval=ack_interval))
+
+    self._dead_letters = None
+    if dead_letter:
+      self._dead_letters = Consumer(conn, dead_letter, "%s/implicit_consumer" % (dead_letter,),
+                                    segment_size=segment_size)
+
+    self._starvation_ratio = starvation_ratio
+    self._served = 0
+    self._signal = _Signal(conn, [consumer._list._channel for consumer in self._consumers])
 
   def __len__(self):
-    return len(self._consumer)
+    # One MGET of every lane's length and cursor, rather than a round trip per lane
+    keys = []
+    for consumer in self._consumers:
+      keys.extend([consumer._list._key, consumer._key])
+    counts = [int(count or "0") for count in self._conn.mget(keys)]
+    return sum(counts[::2]) - sum(counts[1::2])
+
+  def _lane(self, priority):
+    return self._producers[max(0, min(priority, len(self._producers) - 1))]
+
+  def put(self, val, priority=0):
+    return self._lane(priority).put(val)
+
+  def put_many(self, vals, priority=0):
+    return self._lane(priority).put_many(vals)
+
+  def trim(self):
+    return sum(producer.trim() for producer in self._producers)
+
+  def suppressed(self):
+    with self._conn.pipeline(transaction=False) as p:
+      for producer in self._producers:
+        p.get("%s/suppressed" % (producer._list._key,))
+      return sum(int(count or "0") for count in p.execute())
+
+  def _claim(self, claim, timeout):
+    if timeout:
+      deadline = time.time() + timeout
+      # Subscribe before the first claim, so an item added between the two isn't missed
+      self._signal.wait(0)
+
+    while True:
+      if self._served % (self._starvation_ratio + 1) == self._starvation_ratio:
+        lanes = self._consumers
+      else:
+        lanes = reversed(self._consumers)
+
+      for consumer in lanes:
+        try:
+          item = claim(consumer)
+          self._served += 1
+          return item
+        except StopIteration:
+          continue
+
+      if not timeout or not self._signal.wait(deadline - time.time()):
+        return None
+
+  def flush(self):
+    """Send any acknowledgements held back by the window."""
+
+    for consumer in self._consumers:
+      consumer.flush()
+
+  def unregister(self, cursor_key=None):
+    """Forget a consumer of every lane, so that `trim` may drop the items it has yet to process.
+
+    By default forgets this queue's own consumer, which is registered again by its next claim.
+    Otherwise `cursor_key` names a consumer as `offsets` does. Returns the number of lanes the
+    consumer was registered on.
+    """
+
+    if cursor_key is None:
+      return sum(consumer.unregister() for consumer in self._consumers)
+
+    return sum(consumer._list.unregister(cursor_key) for consumer in self._consumers)
+
+  def offsets(self):
+    """Returns, for each lane, the offset, lag and in-flight count of every registered consumer."""
+
+    return [consumer._list.consumers() for consumer in self._consumers]
+
+  def seek(self, offset=None, timestamp=None):
+    """Seek this queue's consumer to an `offset` or unix `timestamp`, as `Consumer.seek` does.
+
+    Offsets are per lane, so only a timestamp may be given for a queue with several lanes. Returns
+    the list of each lane's new offset.
+    """
+
+    if offset is not None and len(self._consumers) > 1:
+      raise ValueError("Cannot seek a queue with several lanes to an offset")
+
+    return [consumer.seek(offset=offset, timestamp=timestamp) for consumer in self._consumers]
+
+  def get(self, timeout=None):
+    return self._claim(lambda consumer: consumer.next(), timeout)
+
+  def get_batch(self, n, timeout=None):
+    """Claim up to `n` items from a single lane."""
+
+    return self._claim(lambda consumer: consumer.next_batch(n), timeout)
+
+  def dead_letters(self, limit=100):
+    """List up to `limit` dead letters which have yet to be requeued, without claiming them.
+
+    Returns a list of triples of dead letter index, decoded value and the last error recorded
+    against the item, if any.
+    """
+
+    if self._dead_letters is None:
+      return []
+
+    dead = self._dead_letters
+    cur_idx = int(self._conn.get(dead._key) or "0")
+    idxs = list(range(cur_idx, min(cur_idx + limit, len(dead._list))))
+    if not idxs:
+      return []
+
+    values = self._unarchive(dead._list.resolve([dead._list[idx] for idx in idxs]))
+    errors = self._conn.hmget("%s/errors" % (dead._list._key,), *idxs)
+    return [(idx, self._decoder(value), error.decode("utf-8") if error else None)
+            for idx, value, error in zip(idxs, values, errors)]
+
+  def _unarchive(self, vals):
+    """Returns dead letter values with those buried from the archive of a lane read back from it."""
+
+    lanes = {consumer._list._key.encode("utf-8"): consumer._list for consumer in self._consumers}
+    vals = list(vals)
+    for i, val in enumerate(vals):
+      if val is not None and val[:len(_ARCHIVED)] == _ARCHIVED:
+        idx, key = val[len(_ARCHIVED):].split(b":", 1)
+        if key in lanes:
+          vals[i] = lanes[key][int(idx)]
+
+    return vals
+
+  def requeue_dead_letters(self, n=None, priority=0):
+    """Move up to `n` dead letters, or all of them, back onto the queue at `priority`.
+
+    Each value is requeued as it was originally encoded and without deduplication. Returns the
+    number of items requeued.
+    """
+
+    if self._dead_letters is None:
+      return 0
+
+    requeued = 0
+    while n is None or requeued < n:
+      try:
+        batch = self._dead_letters.next_batch(100 if n is None else min(100, n - requeued))
+      except StopIteration:
+        break
 
-  def put(self, val):
-    return self._producer.put(val)
+      self._lane(priority)._list.extend(self._unarchive(batch._values))
+      self._conn.hdel("%s/errors" % (self._dead_letters._list._key,), *batch._idxs)
+      batch.complete()
+      requeued += len(batch)
 
-  def get(self):
-    try:
-      return self._consumer.next()
-    except StopIteration:
-      return None
+    return requeued
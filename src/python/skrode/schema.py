@@ -2,15 +2,28 @@
 BBDB schema
 """
 
+from collections import OrderedDict
 import uuid
 
+from skrode.unit_of_work import commit
+
 from detritus import camel2snake as convert
 
-from sqlalchemy import Boolean, CheckConstraint, Column, ForeignKey, String
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import (
+  Boolean,
+  CheckConstraint,
+  Column,
+  DDL,
+  event,
+  ForeignKey,
+  Index,
+  String,
+  UniqueConstraint
+)
+from sqlalchemy.dialects.postgresql import insert, JSONB, TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.orm.session import object_session
 from sqlalchemy.types import Enum
 from sqlalchemy_utils import ArrowType, UUIDType
@@ -21,10 +34,43 @@ def get_or_create(session, model, **kwargs):
   if not instance:
     instance = model(**kwargs)
     session.add(instance)
-    session.commit()
+    commit(session)
   return instance
 
 
+def upsert(session, model, rows, keys, update=()):
+  """Insert many rows of a model at once, returning their ids in the order of `rows`.
+
+  `rows` are dicts of column values, which must all name the same columns. `keys` names the columns
+  of one of the model's unique constraints. A row which conflicts with an existing one on those
+  columns isn't inserted; the existing row's id is returned instead, after its `update` columns
+  are set from the given row. Rows with the same keys are merged, the last one winning.
+
+  Whatever the number of rows this is a single INSERT ... ON CONFLICT ... RETURNING statement, and
+  so PostgreSQL only. Unlike `get_or_create`, it doesn't commit.
+  """
+
+  merged = OrderedDict()
+  for row in rows:
+    row = dict(row)
+    row.setdefault("id", uuid.uuid4())
+    merged[tuple(row[key] for key in keys)] = row
+
+  if not merged:
+    return []
+
+  table = model.__table__
+  stmt = insert(table).values(list(merged.values()))
+  # Setting a key to itself is a no-op which still lets RETURNING see rows which already existed
+  stmt = stmt.on_conflict_do_update(index_elements=list(keys),
+                                    set_={column: stmt.excluded[column]
+                                          for column in (update or keys[:1])})
+  stmt = stmt.returning(table.c.id, *[table.c[key] for key in keys])
+
+  ids = {tuple(result[1:]): result[0] for result in session.execute(stmt)}
+  return [ids[tuple(row[key] for key in keys)] for row in rows]
+
+
 class Base(object):
   """
   Base class. Provides a repr() and not much more.
@@ -45,6 +91,10 @@ class Base(object):
 
 Base = declarative_base(cls=Base)
 
+# Name search is backed by trigram indices, which need the pg_trgm extension
+event.listen(Base.metadata, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+
 
 UUID = UUIDType()
 
@@ -192,15 +242,27 @@ class Name(Base, Named, UUIDed):
   Names or Aliases are associated with Personas, Accounts and many other structures.
 
   Name strings are interned, although names references are unique to a persona.
+
+  Names are indexed by trigram, so that substring, prefix and similarity searches whether or not
+  case sensitive are all served by the one GIN index. See :py:func:`skrode.personas.search_names`.
   """
 
-  account_id = Column(UUID, ForeignKey("account.id"))
+  # Both halves of the unique key upserts conflict on, which NULLs would never conflict with
+  name = Column(String(convert_unicode=True), nullable=False)
+  account_id = Column(UUID, ForeignKey("account.id"), index=True, nullable=False)
   account = relationship("Account", single_parent=True)
 
   when = Column(ArrowType)
 
   some_fk = CheckConstraint("persona_id IS NOT NULL OR account_id IS NOT NULL")
 
+  __table_args__ = (
+    UniqueConstraint("name", "account_id"),
+    Index("ix_name_name_trgm", "name",
+          postgresql_using="gin",
+          postgresql_ops={"name": "gin_trgm_ops"}),
+  )
+
   def __repr__(self):
     return "<Name %r>" % (self.name,)
 
@@ -215,15 +277,17 @@ ACCOUNTREL = Enum("follows", "blocks", "ignores",
 class AccountRelationship(Base, UUIDed):
   """A Left and Right account, related by an ACCOUNTREL. a->b"""
 
-  left_id = Column(UUID, ForeignKey("account.id"))
+  left_id = Column(UUID, ForeignKey("account.id"), nullable=False)
   left = relationship("Account", foreign_keys=[left_id])
 
-  right_id = Column(UUID, ForeignKey("account.id"))
+  right_id = Column(UUID, ForeignKey("account.id"), nullable=False)
   right = relationship("Account", foreign_keys=[right_id])
 
-  rel = Column(ACCOUNTREL)
+  rel = Column(ACCOUNTREL, nullable=False)
   when = Column(ArrowType)
 
+  __table_args__ = (UniqueConstraint("left_id", "right_id", "rel"),)
+
 
 class ListMembership(Base, UUIDed):
   """Side table. Relates Accounts to Lists, where appropriate."""
@@ -244,7 +308,12 @@ class List(Base, UUIDed, Named):
 
 
 class Post(Base, UUIDed):
-  """Used to record a post by an account."""
+  """Used to record a post by an account.
+
+  The `search` column holds the English text search vector of the post's text, and is kept up to
+  date by a trigger on every insert or update of the text, however it is written. See
+  :py:mod:`skrode.search`.
+  """
 
   # Lists are hosted on a service
   service_id = Column(UUID, ForeignKey("service.id"))
@@ -272,11 +341,26 @@ class Post(Base, UUIDed):
 
   tombstone = Column(Boolean, default=False, index=True)
 
+  # Maintained by the post_search_update trigger, and only loaded when asked for
+  search = deferred(Column(TSVECTOR))
+
+  __table_args__ = (
+    Index("ix_post_search", "search", postgresql_using="gin"),
+  )
+
   def __repr__(self):
     return ("<Post id=%r, poster_id=%r, poster=%r, at=%r, text=%r>"
             % (self.external_id, self.poster_id, self.poster, self.when, self.text))
 
 
+POST_SEARCH_TRIGGER = DDL("CREATE TRIGGER post_search_update"
+                          " BEFORE INSERT OR UPDATE OF text ON post FOR EACH ROW"
+                          " EXECUTE PROCEDURE"
+                          " tsvector_update_trigger(search, 'pg_catalog.english', text)")
+
+event.listen(Post.__table__, "after_create", POST_SEARCH_TRIGGER.execute_if(dialect="postgresql"))
+
+
 POSTREL = Enum("reply-to", "quotes",
                name="_post_rel")
 
@@ -284,13 +368,15 @@ POSTREL = Enum("reply-to", "quotes",
 class PostRelationship(Base, UUIDed):
   """Used to relate posts to each other - quoting, reply-to and soforth."""
 
-  left_id = Column(UUID, ForeignKey("post.id"), index=True)
+  left_id = Column(UUID, ForeignKey("post.id"), index=True, nullable=False)
   left = relationship("Post", foreign_keys=[left_id])
 
-  right_id = Column(UUID, ForeignKey("post.id"), index=True)
+  right_id = Column(UUID, ForeignKey("post.id"), index=True, nullable=False)
   right = relationship("Post", foreign_keys=[right_id])
 
-  rel = Column(POSTREL, index=True)
+  rel = Column(POSTREL, index=True, nullable=False)
+
+  __table_args__ = (UniqueConstraint("left_id", "right_id", "rel"),)
 
 
 POSTDIST = Enum("broadcast", "to", "cc", "bcc",
@@ -300,16 +386,17 @@ POSTDIST = Enum("broadcast", "to", "cc", "bcc",
 class PostDistribution(Base, UUIDed):
   """Used to record the distribution of a post."""
 
-  post_id = Column(UUID, ForeignKey("post.id"), nullable=True)
+  # The unique key upserts conflict on, which NULLs would never conflict with
+  post_id = Column(UUID, ForeignKey("post.id"), nullable=False)
   post = relationship("Post", back_populates="distribution", single_parent=True)
-  recipient_id = Column(UUID, ForeignKey("account.id"), nullable=True)
+  recipient_id = Column(UUID, ForeignKey("account.id"), nullable=False)
   recipient = relationship("Account", single_parent=True)
   list_id = Column(UUID, ForeignKey("list.id"))
   list = relationship("List")
 
-  rel = Column(POSTDIST, index=True)
+  rel = Column(POSTDIST, index=True, nullable=False)
 
-  some_fk = CheckConstraint("post_id IS NOT NULL OR recipient_id IS NOT NULL")
+  __table_args__ = (UniqueConstraint("post_id", "recipient_id", "rel"),)
 
 
 POSTINTR = Enum("like", "dislike", "share", "hide",
@@ -0,0 +1,100 @@
+"""
+Full text search over posts.
+
+Every post's text is indexed as an English text search vector in `Post.search`, which a trigger
+keeps up to date and a GIN index covers, so a search is an index lookup however many posts are
+archived. Results are ranked by `ts_rank`, and may be narrowed to a service, to the posts of a
+persona's accounts and to a time range.
+
+Pages of results are fetched by keyset rather than by offset. Each page carries a `next` cursor
+naming the rank and id of its last post, and the following page starts strictly after it, so that
+deep pages cost no more than the first.
+
+.. code-block:: python
+
+   page = search_posts(session, "clojure compiler", service="twitter", limit=20)
+   for post, rank in page.posts:
+     print(rank, post.text)
+   page = search_posts(session, "clojure compiler", service="twitter", limit=20, after=page.next)
+"""
+
+from __future__ import absolute_import
+
+from collections import namedtuple
+from decimal import Decimal
+import uuid
+
+from skrode import schema
+
+from sqlalchemy import and_, cast, func, Numeric, or_
+
+
+# Ranks are rounded to a fixed precision, so that a cursor compares equal to the rank it came from
+_RANK_DIGITS = 8
+
+Page = namedtuple("Page", ["posts", "next"])
+
+
+def _cursor(rank, post_id):
+  return "%s:%s" % (rank, post_id)
+
+
+def _parse_cursor(cursor):
+  rank, post_id = cursor.split(":", 1)
+  return Decimal(rank), uuid.UUID(post_id)
+
+
+def search_query(session, text, service=None, persona=None, since=None, until=None, after=None):
+  """Returns a query of (Post, rank) pairs matching `text`, best first.
+
+  `service` is the name of a service, `persona` the id of a persona whose accounts' posts are
+  wanted, and `since` and `until` bound the time a post was made. `after` is the cursor of a
+  previous page, after whose last post the results start. Tombstoned posts are never returned.
+  """
+
+  tsquery = func.plainto_tsquery("pg_catalog.english", text)
+  rank = func.round(cast(func.ts_rank(schema.Post.search, tsquery), Numeric), _RANK_DIGITS)\
+             .label("rank")
+
+  q = session.query(schema.Post, rank)\
+             .filter(schema.Post.search.op("@@")(tsquery),
+                     schema.Post.tombstone.isnot(True))
+
+  if service is not None:
+    q = q.join(schema.Service, schema.Service.id == schema.Post.service_id)\
+         .filter(schema.Service.name == service.lower())
+
+  if persona is not None:
+    q = q.join(schema.Account, schema.Account.id == schema.Post.poster_id)\
+         .filter(schema.Account.persona_id == persona)
+
+  if since is not None:
+    q = q.filter(schema.Post.when >= since)
+
+  if until is not None:
+    q = q.filter(schema.Post.when < until)
+
+  if after is not None:
+    after_rank, after_id = _parse_cursor(after)
+    q = q.filter(or_(rank < after_rank,
+                     and_(rank == after_rank, schema.Post.id > after_id)))
+
+  return q.order_by(rank.desc(), schema.Post.id)
+
+
+def search_posts(session, text, service=None, persona=None, since=None, until=None, limit=20,
+                 after=None):
+  """Search posts as :py:func:`search_query` does, returning a :py:class:`Page` of up to `limit`
+  (Post, rank) pairs and the cursor of the next page, if there may be one."""
+
+  posts = search_query(session, text, service=service, persona=persona, since=since, until=until,
+                       after=after)\
+      .limit(limit)\
+      .all()
+
+  next = None
+  if len(posts) == limit:
+    post, rank = posts[-1]
+    next = _cursor(rank, post.id)
+
+  return Page(posts, next)
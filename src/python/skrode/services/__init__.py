@@ -5,6 +5,7 @@ Helpers for working with services.
 import sys
 
 from skrode import schema
+from skrode.unit_of_work import commit
 
 from arrow import utcnow as now
 
@@ -70,11 +71,12 @@ def mk_insert_user(service_ctor, external_id_fn):
     else:
        persona = account.persona = persona or schema.Persona()
 
-    schema.get_or_create(session, schema.Name,
-                         name=external_id,
-                         account=account)
+    session.flush()
+    schema.upsert(session, schema.Name,
+                  [{"name": external_id, "account_id": account.id}],
+                  keys=("name", "account_id"))
 
-    session.commit()
+    commit(session)
     session.refresh(account)
     return account
 
@@ -8,6 +8,7 @@ from skrode.personas import merge_left
 from skrode.services import mk_insert_user, mk_service, normalize_url
 from skrode.twitter import insert_twitter
 from skrode.twitter import insert_user as twitter_insert_user
+from skrode.unit_of_work import commit
 
 
 insert_keybase = mk_service("Keybase", ["http://keybase.io"])
@@ -89,7 +90,7 @@ def insert_user(session, kb_user, persona=None, when=None, twitter_api=None):
                                      account=proved_account)
       nametag.persona = persona
       session.add(nametag)
-      session.commit()
+      commit(session)
 
     print("User", kb_account, "proved for service", proved_service)
 
@@ -6,6 +6,7 @@ from __future__ import absolute_import
 
 from skrode import schema
 from skrode.services import mk_service
+from skrode.unit_of_work import commit
 
 from phonenumbers import PhoneNumberFormat
 from phonenumbers import format_number as format_phonenumber
@@ -25,5 +26,5 @@ def insert_phone_number(session, persona, number):
                                  persona=persona,
                                  service=insert_phone_service(session))
   session.add(phone_account)
-  session.commit()
+  commit(session)
   return phone_account
@@ -6,7 +6,7 @@ from __future__ import absolute_import, print_function
 
 from datetime import datetime
 import re
-import traceback
+import uuid
 
 from skrode.schema import (
   Account,
@@ -16,12 +16,14 @@ from skrode.schema import (
   Post,
   PostDistribution,
   PostRelationship,
-  get_or_create
+  upsert
 )
 from skrode.services import mk_service
+from skrode.unit_of_work import commit
 
 from arrow import get as aget
 from arrow import utcnow as now
+from sqlalchemy import exists
 import twitter
 from twitter.models import User
 
@@ -38,6 +40,66 @@ def twitter_external_user_id(fk):
 insert_twitter = mk_service("Twitter", ["http://twitter.com"])
 
 
+def _upsert_handles(session, users, persona=None):
+  """Upsert the Accounts of many Twitter users at once, returning their ids in order.
+
+  New accounts each get a new Persona. If a `persona` is given, every account is linked to it
+  instead, including accounts already linked to another Persona.
+  """
+
+  external_ids = [twitter_external_user_id(user.id) for user in users]
+  new = []
+  if persona is not None:
+    if persona.id is None:
+      session.add(persona)
+      session.flush()
+    personas = dict.fromkeys(external_ids, persona.id)
+
+  else:
+    personas = dict(session.query(Account.external_id, Account.persona_id)
+                           .filter(Account.external_id.in_(external_ids)))
+    new = [external_id for external_id in set(external_ids) if external_id not in personas]
+    if new:
+      personas.update((external_id, uuid.uuid4()) for external_id in new)
+      session.execute(Persona.__table__.insert()
+                      .values([{"id": personas[external_id]} for external_id in new]))
+
+  service_id = insert_twitter(session).id
+  account_ids = upsert(session, Account,
+                       [{"external_id": external_id,
+                         "service_id": service_id,
+                         "persona_id": personas[external_id]}
+                        for external_id in external_ids],
+                       keys=("external_id",),
+                       update=("persona_id",) if persona is not None else ())
+
+  if new:
+    # Another writer may have inserted some of the accounts first, leaving their Personas unused
+    session.execute(Persona.__table__.delete()
+                    .where(Persona.id.in_([personas[external_id] for external_id in new]))
+                    .where(~exists().where(Account.persona_id == Persona.id)))
+
+  return account_ids
+
+
+def _name_rows(user, account_id, when):
+  if user.screen_name:
+    yield {"name": "@" + user.screen_name, "account_id": account_id, "when": when}
+  if user.name:
+    yield {"name": user.name, "account_id": account_id, "when": when}
+
+
+def _upsert_names(session, users, account_ids, when):
+  """Upsert the screen and display names of many Twitter users at once, returning their ids."""
+
+  return upsert(session, Name,
+                [row
+                 for user, account_id in zip(users, account_ids)
+                 for row in _name_rows(user, account_id, when)],
+                keys=("name", "account_id"),
+                update=("when",))
+
+
 def insert_handle(session, user, persona=None):
   """
   Insert a Twitter Handle, creating a Persona for it if there isn't one.
@@ -46,54 +108,55 @@ def insert_handle(session, user, persona=None):
   If the Handle is already known, just linked to another Persona, steal it.
   """
 
-  external_id = twitter_external_user_id(user.id)
-  handle = session.query(Account).filter_by(external_id=external_id).first()
-  if not handle:
-    if not persona:
-      persona = Persona()
-      session.add(persona)
+  [account_id] = _upsert_handles(session, [user], persona)
+  commit(session)
 
-    handle = Account(service=insert_twitter(session),
-                     external_id=external_id,
-                     persona=persona)
-
-  elif handle and persona:
-    handle.persona = persona
-
-  session.add(handle)
-  session.commit()
-
-  return handle
+  return session.query(Account).populate_existing().get(account_id)
 
 
 def insert_screen_name(session, user, handle=None, when=None):
   """Insert a screen name, attaching it to a handle."""
 
   if user.screen_name:
-    external_id = twitter_external_user_id(user.id)
-    handle = handle or get_or_create(session, Account, external_id=external_id)
-    screen_name = get_or_create(session, Name,
-                                name="@" + user.screen_name,
-                                account=handle)
-    screen_name.when = when or now()
-    session.add(screen_name)
+    handle = handle or insert_handle(session, user)
+    [name_id] = upsert(session, Name,
+                       [{"name": "@" + user.screen_name,
+                         "account_id": handle.id,
+                         "when": when or now()}],
+                       keys=("name", "account_id"),
+                       update=("when",))
 
-    return screen_name
+    return session.query(Name).populate_existing().get(name_id)
 
 
 def insert_display_name(session, user, handle=None, when=None):
   """Insert a display name, attaching it to a handle."""
 
   if user.name:
-    external_id = twitter_external_user_id(user.id)
-    handle = handle or get_or_create(session, Account, external_id=external_id)
-    display_name = get_or_create(session, Name,
-                                 name=user.name,
-                                 account=handle)
-    display_name.when = when or now()
-    session.add(display_name)
+    handle = handle or insert_handle(session, user)
+    [name_id] = upsert(session, Name,
+                       [{"name": user.name,
+                         "account_id": handle.id,
+                         "when": when or now()}],
+                       keys=("name", "account_id"),
+                       update=("when",))
+
+    return session.query(Name).populate_existing().get(name_id)
 
-    return display_name
+
+def insert_users(session, users, persona=None, when=None):
+  """
+  Given a SQL session and many Twitter users, find (or create) their handles and write out their
+  screen and display names at the present point in time, returning the handles' ids in order.
+
+  This takes the same few statements however many users there are.
+  """
+
+  when = when or now()
+
+  account_ids = _upsert_handles(session, users, persona)
+  _upsert_names(session, users, account_ids, when)
+  return account_ids
 
 
 def insert_user(session, user, persona=None, when=None):
@@ -106,14 +169,9 @@ def insert_user(session, user, persona=None, when=None):
 
   assert isinstance(user, User)
 
-  when = when or now()
-
-  handle = insert_handle(session, user, persona)
-  insert_screen_name(session, user, handle, when=when)
-  insert_display_name(session, user, handle, when=when)
-  session.commit()
-  session.refresh(handle)
-  return handle
+  [account_id] = insert_users(session, [user], persona=persona, when=when)
+  commit(session)
+  return session.query(Account).populate_existing().get(account_id)
 
 
 def handle_for_screenname(session, screenname):
@@ -125,6 +183,14 @@ def handle_for_screenname(session, screenname):
       .one()
 
 
+def _insert_follow(session, left, right, when):
+  upsert(session, AccountRelationship,
+         [{"left_id": left.id, "right_id": right.id, "rel": "follows", "when": when}],
+         keys=("left_id", "right_id", "rel"),
+         update=("when",))
+  commit(session)
+
+
 def crawl_followers(session, twitter_api, crawl_user,
                     crawl_user_id=None, when=None):
   if not crawl_user_id:
@@ -150,10 +216,7 @@ def crawl_followers(session, twitter_api, crawl_user,
         user = twitter_api.GetUser(user_id=user_id)
         new_account = insert_user(session, user)
         print(new_account)
-        get_or_create(session, AccountRelationship,
-                      left=new_account, right=crawl_user,
-                      rel="follows",
-                      when=when)
+        _insert_follow(session, new_account, crawl_user, when)
 
     except twitter.error.TwitterError as e:
       print(user_id, e)
@@ -179,10 +242,7 @@ def crawl_friends(session, twitter_api, crawl_user,
         user = twitter_api.GetUser(user_id=user_id)
         new_user = insert_user(session, user)
         print(new_user)
-        get_or_create(session, AccountRelationship,
-                      left=crawl_user, right=new_user,
-                      rel="follows",
-                      when=when)
+        _insert_follow(session, crawl_user, new_user, when)
 
     except twitter.error.TwitterError as e:
       print(user_id, e)
@@ -209,10 +269,23 @@ def _get_tweet_text(tweet):
   return tweet.full_text or tweet.text
 
 
+def _upsert_dummies(session, tweet_ids):
+  """Upsert placeholder Posts for many tweet IDs at once, returning their ids in order.
+
+  Tweets which are already known are left untouched.
+  """
+
+  service_id = insert_twitter(session).id
+  return upsert(session, Post,
+                [{"external_id": twitter_external_tweet_id(tweet_id),
+                  "service_id": service_id}
+                 for tweet_id in tweet_ids],
+                keys=("external_id",))
+
+
 def _tweet_or_dummy(session, external_id):
-  return get_or_create(session, Post,
-                       external_id=twitter_external_tweet_id(external_id),
-                       service=insert_twitter(session))
+  [post_id] = _upsert_dummies(session, [external_id])
+  return session.query(Post).populate_existing().get(post_id)
 
 
 def insert_tweet(session, twitter_api, tweet):
@@ -225,60 +298,48 @@ def insert_tweet(session, twitter_api, tweet):
   expected that some other system handles walking the tree of tweets to deal with all that. This is,
   ultimately, to work around the garbage Twitter rate limits.
 
+  Every insert is a bulk upsert of all the rows of one table, so a tweet costs the same few
+  statements however many users it mentions.
+
   """
 
   _tw = insert_twitter(session)
-  try:
-    poster = tweet.user
-    if not isinstance(poster, User):
-      poster = User.NewFromJsonDict(poster)
-    poster = insert_user(session, poster)
-    assert isinstance(poster, Account)
-  except AssertionError as e:
-    print("Encountered exception", repr(e), traceback.format_exc(), "Processing tweet", tweet)
-    return None
-
-  dupe = session.query(Post)\
-                .filter_by(external_id=twitter_external_tweet_id(tweet.id))\
-                .first()
-  # There's a dummy record in place, flesh it out. We're in a monoid here.
-  if dupe:
-    dupe.poster = poster
-    dupe.when = aget(datetime.strptime(tweet.created_at, _tw_datetime_pattern))
-    dupe.text = _get_tweet_text(tweet)
-    dupe.more = tweet.AsDict()
-    session.add(dupe)
-    session.commit()
-    return dupe
-
-  # We're inserting a new tweet here...
-  else:
-    post = Post(service=_tw,
-                text=_get_tweet_text(tweet),
-                external_id=twitter_external_tweet_id(tweet.id_str),
-                poster=poster,
-                when=aget(datetime.strptime(tweet.created_at, _tw_datetime_pattern)),
-                more=tweet.AsDict())
-    session.add(post)
-
-    for user in tweet.user_mentions:
-      get_or_create(session, PostDistribution,
-                    post=post,
-                    recipient=insert_user(session, User(id=user.id)),
-                    rel="to")
-
-    if tweet.in_reply_to_status_id:
-      get_or_create(session, PostRelationship,
-                    left=post,
-                    right=_tweet_or_dummy(session, tweet.in_reply_to_status_id),
-                    rel="reply-to")
-
-    if tweet.quoted_status_id:
-      get_or_create(session, PostRelationship,
-                    left=post,
-                    right=_tweet_or_dummy(session, tweet.quoted_status_id),
-                    rel="quotes")
-
-    session.commit()
-
-    return post
+  poster = tweet.user
+  if not isinstance(poster, User):
+    poster = User.NewFromJsonDict(poster)
+
+  # Mentioned users are only inserted by ID, their names are left to whoever ingests them
+  mentioned = [User(id=user.id) for user in tweet.user_mentions or []]
+  account_ids = insert_users(session, [poster] + mentioned)
+  poster_id, recipient_ids = account_ids[0], account_ids[1:]
+
+  # There may be a dummy record in place, in which case flesh it out. We're in a monoid here.
+  [post_id] = upsert(session, Post,
+                     [{"external_id": twitter_external_tweet_id(tweet.id_str),
+                       "service_id": _tw.id,
+                       "poster_id": poster_id,
+                       "when": aget(datetime.strptime(tweet.created_at, _tw_datetime_pattern)),
+                       "text": _get_tweet_text(tweet),
+                       "more": tweet.AsDict()}],
+                     keys=("external_id",),
+                     update=("service_id", "poster_id", "when", "text", "more"))
+
+  upsert(session, PostDistribution,
+         [{"post_id": post_id, "recipient_id": recipient_id, "rel": "to"}
+          for recipient_id in recipient_ids],
+         keys=("post_id", "recipient_id", "rel"))
+
+  related = [(rel, tweet_id)
+             for rel, tweet_id in [("reply-to", tweet.in_reply_to_status_id),
+                                   ("quotes", tweet.quoted_status_id)]
+             if tweet_id]
+  if related:
+    right_ids = _upsert_dummies(session, [tweet_id for _rel, tweet_id in related])
+    upsert(session, PostRelationship,
+           [{"left_id": post_id, "right_id": right_id, "rel": rel}
+            for (rel, _tweet_id), right_id in zip(related, right_ids)],
+           keys=("left_id", "right_id", "rel"))
+
+  commit(session)
+
+  return session.query(Post).populate_existing().get(post_id)
@@ -1,36 +1,194 @@
 """
 Helpers for dealing with SQL connections.
+
+Engines are pooled and shared per process. Every `!skrode/sql` node for the same database, and
+every call of :py:func:`get_session` with the same URI, gets the same engine and the same
+thread-local scoped session, so a worker holds at most one connection pool per database. An engine
+inherited across a fork is left alone, and the child makes its own on first use.
+
+Missing tables are created at most once per database: when its engine is first made, in the first
+process to make one. Workers may skip even that with `create_schema: false`. Changes to existing
+tables, such as indexing them, may be slow on a large database, and are only made by
+:py:func:`migrate` when the `migrate.pex` tool is run.
 """
 
+import os
+
 from skrode import schema
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import and_, create_engine, exists, func, inspect, or_, select, UniqueConstraint
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.schema import AddConstraint
 
 
 CONN_FORMAT = "{dialect}://{username}:{password}@{hostname}:{port}/{database}"
 
+# Engines and sessions by pid and URI, and the URIs whose missing tables have been created
+_ENGINES = {}
+_SESSIONS = {}
+_CREATED = set()
+
 
 def make_uri(**kwargs):
   return CONN_FORMAT.format(**kwargs)
 
 
-def make_engine_session_factory(config=None, uri=None):
-  """Returns a session factory for the given db URI. By default uses a local sqlite3 db."""
+def _add_unique_constraints(conn):
+  """Add the unique constraints of the schema which tables made by older versions lack.
 
-  assert config or uri
+  Duplicate rows are deleted first, keeping the one with the least id, and the constrained columns
+  are made NOT NULL if the schema says so. Rows with a NULL in a constrained column can't be told
+  apart from each other safely, so if there are any RuntimeError is raised. Returns a list of
+  descriptions of the changes made.
+  """
 
-  if config and not uri:
-    db_uri = config.sql.uri
+  changes = []
+
+  inspector = inspect(conn)
+  tables = set(inspector.get_table_names())
+  for table in schema.Base.metadata.sorted_tables:
+    if table.name not in tables:
+      continue
+
+    existing = [set(constraint["column_names"])
+                for constraint in inspector.get_unique_constraints(table.name)]
+    existing.extend(set(index["column_names"])
+                    for index in inspector.get_indexes(table.name) if index["unique"])
+
+    for constraint in table.constraints:
+      if not isinstance(constraint, UniqueConstraint):
+        continue
+
+      keys = [column.name for column in constraint.columns]
+      if set(keys) in existing:
+        continue
+
+      nulls = conn.execute(select([func.count()]).select_from(table)
+                           .where(or_(*[table.c[key].is_(None) for key in keys]))).scalar()
+      if nulls:
+        raise RuntimeError("Can't add a unique constraint over %s (%s): %d rows have NULL keys, "
+                           "which must be fixed or deleted first"
+                           % (table.name, ", ".join(keys), nulls))
 
-  engine = create_engine(uri)
+      dup = table.alias("dup")
+      deleted = conn.execute(table.delete()
+                             .where(exists().where(and_(dup.c.id < table.c.id,
+                                                        *[dup.c[key] == table.c[key]
+                                                          for key in keys])))).rowcount
+      for key in keys:
+        if not table.c[key].nullable:
+          conn.execute("ALTER TABLE %s ALTER COLUMN %s SET NOT NULL" % (table.name, key))
+      conn.execute(AddConstraint(constraint))
+      changes.append("Added unique constraint %s (%s), deleting %d duplicate rows"
+                     % (table.name, ", ".join(keys), deleted))
+
+  return changes
+
+
+def _add_post_search(conn):
+  """Add the text search column of posts, and the trigger which keeps it up to date, to a post table
+  made by an older version, filling the column in for the posts already there. Postgres only.
+  Returns a list of descriptions of the changes made.
+  """
+
+  changes = []
+
+  if "search" not in set(column["name"] for column in inspect(conn).get_columns("post")):
+    conn.execute("ALTER TABLE post ADD COLUMN search tsvector")
+    changes.append("Added column post.search")
+
+  if not conn.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'post_search_update'").first():
+    conn.execute(schema.POST_SEARCH_TRIGGER)
+    # The trigger only covers posts written from now on
+    filled = conn.execute("UPDATE post SET search = to_tsvector('pg_catalog.english', "
+                          "coalesce(text, ''))").rowcount
+    changes.append("Created trigger post_search_update, filling in the search vectors of %d posts"
+                   % (filled,))
+
+  return changes
+
+
+def create_tables(engine):
+  """Create any missing tables of the schema, with their indices. Existing tables are left alone."""
 
-  # Note this _is_ reloading safe, but is bad at schema migrations
   schema.Base.metadata.create_all(engine, checkfirst=True)
 
-  # Start a session to the database
-  session_factory = sessionmaker(bind=engine)
-  return engine, session_factory
+
+def migrate(engine):
+  """Create any missing tables and indices of the schema, and add the unique constraints which
+  upserts rely on and the text search column of posts to existing tables, returning a list of
+  descriptions of the changes made to existing tables. Note this is reloading safe, but is bad at
+  schema migrations: other changes to existing columns and constraints aren't made."""
+
+  create_tables(engine)
+
+  with engine.begin() as conn:
+    changes = _add_unique_constraints(conn)
+    if engine.dialect.name == "postgresql":
+      changes.extend(_add_post_search(conn))
+      # Indexing names by trigram needs it
+      conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+  # create_all only indexes the tables it creates, so index older tables too
+  inspector = inspect(engine)
+  for table in schema.Base.metadata.sorted_tables:
+    existing = set(index["name"] for index in inspector.get_indexes(table.name))
+    for index in table.indexes:
+      if index.name not in existing:
+        index.create(engine)
+        changes.append("Created index %s" % (index.name,))
+
+  return changes
+
+
+def get_engine(uri, pool_size=5, max_overflow=10, pool_pre_ping=True, pool_recycle=3600,
+               create_schema=True):
+  """Return this process' shared engine for a database URI, making it if need be.
+
+  `pool_size` connections are kept open, and up to `max_overflow` more are made under load.
+  Connections are tested before each use if `pool_pre_ping`, and replaced once they are
+  `pool_recycle` seconds old. As with connection pools of Redis, the first call for a URI
+  determines the options of its engine.
+  """
+
+  key = (os.getpid(), uri)
+  if key not in _ENGINES:
+    kwargs = {}
+    if not uri.startswith("sqlite"):
+      # SQLite's pools don't take a size
+      kwargs.update(pool_size=pool_size, max_overflow=max_overflow)
+
+    engine = create_engine(uri, pool_pre_ping=pool_pre_ping, pool_recycle=pool_recycle, **kwargs)
+    if create_schema and uri not in _CREATED:
+      create_tables(engine)
+      _CREATED.add(uri)
+
+    _ENGINES[key] = engine
+
+  return _ENGINES[key]
+
+
+def get_session(uri, **kwargs):
+  """Return this process' shared scoped session for a database URI, which proxies a session per
+  thread. Takes the same options as :py:func:`get_engine`."""
+
+  key = (os.getpid(), uri)
+  if key not in _SESSIONS:
+    _SESSIONS[key] = scoped_session(sessionmaker(bind=get_engine(uri, **kwargs)))
+
+  return _SESSIONS[key]
+
+
+def make_engine_session_factory(config=None, uri=None):
+  """Returns the shared engine and a session factory for the given db URI."""
+
+  assert config or uri
+
+  if config and not uri:
+    uri = config.sql.uri
+
+  engine = get_engine(uri)
+  return engine, sessionmaker(bind=engine)
 
 
 def make_session(config=None, uri=None):
@@ -0,0 +1,169 @@
+"""
+Batched commits for ingestion.
+
+The insert helpers in `skrode.services` and `skrode.personas` finish by committing, so that each
+one is durable on its own. Ingesting a stream of events that way costs a commit, and a Postgres
+fsync, per helper call. Within a :py:class:`UnitOfWork` those helpers instead flush their writes
+(:py:func:`commit`), and the unit of work commits once per batch of events.
+
+.. code-block:: python
+
+   with UnitOfWork(session, size=100, interval=5) as uow:
+     for tweet in tweets:
+       insert_tweet(session, twitter_api, tweet)
+       uow.done()
+
+An event whose writes may fail on their own, such as a bad queue item, can be processed in a
+SAVEPOINT with `event`, so that a failure rolls back only that event rather than the batch.
+
+.. code-block:: python
+
+   with UnitOfWork(session, size=100, interval=5) as uow:
+     for item in items:
+       try:
+         with uow.event(on_commit=item.complete, on_rollback=item.abort):
+           insert_tweet(session, twitter_api, item.value)
+       except Exception as e:
+         log.error(e)
+"""
+
+from __future__ import absolute_import
+
+import time
+
+
+_KEY = "skrode.unit_of_work"
+
+
+def commit(session):
+  """Commit the session, or if it is in a unit of work, flush it for the unit of work to commit."""
+
+  if _KEY in session.info:
+    session.flush()
+  else:
+    session.commit()
+
+
+class _Event(object):
+  """Helper class. One event of a :py:class:`UnitOfWork`, whose writes are made in a SAVEPOINT."""
+
+  def __init__(self, uow, on_commit=None, on_rollback=None):
+    self._uow = uow
+    self._on_commit = on_commit
+    self._on_rollback = on_rollback
+    self._savepoint = None
+
+  def __enter__(self):
+    self._savepoint = self._uow._session.begin_nested()
+    return self
+
+  def __exit__(self, type, value, traceback):
+    if type is not None:
+      self._rollback("%s: %s" % (type.__name__, value))
+      return
+
+    try:
+      # Flushes the event's writes, which is where constraint violations surface
+      self._savepoint.commit()
+    except Exception as e:
+      self._rollback("%s: %s" % (e.__class__.__name__, e))
+      raise
+
+    self._uow.done(on_commit=self._on_commit, on_rollback=self._on_rollback)
+
+  def _rollback(self, error):
+    self._savepoint.rollback()
+    if self._on_rollback:
+      self._on_rollback(error)
+
+
+class UnitOfWork(object):
+  """Commits a session once per batch of events, rather than once per write.
+
+  Every event is marked `done` once its writes are made. The unit of work commits when `size`
+  events are done, when `interval` seconds have passed since the first uncommitted event was done,
+  and when the unit of work exits. If the batch can't be committed, or the unit of work exits with
+  an exception, the whole batch is rolled back.
+
+  An event's `on_commit` callback is called once its writes are committed, and its `on_rollback`
+  callback with a description of the error if they are rolled back. For instance, a queue item may
+  be acknowledged only once its writes are durable, and given back to the queue if they are lost.
+  """
+
+  def __init__(self, session, size=100, interval=5):
+    self._session = session
+    self._size = size
+    self._interval = interval
+    self._pending = []
+    self._commit_at = None
+    self.commits = 0
+
+  def __enter__(self):
+    if _KEY in self._session.info:
+      raise RuntimeError("The session is already in a unit of work")
+
+    self._session.info[_KEY] = self
+    return self
+
+  def __exit__(self, type, value, traceback):
+    del self._session.info[_KEY]
+    if type is None:
+      self.commit()
+    else:
+      self.rollback(error="%s: %s" % (type.__name__, value))
+
+  def __len__(self):
+    return len(self._pending)
+
+  def done(self, on_commit=None, on_rollback=None):
+    """Mark an event as done, committing the batch if it is full or due."""
+
+    self._pending.append((on_commit, on_rollback))
+    if self._commit_at is None:
+      self._commit_at = time.time() + self._interval
+
+    if len(self._pending) >= self._size:
+      self.commit()
+    else:
+      self.poll()
+
+  def event(self, on_commit=None, on_rollback=None):
+    """Returns a context manager making an event's writes in a SAVEPOINT.
+
+    If the block succeeds, its writes are flushed and the event is marked `done`. If the block or
+    the flush raises, only the event's writes are rolled back, its `on_rollback` callback is
+    called, and the error propagates. The rest of the batch is unaffected.
+    """
+
+    return _Event(self, on_commit=on_commit, on_rollback=on_rollback)
+
+  def poll(self):
+    """Commit the batch if its `interval` has passed. Idle loops should call this periodically."""
+
+    if self._commit_at is not None and time.time() >= self._commit_at:
+      self.commit()
+
+  def commit(self):
+    """Commit every event done so far."""
+
+    pending, self._pending, self._commit_at = self._pending, [], None
+    try:
+      self._session.commit()
+    except Exception as e:
+      self._pending = pending
+      self.rollback(error="%s: %s" % (e.__class__.__name__, e))
+      raise
+
+    self.commits += 1
+    for on_commit, _on_rollback in pending:
+      if on_commit:
+        on_commit()
+
+  def rollback(self, error=None):
+    """Roll back every event done since the last commit, passing `error` to their callbacks."""
+
+    pending, self._pending, self._commit_at = self._pending, [], None
+    self._session.rollback()
+    for _on_commit, on_rollback in pending:
+      if on_rollback:
+        on_rollback(error)
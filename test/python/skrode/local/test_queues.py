@@ -0,0 +1,102 @@
+from json import dumps, loads
+from multiprocessing import Process
+
+from skrode.local.workqueue import Consumer, Producer
+
+import pytest
+from pytest import fixture
+
+@fixture
+def path(tmpdir):
+  return str(tmpdir.join("queue"))
+
+
+def test_produce_consume(path):
+  source = Producer(path, encoder=dumps)
+  sink0 = Consumer(path, "test_key_consumer_0", decoder=loads)
+  sink1 = Consumer(path, "test_key_consumer_1", decoder=loads)
+
+  for i in range(1, 100):
+    source.put(i)
+    assert len(source) == i
+    with sink0.next() as next_value0:
+      with sink1.next() as next_value1:
+        assert i == next_value0 == next_value1
+
+  assert len(sink0) == len(sink1) == 0
+
+
+def test_abort_redelivers_one_item(path):
+  source = Producer(path, encoder=dumps)
+  sink = Consumer(path, "test_key_consumer", decoder=loads)
+
+  source.put_many(range(5))
+
+  sink.next().complete()
+  failed = sink.next()
+  sink.next().complete()
+  failed.abort()
+
+  with sink.next_batch(3) as values:
+    assert values == [1, 3, 4]
+
+  with pytest.raises(StopIteration):
+    sink.next(timeout=0.05)
+
+
+def test_renew(path):
+  source = Producer(path, encoder=dumps)
+  sink = Consumer(path, "test_key_consumer", decoder=loads, lease=0)
+
+  source.put_many(range(2))
+
+  # Leases of no time are re-delivered at once, unless renewed for longer
+  item = sink.next()
+  item.renew(lease=60)
+  with sink.next_batch(2) as values:
+    assert values == [1]
+
+
+def test_windowed_consumer(path):
+  source = Producer(path, encoder=dumps)
+  sink = Consumer(path, "test_key_consumer", decoder=loads, window=4, lease=0)
+
+  source.put_many(range(6))
+  # The first claim takes the whole window
+  with sink.next() as value:
+    assert value == 0
+  assert len(sink) == 2
+
+  # Acknowledgements are held back until the window is done
+  with sink.next() as value:
+    assert value == 1
+  assert len(sink._state._read()[1]) == 4
+  with sink.next_batch(2) as values:
+    assert values == [2, 3]
+  assert len(sink._state._read()[1]) == 0
+
+  # A consumer which dies before writing its acknowledgements has them re-delivered
+  with sink.next() as value:
+    assert value == 4
+  other = Consumer(path, "test_key_consumer", decoder=loads)
+  with other.next_batch(2) as values:
+    assert sorted(values) == [4, 5]
+
+  sink.flush()
+  assert len(sink._state._read()[1]) == 0
+
+
+def _produce(path):
+  Producer(path, encoder=dumps).put_many(range(100))
+
+
+def test_forked_producers(path):
+  producers = [Process(target=_produce, args=(path,)) for _ in range(4)]
+  for ps in producers:
+    ps.start()
+  for ps in producers:
+    ps.join()
+
+  sink = Consumer(path, "test_key_consumer", decoder=loads)
+  with sink.next_batch(1000) as values:
+    assert sorted(values) == sorted(list(range(100)) * 4)
@@ -0,0 +1,70 @@
+import asyncio
+from json import dumps, loads
+
+from skrode.redis import aio, workqueue
+
+from redis import StrictRedis
+import redis.asyncio
+from pytest import fixture
+
+
+@fixture
+def conn():
+  rds = StrictRedis("localhost", db=15)
+  rds.flushdb()
+  return rds
+
+
+@fixture
+def aconn(conn):
+  # Depends on conn, which flushes the db
+  return redis.asyncio.StrictRedis("localhost", db=15)
+
+
+def _run(coro):
+  # Rather than asyncio.run, which is new in Python 3.7
+  loop = asyncio.new_event_loop()
+  try:
+    return loop.run_until_complete(coro)
+  finally:
+    loop.close()
+
+
+def test_async_produce_consume(conn, aconn):
+  async def _test():
+    source = aio.Producer(aconn, "test_key", encoder=dumps)
+    sink = aio.Consumer(aconn, "test_key", "test_key_consumer", decoder=loads)
+
+    assert await source.put_many(range(10)) == range(10)
+    assert await sink.length() == 10
+
+    async with await sink.next() as value:
+      assert value == 0
+    async with await sink.next_batch(100) as values:
+      assert values == list(range(1, 10))
+    assert await sink.next() is None
+
+  _run(_test())
+
+
+def test_interop(conn, aconn):
+  sync_queue = workqueue.WorkQueue(conn, "test_key", encoder=dumps, decoder=loads, lanes=2)
+  async_queue = aio.WorkQueue(aconn, "test_key", encoder=dumps, decoder=loads, lanes=2)
+
+  sync_queue.put(1)
+  sync_queue.put(2, priority=1)
+
+  async def _test():
+    # The same implicit consumer, so each item is delivered once
+    async with await async_queue.get() as value:
+      assert value == 2
+    await async_queue.put(3)
+
+    item = await async_queue.get(timeout=5)
+    assert await item.value() == 1
+    await item.abort()
+
+  _run(_test())
+
+  with sync_queue.get_batch(10) as values:
+    assert values == [1, 3]
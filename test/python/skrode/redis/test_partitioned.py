@@ -0,0 +1,70 @@
+from json import dumps, loads
+
+from skrode.redis.partitioned import PartitionedQueue
+
+from redis import StrictRedis
+from pytest import fixture
+
+
+@fixture
+def conn():
+  rds = StrictRedis("localhost", db=15)
+  rds.flushdb()
+  return rds
+
+
+def _queue(conn, member_id):
+  return PartitionedQueue(conn, "test_key", encoder=dumps, decoder=loads, partitions=4,
+                          member_id=member_id)
+
+
+def _drain(queue):
+  values = []
+  while True:
+    item = queue.get()
+    if item is None:
+      return values
+    with item as value:
+      values.append(value)
+
+
+def test_routing(conn):
+  queue = _queue(conn, "a")
+  assert sum(len(idxs) for idxs in queue.put_many(range(100)).values()) == 100
+  queue.put("x", key="same")
+  queue.put("y", key="same")
+
+  assert len(queue) == 102
+  values = _drain(queue)
+  assert sorted(v for v in values if isinstance(v, int)) == list(range(100))
+  # Values with one routing key share a partition, and keep their order
+  assert [v for v in values if isinstance(v, str)] == ["x", "y"]
+
+
+def test_rebalance(conn):
+  a, b = _queue(conn, "a"), _queue(conn, "b")
+  assert a.assigned() == [0, 1, 2, 3]
+  assert b.assigned() == [1, 3]
+
+  a.put_many(range(100))
+  # a still holds every partition until its next rebalance
+  a._rebalance_at = 0
+  assert a.assigned() == [0, 2]
+
+  values = _drain(a) + _drain(b)
+  assert sorted(values) == list(range(100))
+
+  b.leave()
+  a._rebalance_at = 0
+  assert a.assigned() == [0, 1, 2, 3]
+
+
+def test_dead_letters(conn):
+  queue = PartitionedQueue(conn, "test_key", encoder=dumps, decoder=loads, partitions=4,
+                           member_id="a", max_attempts=1, dead_letter="test_key/dead")
+  queue.put(1)
+
+  item = queue.get()
+  item.abort(error="ValueError: bad item")
+  assert queue.get() is None
+  assert conn.get("test_key/dead") == b"1"
@@ -0,0 +1,18 @@
+from skrode.redis.pool import get_redis, pool_stats
+
+
+def test_shared_pool():
+  a = get_redis("localhost", db=15)
+  b = get_redis("localhost", port="6379", db=15)
+  assert a.connection_pool is b.connection_pool
+  assert get_redis("localhost", db=14).connection_pool is not a.connection_pool
+
+  before = pool_stats()[("localhost", 6379, 15)]
+  a.set("test_key", 1)
+  assert b.get("test_key") == b"1"
+  after = pool_stats()[("localhost", 6379, 15)]
+
+  # Both clients ran their command on the one socket
+  assert after["checkouts"] - before["checkouts"] == 2
+  assert after["created"] <= 1
+  assert after["reused"] >= 1
@@ -1,9 +1,11 @@
 from json import dumps, loads
 from threading import Thread, Event
+from time import sleep, time
 
-from skrode.redis.workqueue import Producer, Consumer
+from skrode.redis.workqueue import Consumer, Producer, WorkQueue
 
 from redis import StrictRedis
+import pytest
 from pytest import fixture
 
 @fixture
@@ -27,3 +29,369 @@ def test_produce_consume(conn):
 
   assert len(sink0) == len(sink1) == 0
   assert len(source) == len(range(1, 100))
+
+
+def test_concurrent_producers(conn):
+  indices = []
+
+  def _produce():
+    source = Producer(conn, "test_key", encoder=dumps)
+    for i in range(50):
+      indices.append(source.put(i))
+
+  producers = [Thread(target=_produce) for _ in range(4)]
+  for t in producers:
+    t.start()
+  for t in producers:
+    t.join()
+
+  assert sorted(indices) == list(range(200))
+
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads)
+  assert len(sink) == 200
+  assert sorted(sink.next().value for _ in range(200)) == sorted(list(range(50)) * 4)
+  assert len(sink) == 0
+
+
+def test_put_many(conn):
+  source = Producer(conn, "test_key", encoder=dumps)
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads)
+
+  assert source.put(0) == 0
+  assert source.put_many(range(1, 100)) == range(1, 100)
+  assert source.put_many([]) == range(0)
+  assert len(source) == 100
+
+  for i in range(100):
+    with sink.next() as value:
+      assert value == i
+
+
+def test_next_batch(conn):
+  source = Producer(conn, "test_key", encoder=dumps)
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads)
+
+  source.put_many(range(10))
+
+  with sink.next_batch(4) as values:
+    assert values == [0, 1, 2, 3]
+
+  try:
+    with sink.next_batch(4) as values:
+      assert values == [4, 5, 6, 7]
+      raise ValueError()
+  except ValueError:
+    pass
+
+  with sink.next_batch(100) as values:
+    assert values == [4, 5, 6, 7, 8, 9]
+
+  assert len(sink) == 0
+
+
+def test_abort_redelivers_one_item(conn):
+  source = Producer(conn, "test_key", encoder=dumps)
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads)
+
+  source.put_many(range(5))
+
+  sink.next().complete()
+  failed = sink.next()
+  sink.next().complete()
+  failed.abort()
+
+  # Only the failed item comes back, ahead of the rest of the queue
+  assert [sink.next().value for _ in range(3)] == [1, 3, 4]
+  assert len(sink) == 0
+
+
+def test_expired_lease_redelivers(conn):
+  source = Producer(conn, "test_key", encoder=dumps)
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads, lease=0.1)
+
+  source.put_many(range(2))
+
+  sink.next()  # Claimed and never acknowledged
+  with sink.next() as value:
+    assert value == 1
+
+  with pytest.raises(StopIteration):
+    sink.next()
+
+  sleep(0.2)
+  with sink.next() as value:
+    assert value == 0
+
+  with pytest.raises(StopIteration):
+    sink.next()
+
+
+@pytest.mark.parametrize("segment_size", [0, 1, 128])
+def test_segment_sizes(conn, segment_size):
+  source = Producer(conn, "test_key", encoder=dumps, segment_size=segment_size)
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads,
+                  segment_size=segment_size)
+
+  source.put_many(range(300))
+  with sink.next_batch(300) as values:
+    assert values == list(range(300))
+
+
+def test_segmenting_flat_queue(conn):
+  Producer(conn, "test_key", encoder=dumps, segment_size=0).put_many(range(25))
+
+  source = Producer(conn, "test_key", encoder=dumps, segment_size=10)
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads, segment_size=10)
+  source.put_many(range(25, 35))
+
+  with sink.next_batch(35) as values:
+    assert values == list(range(35))
+
+  assert source.trim() == 3
+  for idx in range(35):
+    assert not conn.exists("test_key/%016x" % idx)
+
+
+def test_trim(conn):
+  source = Producer(conn, "test_key", encoder=dumps, segment_size=10)
+  sink0 = Consumer(conn, "test_key", "test_key_consumer_0", decoder=loads, segment_size=10)
+  sink1 = Consumer(conn, "test_key", "test_key_consumer_1", decoder=loads, segment_size=10)
+
+  source.put_many(range(50))
+
+  sink0.next_batch(35).complete()
+  held = sink1.next_batch(25)
+  sink1.next_batch(10).complete()
+
+  # sink1 has yet to acknowledge anything before 25
+  assert source.trim() == 0
+
+  held.complete()
+  assert source.trim() == 3
+  assert source.trim() == 0
+
+  with sink0.next_batch(15) as values:
+    assert values == list(range(35, 50))
+
+
+def test_blocking_get(conn):
+  source = Producer(conn, "test_key", encoder=dumps)
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads)
+
+  with pytest.raises(StopIteration):
+    sink.next(timeout=0.1)
+
+  def _produce():
+    sleep(0.1)
+    source.put(1)
+
+  t = Thread(target=_produce)
+  t.start()
+  with sink.next(timeout=5) as value:
+    assert value == 1
+  t.join()
+
+
+def test_dedup(conn):
+  source = Producer(conn, "test_key", encoder=dumps, dedup=60)
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads)
+
+  assert source.put(1) == 0
+  assert source.put(1) is None
+  assert source.put_many([1, 2, 2, 3]) == range(1, 3)
+  assert source.suppressed() == 3
+
+  with sink.next_batch(10) as values:
+    assert values == [1, 2, 3]
+
+
+def test_priority_lanes(conn):
+  queue = WorkQueue(conn, "test_key", encoder=dumps, decoder=loads, lanes=2, starvation_ratio=2)
+
+  queue.put_many(range(10))
+  queue.put_many(range(100, 110), priority=1)
+  queue.put(200, priority=5)
+
+  values = []
+  for _ in range(6):
+    with queue.get() as value:
+      values.append(value)
+
+  # Two high priority items, then one low priority item
+  assert values == [100, 101, 0, 102, 103, 1]
+  assert len(queue) == 15
+
+
+def test_dead_letters(conn):
+  queue = WorkQueue(conn, "test_key", encoder=dumps, decoder=loads,
+                    dead_letter="test_key/dead", max_attempts=2)
+
+  queue.put_many([1, 2])
+  for _ in range(2):
+    with pytest.raises(ValueError):
+      with queue.get() as value:
+        assert value == 1
+        raise ValueError("bad item")
+
+  # The first item used its attempts, and was dead lettered when it was aborted
+  with queue.get() as value:
+    assert value == 2
+
+  assert queue.get() is None
+  assert queue.dead_letters() == [(0, 1, "ValueError: bad item")]
+
+  assert queue.requeue_dead_letters() == 1
+  assert queue.dead_letters() == []
+  with queue.get() as value:
+    assert value == 1
+
+
+def test_seek(conn):
+  source = Producer(conn, "test_key", encoder=dumps)
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads)
+
+  source.put_many(range(10))
+  with sink.next_batch(10) as values:
+    assert values == list(range(10))
+  assert sink.offset() == 10
+
+  # Rewind, and a new consumer starts from the beginning
+  assert sink.seek(offset=5) == 5
+  assert len(sink) == 5
+  replay = Consumer(conn, "test_key", "test_key_replay", decoder=loads)
+  assert replay.offset() == 0
+
+  with pytest.raises(IndexError):
+    sink.seek(offset=11)
+
+  # Everything so far was put in the past, so seeking to now lands at the end
+  sleep(1)
+  assert sink.seek(timestamp=time()) == 10
+  source.put(10)
+  with sink.next() as value:
+    assert value == 10
+  assert sink.seek(timestamp=0) == 0
+
+  # Consumers are registered by their first claim or seek, and hold back trimming until unregistered
+  offsets = source._list.consumers()
+  assert "test_key_replay" not in offsets
+  assert offsets["test_key_consumer"]["offset"] == 0
+
+  replay.seek(offset=0)
+  assert source._list.consumers()["test_key_replay"] == {"offset": 0, "lag": 11, "inflight": 0}
+  assert replay.unregister()
+  assert "test_key_replay" not in source._list.consumers()
+
+
+def test_claim_checks(conn):
+  source = Producer(conn, "test_key", encoder=dumps, indirect=100, segment_size=1)
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads, segment_size=1)
+
+  big = "x" * 1000
+  source.put_many([1, big, big])
+
+  # The sequence holds a short reference, and both puts share one payload
+  assert len(source._list[1]) < 100
+  assert source._list[1] == source._list[2]
+  assert len(conn.keys("test_key/payload/*")) == 2
+
+  with sink.next() as value:
+    assert value == 1
+  with sink.next_batch(2) as values:
+    assert values == [big, big]
+
+  # Trimming the last reference drops the payload
+  source.trim()
+  assert conn.keys("test_key/payload/*") == []
+
+
+def test_retention_and_archive(conn, tmpdir):
+  source = Producer(conn, "test_key", encoder=dumps, segment_size=2, retain_items=4,
+                    archive=str(tmpdir))
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads, segment_size=2,
+                  archive=str(tmpdir))
+
+  source.put_many(range(10))
+  with sink.next_batch(10):
+    pass
+
+  # The last 4 items are retained, and the rest archived
+  assert source.trim() == 3
+  assert sorted(tmpdir.listdir()) == [tmpdir.join("%012x.seg.gz" % seg) for seg in range(3)]
+
+  # Archived items may still be replayed
+  assert sink.seek(offset=1) == 1
+  with sink.next_batch(3) as values:
+    assert values == [1, 2, 3]
+  with sink.next_batch(10) as values:
+    assert values == list(range(4, 10))
+
+
+def test_archive_segmenting_flat_queue(conn, tmpdir):
+  Producer(conn, "test_key", encoder=dumps, segment_size=0).put_many(range(5))
+
+  source = Producer(conn, "test_key", encoder=dumps, segment_size=4, retain_items=2,
+                    archive=str(tmpdir))
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads, segment_size=4,
+                  archive=str(tmpdir))
+  source.put_many(range(5, 10))
+  with sink.next_batch(10):
+    pass
+
+  # The second segment holds both flat and segmented items
+  assert source.trim() == 2
+  assert sink.seek(offset=0) == 0
+  with sink.next_batch(10) as values:
+    assert values == list(range(10))
+
+
+def test_dead_letter_from_archive(conn, tmpdir):
+  queue = WorkQueue(conn, "test_key", encoder=dumps, decoder=loads, segment_size=2,
+                    retain_items=2, archive=str(tmpdir), dead_letter="test_key/dead",
+                    max_attempts=1)
+
+  queue.put_many(range(6))
+  queue.get_batch(6).complete()
+  assert queue.trim() == 2
+
+  # Replaying an archived item until it runs out of attempts buries it
+  queue.seek(offset=1)
+  with pytest.raises(ValueError):
+    with queue.get() as value:
+      assert value == 1
+      raise ValueError("bad item")
+
+  assert queue.dead_letters() == [(0, 1, "ValueError: bad item")]
+  assert queue.requeue_dead_letters() == 1
+  queue.seek(offset=6)
+  with queue.get() as value:
+    assert value == 1
+
+
+def test_windowed_consumer(conn):
+  source = Producer(conn, "test_key", encoder=dumps)
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads, window=4, lease=0)
+
+  source.put_many(range(6))
+  # The first claim takes the whole window, advancing the cursor once
+  with sink.next() as value:
+    assert value == 0
+  assert sink.offset() == 4
+
+  # Acknowledgements are held back until the window is done
+  with sink.next() as value:
+    assert value == 1
+  assert len(sink._inflight) == 4
+  with sink.next_batch(2) as values:
+    assert values == [2, 3]
+  assert len(sink._inflight) == 0
+
+  # A consumer which dies before sending its acknowledgements has them re-delivered
+  with sink.next() as value:
+    assert value == 4
+  other = Consumer(conn, "test_key", "test_key_consumer", decoder=loads)
+  with other.next_batch(2) as values:
+    assert sorted(values) == [4, 5]
+
+  sink.flush()
+  assert len(sink._inflight) == 0
@@ -0,0 +1,69 @@
+from json import dumps, loads
+
+from skrode.redis.streams import Consumer, Producer
+
+from redis import StrictRedis
+import pytest
+from pytest import fixture
+
+@fixture
+def conn():
+  rds = StrictRedis("localhost", db=15)
+  rds.flushdb()
+  return rds
+
+
+def test_produce_consume(conn):
+  source = Producer(conn, "test_key", encoder=dumps)
+  sink0 = Consumer(conn, "test_key", "test_key_consumer_0", decoder=loads)
+  sink1 = Consumer(conn, "test_key", "test_key_consumer_1", decoder=loads)
+
+  for i in range(1, 100):
+    source.put(i)
+    assert len(source) == i
+    with sink0.next() as next_value0:
+      with sink1.next() as next_value1:
+        assert i == next_value0 == next_value1
+
+  with pytest.raises(StopIteration):
+    sink0.next()
+
+
+def test_abort_redelivers_one_item(conn):
+  source = Producer(conn, "test_key", encoder=dumps)
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads)
+
+  source.put_many(range(5))
+
+  sink.next().complete()
+  failed = sink.next()
+  sink.next().complete()
+  failed.abort()
+
+  with sink.next_batch(3) as values:
+    assert values == [1, 3, 4]
+
+
+def test_trim(conn):
+  source = Producer(conn, "test_key", encoder=dumps)
+  sink0 = Consumer(conn, "test_key", "test_key_consumer_0", decoder=loads)
+  sink1 = Consumer(conn, "test_key", "test_key_consumer_1", decoder=loads)
+
+  source.put_many(range(10))
+  sink0.next_batch(8).complete()
+  held = sink1.next_batch(5)
+
+  assert source.trim() == 0
+  held.complete()
+  assert source.trim() == 5
+  assert len(source) == 5
+
+
+def test_len(conn):
+  source = Producer(conn, "test_key", encoder=dumps)
+  sink = Consumer(conn, "test_key", "test_key_consumer", decoder=loads)
+
+  source.put_many(range(10))
+  assert len(sink) == 10
+  sink.next_batch(3).complete()
+  assert len(sink) == 7
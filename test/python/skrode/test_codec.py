@@ -0,0 +1,41 @@
+"""
+Tests covering the queue payload codecs.
+"""
+
+import json
+
+from skrode.codec import Codec
+
+import pytest
+
+
+TWEET = {"id": 950000000000000000, "text": "hello world " * 20, "user": {"screen_name": "arrdem"}}
+
+
+@pytest.mark.parametrize("codec", ["json", "msgpack"])
+@pytest.mark.parametrize("compress_above", [None, 0, 1 << 20])
+def test_round_trip(codec, compress_above):
+  codec = Codec(codec, compress_above=compress_above)
+  assert codec.decode(codec.encode(TWEET)) == TWEET
+
+
+def test_json_is_unchanged():
+  assert Codec("json").encode(TWEET) == json.dumps(TWEET)
+
+
+def test_decodes_legacy_json():
+  # Entries written before codecs were introduced come back from Redis as bare JSON bytes
+  for codec in ["json", "msgpack"]:
+    assert Codec(codec).decode(json.dumps(TWEET).encode("utf-8")) == TWEET
+
+
+def test_compress_above():
+  codec = Codec("msgpack", compress_above=64)
+  assert len(codec.encode(TWEET)) < len(Codec("msgpack").encode(TWEET))
+  assert Codec("msgpack").encode(1)[:1] == b"\x01"
+  assert codec.encode(1) == Codec("msgpack").encode(1)
+
+
+def test_unknown_codec():
+  with pytest.raises(ValueError):
+    Codec("xml")
@@ -0,0 +1,41 @@
+"""
+Tests covering the shape of post search queries.
+"""
+
+from decimal import Decimal
+import uuid
+
+from skrode import search
+
+from sqlalchemy.dialects.postgresql import psycopg2
+from sqlalchemy.orm import Session
+
+
+def _sql(query):
+  return str(query.statement.compile(dialect=psycopg2.dialect()))
+
+
+def test_search_uses_the_index():
+  sql = _sql(search.search_query(Session(), "hello world"))
+  assert "post.search @@ plainto_tsquery" in sql
+  assert "post.tombstone IS NOT true" in sql
+  assert sql.endswith("ORDER BY rank DESC, post.id")
+
+
+def test_filters():
+  sql = _sql(search.search_query(Session(), "hello", service="Twitter", persona=uuid.uuid4(),
+                                 since="2017-01-01", until="2018-01-01"))
+  assert "JOIN service" in sql
+  assert "account.persona_id =" in sql
+  assert 'post."when" >=' in sql
+  assert 'post."when" <' in sql
+
+
+def test_keyset_cursor():
+  post_id = uuid.uuid4()
+  cursor = search._cursor(Decimal("0.06079271"), post_id)
+  assert search._parse_cursor(cursor) == (Decimal("0.06079271"), post_id)
+
+  sql = _sql(search.search_query(Session(), "hello", after=cursor))
+  assert "post.id >" in sql
+  assert "OFFSET" not in sql
@@ -0,0 +1,17 @@
+"""
+Tests covering the shared engine and session registry.
+"""
+
+from skrode import sql
+
+
+def test_shared_engine_and_session(tmpdir):
+  uri = "sqlite:///%s" % (tmpdir.join("a.db"),)
+  session = sql.get_session(uri, create_schema=False)
+  assert sql.get_session(uri) is session
+  assert sql.get_engine(uri) is session.bind
+  assert sql.make_engine_session_factory(uri=uri)[0] is session.bind
+
+  other = sql.get_session("sqlite:///%s" % (tmpdir.join("b.db"),), create_schema=False)
+  assert other is not session
+  assert other.bind is not session.bind
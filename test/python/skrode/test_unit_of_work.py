@@ -0,0 +1,109 @@
+"""
+Tests covering batched commits.
+"""
+
+from time import sleep
+
+from skrode.unit_of_work import commit, UnitOfWork
+
+import pytest
+
+
+class Savepoint(object):
+  def __init__(self, session):
+    self.session = session
+
+  def commit(self):
+    if self.session.fail_flush:
+      raise ValueError("bad flush")
+
+  def rollback(self):
+    self.session.savepoint_rollbacks += 1
+
+
+class Session(object):
+  """Just enough of a SQLAlchemy session to count what is done to it."""
+
+  def __init__(self):
+    self.info = {}
+    self.commits = self.flushes = self.rollbacks = self.savepoint_rollbacks = 0
+    self.fail_flush = False
+
+  def begin_nested(self):
+    return Savepoint(self)
+
+  def commit(self):
+    self.commits += 1
+
+  def flush(self):
+    self.flushes += 1
+
+  def rollback(self):
+    self.rollbacks += 1
+
+
+def test_commit_outside_unit_of_work():
+  session = Session()
+  commit(session)
+  assert (session.commits, session.flushes) == (1, 0)
+
+
+def test_batches_by_size():
+  session = Session()
+  committed = []
+  with UnitOfWork(session, size=3, interval=60) as uow:
+    for event in range(7):
+      commit(session)
+      uow.done(on_commit=lambda event=event: committed.append(event))
+    assert session.flushes == 7
+    assert session.commits == 2
+    assert committed == list(range(6))
+
+  # The remainder is committed on exit
+  assert session.commits == 3
+  assert committed == list(range(7))
+  assert "skrode.unit_of_work" not in session.info
+
+
+def test_batches_by_time():
+  session = Session()
+  with UnitOfWork(session, size=100, interval=0.1) as uow:
+    uow.done()
+    uow.poll()
+    assert session.commits == 0
+    sleep(0.1)
+    uow.poll()
+    assert session.commits == 1
+
+
+def test_rollback_on_error():
+  session = Session()
+  rolled_back = []
+  with pytest.raises(ValueError):
+    with UnitOfWork(session) as uow:
+      uow.done(on_rollback=rolled_back.append)
+      raise ValueError("bad event")
+
+  assert (session.commits, session.rollbacks) == (0, 1)
+  assert rolled_back == ["ValueError: bad event"]
+
+
+def test_event_rolls_back_alone():
+  session = Session()
+  committed, rolled_back = [], []
+  with UnitOfWork(session) as uow:
+    with uow.event(on_commit=lambda: committed.append(1)):
+      pass
+
+    with pytest.raises(ValueError):
+      with uow.event(on_rollback=rolled_back.append):
+        raise ValueError("bad event")
+
+    session.fail_flush = True
+    with pytest.raises(ValueError):
+      with uow.event(on_rollback=rolled_back.append):
+        pass
+
+  assert (session.commits, session.rollbacks, session.savepoint_rollbacks) == (1, 0, 2)
+  assert committed == [1]
+  assert rolled_back == ["ValueError: bad event", "ValueError: bad flush"]